@@ -0,0 +1,79 @@
+'''
+Compare the native off-target search (pavooc.preprocessing.offtarget_search)
+with FlashFry discover on the exon FASTA files of some genes.
+
+Reports runtimes and the agreement of the guide sets, the otCounts and the
+off-target loci (Jaccard index per guide).
+
+usage: python misc/offtarget_benchmark.py [number of genes]
+'''
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from pavooc.config import EXON_DIR
+from pavooc.data import offtarget_index
+from pavooc.preprocessing import offtarget_search
+from pavooc.preprocessing.exon_guide_search import flashfry_guides
+
+KEY_COLUMNS = ['contig', 'start', 'orientation']
+
+
+def _loci(off_targets):
+    if not isinstance(off_targets, str):
+        return set()
+    # entries look like SEQUENCE_occurrences_mismatches<locus|locus|...>
+    return {locus for entry in off_targets.split(',')
+            for locus in entry[entry.index('<') + 1:-1].split('|')}
+
+
+def _timed(function, seq_file):
+    target_file = tempfile.NamedTemporaryFile(delete=False).name
+    start = time.time()
+    function(seq_file, target_file)
+    duration = time.time() - start
+    result = pd.read_csv(target_file, sep='\t')
+    os.remove(target_file)
+    return result, duration
+
+
+def compare(seq_file):
+    flashfry, flashfry_time = _timed(flashfry_guides, seq_file)
+    native, native_time = _timed(offtarget_search.discover, seq_file)
+    merged = flashfry.merge(native, on=KEY_COLUMNS, how='outer',
+                            suffixes=('_flashfry', '_native'),
+                            indicator=True)
+    both = merged[merged['_merge'] == 'both']
+    jaccard = [
+        len(a & b) / max(1, len(a | b)) for a, b in
+        zip(both['offTargets_flashfry'].map(_loci),
+            both['offTargets_native'].map(_loci))]
+    return {
+        'flashfry_time': flashfry_time,
+        'native_time': native_time,
+        'guides_flashfry': len(flashfry),
+        'guides_native': len(native),
+        'guides_shared': len(both),
+        'otcount_equal': (both['otCount_flashfry'] ==
+                          both['otCount_native']).mean(),
+        'loci_jaccard': np.mean(jaccard) if jaccard else np.nan,
+    }
+
+
+def main():
+    gene_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    genes = sorted(f for f in os.listdir(EXON_DIR) if '.' not in f)
+    offtarget_index()  # don't count the loading time
+    results = pd.DataFrame([compare(os.path.join(EXON_DIR, gene))
+                            for gene in genes[:gene_count]],
+                           index=genes[:gene_count])
+    print(results.to_string())
+    print(results.mean().to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -17,17 +17,43 @@ DEBUG = os.environ.get('DEBUG', 'True') in \
 GENOME = os.environ.get('GENOME', 'mm10')
 MOUSE_CHROMOSOMES = ['chr{}'.format(v) for v in range(1, 20)] + ['chrX', 'chrY']
 HUMAN_CHROMOSOMES = ['chr{}'.format(v) for v in range(1, 23)] + ['chrX', 'chrY']
-if DEBUG:
-    CHROMOSOMES = ['chrY']
-else:
-    if 'hg' in GENOME:
-        CHROMOSOMES = HUMAN_CHROMOSOMES
-    else:
-        CHROMOSOMES = MOUSE_CHROMOSOMES
+SUPPORTED_GENOMES = ['hg19', 'hg38', 'mm10']
+# genomes the API server serves side by side (see pavooc.registry)
+SERVER_GENOMES = os.environ.get('SERVER_GENOMES', 'hg19,mm10').split(',')
+
+
+def genome_chromosomes(genome):
+    '''
+    :returns: the chromosomes processed for a genome
+    '''
+    if DEBUG:
+        return ['chrY']
+    if 'hg' in genome:
+        return HUMAN_CHROMOSOMES
+    return MOUSE_CHROMOSOMES
+
+
+CHROMOSOMES = genome_chromosomes(GENOME)
 TRAIN_MODEL = os.environ.get('TRAIN_MODEL', 'False') in \
     ['True', 'true', '1', 'y', 'yes', 't']
 
 PROTOSPACER_POSITIONS_FILE = os.path.join(DATADIR, 'protospacer_positions.csv')
+PROTOSPACER_DIR = os.path.join(DATADIR, 'protospacers')
+# formatted with chromosome and column name
+PROTOSPACER_CATALOG_FILE = os.path.join(PROTOSPACER_DIR,
+                                        f'{GENOME}_{{}}_{{}}.npy')
+# formatted with genome, then with column name
+PROTOSPACER_INDEX_TEMPLATE = os.path.join(PROTOSPACER_DIR,
+                                          '{}_index_{{}}.npy')
+
+
+def protospacer_index_file(genome):
+    return PROTOSPACER_INDEX_TEMPLATE.format(genome)
+
+
+PROTOSPACER_INDEX_FILE = protospacer_index_file(GENOME)
+# versioned columnar snapshots of expensive DataFrames (see pavooc.snapshot)
+SNAPSHOT_DIR = os.path.join(DATADIR, 'snapshots')
 SIFTS_FILE = os.path.join(DATADIR, 'sifts', '{}')
 SIFTS_TARBALL = os.path.join(DATADIR, 'sifts.tar')
 
@@ -35,10 +61,21 @@ SIFTS_TARBALL = os.path.join(DATADIR, 'sifts.tar')
 GENCODE_HG19_FILE = os.path.join(DATADIR, 'gencode.v19.annotation.gtf')
 GENCODE_HG38_FILE = os.path.join(DATADIR, 'gencode.v30.annotation.gtf')
 GENCODE_MM10_FILE = os.path.join(DATADIR, 'gencode.vM21.annotation.gtf')
+GENCODE_FILES = {'hg19': GENCODE_HG19_FILE, 'hg38': GENCODE_HG38_FILE,
+                 'mm10': GENCODE_MM10_FILE}
 BIG_BED_EXE = os.path.join(DATADIR, 'bedToBigBed')
 CHROM_SIZES_FILE = os.path.join(DATADIR, f'{GENOME}.chrom.sizes')
 APPRIS_FILE = os.path.join(DATADIR, 'appris_data.principal.txt')
-PROTEIN_ID_MAPPING_FILE = os.path.join(DATADIR, f'{"HUMAN_9606" if "hg" in GENOME else "MOUSE_10090"}_idmapping.dat')
+# formatted with HUMAN_9606 or MOUSE_10090
+PROTEIN_ID_MAPPING_TEMPLATE = os.path.join(DATADIR, '{}_idmapping.dat')
+
+
+def protein_id_mapping_file(genome):
+    return PROTEIN_ID_MAPPING_TEMPLATE.format(
+        'HUMAN_9606' if 'hg' in genome else 'MOUSE_10090')
+
+
+PROTEIN_ID_MAPPING_FILE = protein_id_mapping_file(GENOME)
 PDB_LIST_FILE = os.path.join(DATADIR, 'pdb_chain_uniprot.csv')
 CONSERVATION_FEATURES_FILE = os.path.join(
     DATADIR, 'conservations_features.csv')
@@ -47,12 +84,26 @@ ACHILLES_CONSERVATION_FEATURES_FILE = os.path.join(
 
 CHROMOSOME_FILE = os.path.join(DATADIR, '{}.fa')
 CHROMOSOME_RAW_FILE = os.path.join(DATADIR, '{}.raw')
+# formatted with genome and chromosome
+CHROMOSOME_PACKED_FILE = os.path.join(DATADIR, '{}_{}.packed')
 EXON_DIR = os.path.join(DATADIR, 'exons/')
 GENOME_FILE = os.path.join(DATADIR, 'genome_{}.fa')
 GUIDES_FILE = os.path.join(EXON_DIR, '{}.guides')
 SCORES_FILE = os.path.join(EXON_DIR, '{}.guides.scores')
 MUTATIONS_FILE = os.path.join(DATADIR, 'ccle2maf_081117.txt')
 CNS_FILE = os.path.join(DATADIR, 'CCLE_copynumber_2013-12-03.seg.txt')
+# genome of the CCLE cellline data (MUTATIONS_FILE and CNS_FILE)
+CCLE_GENOME = 'hg19'
+CELLLINE_NAMES_FILE = os.path.join(BASEDIR, 'pavooc/server/celllines.txt')
+# formatted with genome
+PFAM_DOMAINS_TEMPLATE = os.path.join(DATADIR, 'ucscGenePfam_{}.txt')
+
+
+def pfam_domains_file(genome):
+    return PFAM_DOMAINS_TEMPLATE.format(genome)
+
+
+PFAM_DOMAINS_FILE = pfam_domains_file(GENOME)
 EXON_BED_FILE = os.path.join(DATADIR, f'exome_{GENOME}.bed')
 SINGLE_PDBS = os.path.join(DATADIR, 'pdbs', f'{GENOME}_{{}}.bed')
 PDB_BED_FILE = os.path.join(DATADIR, f'pdbs_{GENOME}.bed')
@@ -73,8 +124,35 @@ SCALER_FILE = os.path.join(DATADIR, 'scaler.pkl')
 FLASHFRY_EXE = 'FlashFry-assembly-1.7.5.jar'
 JAVA_RAM = os.environ.get('JAVA_RAM', '3')
 COMPUTATION_CORES = int(os.environ.get('COMPUTATION_CORES', '1'))
+# memory budget in bytes for all values cached by pavooc.util.memoize.
+# 0 means unlimited
+CACHE_MEMORY_BUDGET = int(os.environ.get('CACHE_MEMORY_BUDGET', '0'))
 FLASHFRY_TMP_DIR = os.path.join(DATADIR, 'flashfry_tmp')
-FLASHFRY_DB_FILE = os.path.join(DATADIR, 'flashfry_genome_db')
+# formatted with genome
+FLASHFRY_DB_TEMPLATE = os.path.join(DATADIR, 'flashfry_genome_db_{}')
+
+
+def flashfry_db_file(genome):
+    return FLASHFRY_DB_TEMPLATE.format(genome)
+
+
+FLASHFRY_DB_FILE = flashfry_db_file(GENOME)
+# 'flashfry' or 'native' (pavooc.preprocessing.offtarget_search)
+OFFTARGET_BACKEND = os.environ.get('OFFTARGET_BACKEND', 'flashfry')
+# off-target search of /api/edit. native searches the preloaded index in the
+# edit workers instead of starting FlashFry for every request
+EDIT_OFFTARGET_BACKEND = os.environ.get('EDIT_OFFTARGET_BACKEND', 'native')
+MAX_MISMATCH = 5
+MAXIMUM_OFF_TARGETS = 1500
+# genes per FlashFry discover run. Defaults to ~170 genes per GB of java heap
+# each worker gets (JAVA_RAM / COMPUTATION_CORES)
+FLASHFRY_BATCH_SIZE = int(os.environ.get(
+    'FLASHFRY_BATCH_SIZE',
+    max(1, int(170 * float(JAVA_RAM) / COMPUTATION_CORES))))
+
+# resident server processes running /api/edit (0 runs it in the request)
+EDIT_WORKERS = int(os.environ.get('EDIT_WORKERS', '2'))
+EDIT_TIMEOUT = int(os.environ.get('EDIT_TIMEOUT', '120'))  # seconds
 
 MONGO_HOST = os.getenv('MONGO_HOST', 'localhost')
 MONGO_PORT = int(os.getenv('MONGO_PORT', '27017'))
@@ -1,26 +1,34 @@
 '''
 Buffered data loading
 '''
+import gc
 import logging
+import multiprocessing
 import os
 import pickle
-from functools import lru_cache
-from itertools import chain
+from contextlib import contextmanager
 
+import numpy as np
 import pandas as pd
 # import torch
-from gtfparse import read_gtf_as_dataframe
-from intervaltree import IntervalTree
 from sklearn.externals import joblib
 
 import azimuth
-from pavooc.config import (APPRIS_FILE, BASEDIR, CHROMOSOME_RAW_FILE,
-                           CHROMOSOMES, CNS_FILE, DATADIR, GENCODE_HG19_FILE,
-                           GENCODE_HG38_FILE, GENCODE_MM10_FILE, GENOME,
+from pavooc.config import (APPRIS_FILE, CCLE_GENOME, CELLLINE_NAMES_FILE,
+                           CHROMOSOME_PACKED_FILE, CNS_FILE,
+                           COMPUTATION_CORES, DATADIR, GENCODE_FILES, GENOME,
                            MUTATIONS_FILE, PDB_LIST_FILE,
-                           PROTEIN_ID_MAPPING_FILE, SCALER_FILE)
+                           genome_chromosomes, pfam_domains_file,
+                           protein_id_mapping_file, protospacer_index_file,
+                           SCALER_FILE)
+from pavooc.genome import PackedChromosome
+from pavooc.gtf import read_gtf
+from pavooc.intervals import (build_interval_indexes, interval_snapshot,
+                              records)
+from pavooc.protospacer_index import OffTargetIndex, ProtospacerIndex
+from pavooc.snapshot import snapshot
 # from pavooc.scoring.models import CNN38
-from pavooc.util import buffer_return_value
+from pavooc.util import memoize
 
 logging.basicConfig(level=logging.INFO)
 
@@ -29,27 +37,45 @@ logging.basicConfig(level=logging.INFO)
 # out though?
 
 
-def _filter_best_transcript(gene):
-    appris_values = set(chain.from_iterable(gene.tag.apply(
-        lambda v: [x for x in v.split(',') if 'appris' in x]).values))
-    for appris_type in ['appris_principal',
-                        'appris_candidate_longest',
-                        'appris_candidate']:
-        if appris_type in appris_values:
-            transcript_id = gene[gene.tag.str.contains(
-                appris_type)].iloc[0].transcript_id
-            break
-    else:
-        transcript_id = gene[gene.feature == 'transcript'].transcript_id
-        # if len(transcript_id) > 1:
-        #     print(gene.gene_id.iloc[0])
-        transcript_id = transcript_id.iloc[0]
-
-    return gene[(gene.feature == 'gene') |
-                (gene.transcript_id == transcript_id)]
+APPRIS_PRIORITY = ['appris_principal',
+                   'appris_candidate_longest',
+                   'appris_candidate']
 
 
-@buffer_return_value
+def _select_best_transcripts(df):
+    '''
+    Keep the gene rows and the rows of the best transcript of every gene.
+
+    The best transcript is chosen by APPRIS tag priority. A gene gets the
+    first APPRIS type which one of its tags contains as a full tag. The first
+    row whose tag contains that type (as a substring) determines the
+    transcript. Genes without an APPRIS tag fall back to their first
+    transcript.
+    :returns: the selected rows, ordered by gene_id (stable)
+    '''
+    tag = df.tag.fillna('')
+    fallback = len(APPRIS_PRIORITY)
+    row_tier = np.full(len(df), fallback)
+    for tier, appris_type in reversed(list(enumerate(APPRIS_PRIORITY))):
+        row_tier[tag.str.contains(
+            f'(?:^|,){appris_type}(?:,|$)').values] = tier
+    gene_tier = pd.Series(row_tier, index=df.index).groupby(
+        df.gene_id.values).transform('min').values
+
+    candidate = (gene_tier == fallback) & (df.feature == 'transcript').values
+    for tier, appris_type in enumerate(APPRIS_PRIORITY):
+        candidate |= (gene_tier == tier) & \
+            tag.str.contains(appris_type, regex=False).values
+    best_transcripts = df[candidate].drop_duplicates('gene_id').set_index(
+        'gene_id').transcript_id
+
+    selected = df[(df.feature == 'gene').values |
+                  (df.transcript_id.values ==
+                   df.gene_id.map(best_transcripts).values)]
+    return selected.sort_values('gene_id', kind='mergesort')
+
+
+@memoize
 def pfam_mapping():
     df = pd.read_csv(os.path.join(DATADIR, 'pdb_pfam_mapping.txt'), sep='\t')
     df = df[['PFAM_ACC', 'PFAM_Name']].drop_duplicates()
@@ -57,26 +83,39 @@ def pfam_mapping():
     return df
 
 
-@buffer_return_value
+@memoize
 def pfam_pdb_mapping():
     df = pd.read_csv(os.path.join(DATADIR, 'pdb_pfam_mapping.txt'), sep='\t')
     return df
 
 
-@lru_cache()
+GENCODE_FEATURES = ['gene', 'transcript', 'exon', 'UTR']
+
+
+def _gencode_inputs(genome=GENOME):
+    return [GENCODE_FILES[genome], protein_id_mapping_file(genome)]
+
+
+def _gencode_key(genome=GENOME):
+    return genome_chromosomes(genome)
+
+
+@memoize
+# version 2: best transcript selection by APPRIS tags, pre-filtered GTF
+@snapshot('gencode', _gencode_inputs, _gencode_key, version=2)
 def read_gencode(genome=GENOME):
     '''
     Buffered gencode read with HAVANA/ENSEMBL merged
     Swissprot IDs are merged and start-end indexing is adjusted
     Returns relevant columns only
     Returns the gencode dataframe but with havana and ensembl merged
+    The result is snapshotted on disk (see pavooc.snapshot)
     '''
-    if genome == 'hg19':
-        df = read_gtf_as_dataframe(GENCODE_HG19_FILE)
-    elif genome == 'hg38':
-        df = read_gtf_as_dataframe(GENCODE_HG38_FILE)
-    elif genome == 'mm10':
-        df = read_gtf_as_dataframe(GENCODE_MM10_FILE)
+    # only protein_coding genes/transcripts/exons/UTRs are parsed at all
+    df = read_gtf(GENCODE_FILES[genome],
+                  features=GENCODE_FEATURES,
+                  seqnames=genome_chromosomes(genome),
+                  gene_types=['protein_coding'])
 
     df.exon_number = df.exon_number.apply(pd.to_numeric, errors='coerce')
     df.protein_id = df.protein_id.map(lambda v: v[:v.find('.')])
@@ -87,8 +126,8 @@ def read_gencode(genome=GENOME):
     # only take protein_coding genes/transcripts/exons
     df = df[
         (df['gene_type'] == 'protein_coding') &
-        (df['feature'].isin(['gene', 'transcript', 'exon', 'UTR'])) &
-        (df['seqname'].isin(CHROMOSOMES))]
+        (df['feature'].isin(GENCODE_FEATURES)) &
+        (df['seqname'].isin(genome_chromosomes(genome)))]
     # drop all transcripts and exons that have no protein_id
     df.drop(df.index[(df.protein_id == '') & (
         df.feature.isin(['exon', 'transcript', 'UTR']))], inplace=True)
@@ -99,7 +138,7 @@ def read_gencode(genome=GENOME):
     df.drop(df.index[non_basic_transcripts], inplace=True)
 
     # add swissprot id mappings
-    protein_id_mapping = load_protein_mapping()
+    protein_id_mapping = load_protein_mapping(genome)
     protein_id_mapping = protein_id_mapping[
         protein_id_mapping.ID_NAME == 'Ensembl_PRO'][
         ['swissprot_id', 'protein_id']]
@@ -129,8 +168,7 @@ def read_gencode(genome=GENOME):
     df.drop(df.index[~df.gene_id.isin(valid_genes)], inplace=True)
 
     # select best transcript
-    df = df.groupby('gene_id').apply(_filter_best_transcript)
-    df.reset_index(level=0, drop=True, inplace=True)
+    df = _select_best_transcripts(df)
 
     return df[[
         'feature', 'gene_id', 'transcript_id',
@@ -140,17 +178,17 @@ def read_gencode(genome=GENOME):
         'score', 'seqname', 'source']]
 
 
-@buffer_return_value
+@memoize
 def celllines():
-    with open(os.path.join(BASEDIR, 'pavooc/server/celllines.txt')) as f:
+    with open(CELLLINE_NAMES_FILE) as f:
         return [line.strip() for line in f.readlines()]
 
 
-def load_protein_mapping():
+def load_protein_mapping(genome=GENOME):
     # TODO  "P63104-1        Ensembl_PRO     ENSP00000309503"
     # is not recognized for example (due to the '-1')
     return pd.read_csv(
-        PROTEIN_ID_MAPPING_FILE,
+        protein_id_mapping_file(genome),
         sep='\t',
         header=None,
         names=['swissprot_id', 'ID_NAME', 'protein_id'],
@@ -158,56 +196,89 @@ def load_protein_mapping():
         index_col=False)
 
 
-def compute_canonical_exons(gene):
-    exons = gene[gene.feature == 'exon']
-    utrs = []
-    for index, row in gene[gene.feature == 'UTR'].iterrows():
-        utrs.extend(list(range(row.start, row.end)))
-    utrs = set(utrs)
+CANONICAL_EXON_COLUMNS = [
+    'seqname', 'start', 'end', 'strand', 'transcript_id', 'swissprot_id',
+    'gene_id', 'gene_name', 'exon_id', 'exon_number']
+# larger than any chromosome coordinate. (gene, position) pairs are encoded
+# as gene * _GENE_STRIDE + position to process all genes at once
+_GENE_STRIDE = 2 ** 32
 
-    sorted_exons = exons.sort_values('exon_number')
-    result_exons = []
 
-    for index, exon in sorted_exons.iterrows():
-        exon_positions = set(range(exon.start, exon.end))
-        filtered = (exon_positions - utrs)
-        try:
-            end = max(filtered) + 1
-            start = min(filtered)
-        except ValueError:
-            continue
-        else:
-            new_exon = exon.copy()
-            new_exon.start = start
-            new_exon.end = end
-            result_exons.append(new_exon)
-
-    df = pd.DataFrame(result_exons)
-    # df.index.name = 'exon_id'
-    try:
-        return df.reset_index()[[
-            'seqname', 'start', 'end', 'strand', 'transcript_id',
-            'swissprot_id', 'gene_id', 'gene_name', 'exon_id', 'exon_number']]
-    except KeyError:
-        logging.error(
-            f'fixme at data.py canonical_exons: {gene.iloc[0].gene_id}')
-        return
+def _merge_intervals(starts, ends):
+    '''
+    Merge overlapping and adjacent intervals
+    :starts, ends: int arrays, sorted by starts
+    :returns: tuple (starts, ends) of the merged intervals
+    '''
+    if len(starts) == 0:
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    first = np.concatenate([[True], starts[1:] > reach[:-1]])
+    last = np.concatenate([first[1:], [True]])
+    return starts[first], reach[last]
 
 
-@buffer_return_value
+def compute_canonical_exons(gencode):
+    '''
+    Cut the UTRs off the exons of all genes in one pass
+
+    Every exon is trimmed to the span from its first to its last base which
+    is not covered by a UTR of the same gene. Exons lying completely in UTRs
+    are dropped.
+    :gencode: DataFrame as returned by read_gencode
+    :returns: DataFrame with CANONICAL_EXON_COLUMNS, ordered by gene_id and
+        exon_number
+    '''
+    gene_codes, gene_ids = pd.factorize(gencode.gene_id)
+    offsets = gene_codes.astype(np.int64) * _GENE_STRIDE
+
+    is_utr = (gencode.feature == 'UTR').values
+    utr_starts = offsets[is_utr] + gencode.start.values[is_utr]
+    utr_ends = offsets[is_utr] + gencode.end.values[is_utr]
+    order = np.argsort(utr_starts, kind='mergesort')
+    utr_starts, utr_ends = _merge_intervals(utr_starts[order],
+                                            utr_ends[order])
+
+    def covering_utr(positions):
+        index = np.searchsorted(utr_starts, positions, side='right') - 1
+        covered = index >= 0
+        covered[covered] = positions[covered] < utr_ends[index[covered]]
+        return index, covered
+
+    is_exon = (gencode.feature == 'exon').values
+    exon_offsets = offsets[is_exon]
+    starts = exon_offsets + gencode.start.values[is_exon]
+    ends = exon_offsets + gencode.end.values[is_exon]
+
+    # a covered first base moves the start behind its (merged) UTR, a
+    # covered last base moves the end before its UTR
+    index, covered = covering_utr(starts)
+    starts[covered] = utr_ends[index[covered]]
+    index, covered = covering_utr(ends - 1)
+    ends[covered] = utr_starts[index[covered]]
+
+    exons = gencode[is_exon].copy()
+    exons['start'] = starts - exon_offsets
+    exons['end'] = ends - exon_offsets
+    exons = exons[starts < ends]
+
+    exons = exons.sort_values(['gene_id', 'exon_number'], kind='mergesort')
+    return exons[CANONICAL_EXON_COLUMNS].reset_index(drop=True)
+
+
+@memoize
+# version 2: canonical exons by interval subtraction
+@snapshot('gencode_exons', _gencode_inputs, _gencode_key, version=2)
 def gencode_exons(genome=GENOME):
     '''
 
     Return the protein-coding exons from gencode, indexed by exon_id
 
     Deletes UTR (untranslated region)
+    The result is snapshotted on disk (see pavooc.snapshot)
     :returns: DataFrame with unique exons
     '''
-    gencode = read_gencode(genome)
-
-    prepared = gencode.groupby('gene_id').apply(compute_canonical_exons)
-
-    return prepared.set_index('exon_id')
+    return compute_canonical_exons(read_gencode(genome)).set_index('exon_id')
 
     # OLD: (we now use simply appris principal)
     # # Use longest transcript only
@@ -222,51 +293,325 @@ def gencode_exons(genome=GENOME):
     #     longest_transcripts.index.get_level_values(1))]
 
 
-@buffer_return_value
-def cns_trees():
-    trees = {chromosome: IntervalTree() for chromosome in CHROMOSOMES}
-    df = pd.read_csv(CNS_FILE, sep='\t')
-    df.Chromosome = df.Chromosome.map(lambda c: f'chr{c}')
-    for _, cns in df.iterrows():
+class GeneIndex:
+    '''
+    gene_id keyed access to a DataFrame with one contiguous block of rows per
+    gene (like read_gencode and gencode_exons, which are ordered by gene_id).
+    Lookups are dict accesses and row slices instead of boolean scans over
+    the whole frame.
+    '''
+
+    def __init__(self, df):
+        starts = self._block_starts(df.gene_id.values)
+        if len(starts) != df.gene_id.nunique():
+            df = df.sort_values('gene_id', kind='mergesort')
+            starts = self._block_starts(df.gene_id.values)
+        self.df = df
+        self._positions = {gene_id: i for i, gene_id
+                           in enumerate(df.gene_id.values[starts])}
+        self._starts = starts
+        self._ends = np.append(starts[1:], len(df))
+
+        first_rows = df.iloc[starts]
+        self._names = first_rows.gene_name.values
+        self._strands = first_rows.strand.values
+        self._chromosomes = first_rows.seqname.values
+        self._lower = np.minimum.reduceat(df.start.values, starts) \
+            if len(starts) else starts
+        self._upper = np.maximum.reduceat(df.end.values, starts) \
+            if len(starts) else starts
+
+    @staticmethod
+    def _block_starts(gene_ids):
+        if len(gene_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(
+            np.concatenate([[True], gene_ids[1:] != gene_ids[:-1]]))
+
+    @property
+    def nbytes(self):
+        return int(self.df.memory_usage(index=True).sum())
+
+    def __contains__(self, gene_id):
+        return gene_id in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def rows(self, gene_id):
+        '''
+        :returns: DataFrame slice with all rows of the gene (empty if unknown)
+        '''
         try:
-            trees[cns.Chromosome][cns.Start - 1:
-                                  cns.End] = \
-                {'type': 2 * (2 ** cns.Segment_Mean),
-                 'cellline': cns.CCLE_name}
+            i = self._positions[gene_id]
         except KeyError:
-            pass
-    return trees
+            return self.df.iloc[0:0]
+        return self.df.iloc[self._starts[i]:self._ends[i]]
 
+    def name(self, gene_id):
+        return self._names[self._positions[gene_id]]
+
+    def strand(self, gene_id):
+        return self._strands[self._positions[gene_id]]
+
+    def chromosome(self, gene_id):
+        return self._chromosomes[self._positions[gene_id]]
+
+    def bounds(self, gene_id):
+        '''
+        :returns: tuple (minimal start, maximal end) over the rows of the gene
+        '''
+        i = self._positions[gene_id]
+        return int(self._lower[i]), int(self._upper[i])
+
+
+@memoize
+def gencode_gene_index(genome=GENOME):
+    '''
+    GeneIndex over read_gencode()
+    '''
+    return GeneIndex(read_gencode(genome))
+
+
+@memoize
+def exon_gene_index(genome=GENOME):
+    '''
+    GeneIndex over gencode_exons()
+    '''
+    return GeneIndex(gencode_exons(genome))
 
-@buffer_return_value
-def cellline_mutation_trees():
-    trees = {chromosome: IntervalTree() for chromosome in CHROMOSOMES}
-    df = pd.read_csv(MUTATIONS_FILE, sep='\t')
-    df.Chromosome = df.Chromosome.map(lambda c: f'chr{c}')
-    for _, mutation in df.iterrows():
-        try:
-            trees[mutation.Chromosome][mutation.Start_position - 1:
-                                       mutation.End_position] = \
-                {'type': mutation.Variant_Type,
-                 'cellline': mutation.Tumor_Sample_Barcode}
-        except KeyError:
-            pass
-    return trees
 
+def _name_stem(gene_name):
+    return gene_name[:-1]
 
-@buffer_return_value
-def exon_interval_trees():
+
+@snapshot('gene_name_stems', _gencode_inputs, _gencode_key)
+def gene_name_stems(genome=GENOME):
+    '''
+    All pairs (stem, gene_name) where the stem of one gene name (the name
+    without its last character) is a substring of another gene name.
+    Snapshotted along with read_gencode.
+    '''
+    names = read_gencode(genome).gene_name.dropna().drop_duplicates()
+    stems = set(names.map(_name_stem))
+    pairs = set()
+    for name in names:
+        for start in range(len(name)):
+            for end in range(start + 1, len(name) + 1):
+                if name[start:end] in stems:
+                    pairs.add((name[start:end], name))
+    return pd.DataFrame(sorted(pairs), columns=['stem', 'gene_name'])
+
+
+class GeneNameSimilarity:
+    '''
+    Isozyme/paralog heuristic on gene names: two genes are similar if the
+    name of one without its last character is contained in the name of the
+    other. Names with at most one character are similar to every gene.
+    '''
+
+    def __init__(self, gene_names, stems):
+        '''
+        :gene_names: callable, gene_id to gene name
+        :stems: DataFrame as returned by gene_name_stems
+        '''
+        self.gene_names = gene_names
+        self.containing = {stem: set(names) for stem, names in
+                           stems.groupby('stem').gene_name}
+
+    def names_similar(self, name_a, name_b):
+        if len(name_a) <= 1 or len(name_b) <= 1:
+            return True
+        return name_b in self.containing.get(_name_stem(name_a), ()) or \
+            name_a in self.containing.get(_name_stem(name_b), ())
+
+    def __call__(self, gene_a, gene_b):
+        return self.names_similar(self.gene_names(gene_a),
+                                  self.gene_names(gene_b))
+
+
+@memoize
+def gene_name_similarity(genome=GENOME):
     '''
-    Generate an exon interval tree
+    GeneNameSimilarity for all genes of read_gencode()
+    '''
+    return GeneNameSimilarity(gencode_gene_index(genome).name,
+                              gene_name_stems(genome))
+
+
+def encode_celllines(names):
+    '''
+    Encode cellline names as integer ids (positions in celllines())
+    :names: array-like of cellline names
+    :returns: int32 array. Celllines missing from celllines() get -1
+    '''
+    return pd.Index(celllines()).get_indexer(names).astype(np.int32)
+
+
+def decode_celllines(ids):
+    '''
+    Inverse of encode_celllines. Names are passed through unchanged, so
+    guide documents from before the id encoding can be decoded as well
+    :returns: list of cellline names
+    '''
+    names = celllines()
+    return [i if isinstance(i, str) else names[i] for i in ids]
+
+
+def _cellline_interval_indexes(genome, chromosomes, starts, ends,
+                               cellline_names, types):
+    '''
+    Build interval indexes with (type, cellline id) records. Rows of
+    celllines which are not offered by the server (see celllines()) are
+    dropped, they can't be selected anyways
+    '''
+    ids = encode_celllines(cellline_names)
+    known = ids >= 0
+    if not known.all():
+        logging.warning('Ignoring {} rows of unknown celllines'
+                        .format((~known).sum()))
+    return build_interval_indexes(
+        genome_chromosomes(genome), 'chr' + np.asarray(chromosomes)[known],
+        np.asarray(starts)[known], np.asarray(ends)[known],
+        records(type=np.asarray(types)[known], cellline=ids[known]))
+
+
+def _no_cellline_indexes(genome):
+    '''
+    Empty cellline interval indexes for genomes without CCLE data
+    '''
+    return build_interval_indexes(
+        genome_chromosomes(genome), np.zeros(0, dtype='U1'),
+        np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+        records(type=np.zeros(0, dtype='U1'),
+                cellline=np.zeros(0, dtype=np.int32)))
+
+
+def _ccle_inputs(ccle_file):
+    '''
+    :returns: input files function of a CCLE based loader (there are no
+        inputs for genomes other than CCLE_GENOME)
+    '''
+    def inputs(genome=GENOME):
+        if genome != CCLE_GENOME:
+            return []
+        return [ccle_file, CELLLINE_NAMES_FILE]
+    return inputs
+
+
+@memoize
+@interval_snapshot('cns_index', _ccle_inputs(CNS_FILE), _gencode_key)
+def cns_trees(genome=GENOME):
+    '''
+    Copy number segments. Payloads are records of (type, cellline id).
+    Empty for genomes other than CCLE_GENOME
+    '''
+    if genome != CCLE_GENOME:
+        return _no_cellline_indexes(genome)
+    df = pd.read_csv(
+        CNS_FILE, sep='\t',
+        usecols=['CCLE_name', 'Chromosome', 'Start', 'End', 'Segment_Mean'],
+        dtype={'CCLE_name': str, 'Chromosome': str, 'Start': np.int64,
+               'End': np.int64, 'Segment_Mean': np.float64})
+    return _cellline_interval_indexes(
+        genome, df.Chromosome.values, df.Start.values - 1, df.End.values,
+        df.CCLE_name.values, 2 * (2 ** df.Segment_Mean.values))
+
+
+@memoize
+@interval_snapshot('mutation_index', _ccle_inputs(MUTATIONS_FILE),
+                   _gencode_key)
+def cellline_mutation_trees(genome=GENOME):
+    '''
+    Cellline mutations from the CCLE MAF. Payloads are records of
+    (type, cellline id). Empty for genomes other than CCLE_GENOME
+    '''
+    if genome != CCLE_GENOME:
+        return _no_cellline_indexes(genome)
+    df = pd.read_csv(
+        MUTATIONS_FILE, sep='\t',
+        usecols=['Chromosome', 'Start_position', 'End_position',
+                 'Variant_Type', 'Tumor_Sample_Barcode'],
+        dtype={'Chromosome': str, 'Start_position': np.int64,
+               'End_position': np.int64, 'Variant_Type': str,
+               'Tumor_Sample_Barcode': str})
+    return _cellline_interval_indexes(
+        genome, df.Chromosome.values, df.Start_position.values - 1,
+        df.End_position.values, df.Tumor_Sample_Barcode.values,
+        df.Variant_Type.values)
+
+
+def _gene_cns_inputs(genome=GENOME):
+    return _gencode_inputs(genome) + _ccle_inputs(CNS_FILE)(genome)
+
+
+@memoize
+@snapshot('gene_cns', _gene_cns_inputs, _gencode_key)
+def gene_cns_affection(genome=GENOME):
+    '''
+    Join all gene spans (first exon start to last exon end) against the CCLE
+    copy number segments, with one batched interval query per chromosome.
+    The result is snapshotted on disk (see pavooc.snapshot)
+
+    :returns: DataFrame with unique (gene_id, cellline) pairs, cellline
+        being the cellline id (see encode_celllines), ordered by gene_id
+    '''
+    spans = gencode_exons(genome).groupby('gene_id', sort=True).agg(
+        seqname=('seqname', 'first'), start=('start', 'min'),
+        end=('end', 'max'))
+    trees = cns_trees(genome)
+
+    tables = []
+    for chromosome, genes in spans.groupby('seqname', sort=False):
+        if chromosome not in trees:
+            continue
+        index = trees[chromosome]
+        gene_numbers, segments = index.query_ranges(genes.start.values,
+                                                    genes.end.values)
+        tables.append(pd.DataFrame({
+            'gene_id': genes.index.values[gene_numbers],
+            'cellline': index.data['cellline'][segments].astype(np.int32)}))
+
+    if not tables:
+        return pd.DataFrame({'gene_id': pd.Series([], dtype=object),
+                             'cellline': pd.Series([], dtype=np.int32)})
+    return pd.concat(tables, ignore_index=True) \
+        .drop_duplicates() \
+        .sort_values(['gene_id', 'cellline'], kind='mergesort') \
+        .reset_index(drop=True)
+
+
+@memoize
+def gene_cns_celllines(genome=GENOME):
+    '''
+    :returns: dict of gene_id to the list of cellline ids of
+        gene_cns_affection. Genes without CNS are missing
+    '''
+    table = gene_cns_affection(genome)
+    gene_ids = table.gene_id.values
+    celllines = table.cellline.values.tolist()
+    starts = np.flatnonzero(
+        np.concatenate([[True], gene_ids[1:] != gene_ids[:-1]])) \
+        if len(gene_ids) else np.zeros(0, dtype=np.int64)
+    ends = np.append(starts[1:], len(gene_ids))
+    return {gene_ids[start]: celllines[start:end]
+            for start, end in zip(starts, ends)}
+
+
+@memoize
+@interval_snapshot('exon_index', _gencode_inputs, _gencode_key)
+def exon_interval_trees(genome=GENOME):
+    '''
+    Generate an exon interval index (see pavooc.intervals)
     '''
     logging.info('Building exon tree')
-    trees = {chromosome: IntervalTree() for chromosome in CHROMOSOMES}
-    relevant_exons = gencode_exons()
-    for _, row in relevant_exons.iterrows():
-        if row['end'] > row['start']:
-            # end is included, start count at 0 instead of 1
-            trees[row['seqname']][row['start'] - 1:row['end']
-                                  ] = (row['gene_id'], row['exon_number'])
+    exons = gencode_exons(genome)
+    exons = exons[exons.end > exons.start]
+    # end is included, start count at 0 instead of 1
+    trees = build_interval_indexes(
+        genome_chromosomes(genome), exons.seqname, exons.start - 1,
+        exons.end, records(gene_id=exons.gene_id.values,
+                           exon_number=exons.exon_number.values))
 
     logging.info('Built exon tree with {} nodes'
                  .format(sum([len(tree) for tree in trees.values()])))
@@ -274,28 +619,48 @@ def exon_interval_trees():
     return trees
 
 
-@buffer_return_value
+@memoize
 def pdb_list():
     df = pd.read_csv(PDB_LIST_FILE, sep=',', skiprows=1, index_col=False)
     return df[['PDB', 'CHAIN', 'SP_PRIMARY']]
 
 
-@buffer_return_value
-def chromosomes():
+@memoize
+def chromosomes(genome=GENOME):
     '''
-    Return dictionary with loaded chromosome data
+    Return dictionary with memory-mapped chromosome data. Slicing a chromosome
+    returns an upper case str (see pavooc.genome)
     '''
     return {
-        c: open(CHROMOSOME_RAW_FILE.format(c)).read()
-        for c in CHROMOSOMES}
+        c: PackedChromosome(CHROMOSOME_PACKED_FILE.format(genome, c))
+        for c in genome_chromosomes(genome)}
+
+
+@memoize
+def protospacer_index(genome=GENOME):
+    '''
+    Memory-mapped index of all genome protospacers and their counts. Built by
+    pavooc.preprocessing.sgrna_finder
+    '''
+    return ProtospacerIndex.load(protospacer_index_file(genome))
+
+
+@memoize
+def offtarget_index(genome=GENOME):
+    '''
+    Memory-mapped protospacer index including the genome loci and the half
+    bucket tables for mismatch search (see
+    pavooc.preprocessing.offtarget_search)
+    '''
+    return OffTargetIndex.load(protospacer_index_file(genome))
 
 
-@buffer_return_value
+@memoize
 def feature_scaler():
     return joblib.load(SCALER_FILE)
 
 
-@buffer_return_value
+@memoize
 def azimuth_model(nopos=False):
     azimuth_saved_model_dir = os.path.join(
         os.path.dirname(azimuth.__file__),
@@ -310,34 +675,48 @@ def azimuth_model(nopos=False):
         return pickle.load(f)
 
 
-@buffer_return_value
-def domain_interval_trees():
+@memoize
+@interval_snapshot('domain_index',
+                   lambda genome=GENOME: [pfam_domains_file(genome)],
+                   _gencode_key)
+def domain_interval_trees(genome=GENOME):
     '''
     Generate interval trees for all domains from Pfam
     '''
     logging.info('Building domain tree')
-    trees = {chromosome: IntervalTree() for chromosome in CHROMOSOMES}
     domains = pd.read_csv(
-        os.path.join(DATADIR, 'ucscGenePfam.txt'),
+        pfam_domains_file(genome),
         sep='\t',
         header=None,
         names=[
             'bin', 'chrom', 'chromStart', 'chromEnd', 'name', 'score',
             'strand', 'thickStart', 'thickEnd', 'reserved', 'blockCount',
             'blockSizes', 'chromStarts'],
+        usecols=['chrom', 'chromStart', 'chromEnd', 'name', 'strand',
+                 'blockSizes', 'chromStarts'],
+        dtype={'chrom': str, 'chromStart': np.int64, 'chromEnd': np.int64,
+               'name': str, 'strand': str, 'blockSizes': str,
+               'chromStarts': str},
         index_col=False)
 
-    domains = domains[domains['chrom'].isin(CHROMOSOMES)]
-
-    for _, row in domains.iterrows():
-        if row['chromEnd'] > row['chromStart']:
-            for local_start, block_size in zip(
-                    row['chromStarts'].split(',')[:-1],
-                    row['blockSizes'].split(',')[:-1]):
-                # TODO, DELETE, strand is for verification only
-                trees[row['chrom']][
-                    row['chromStart'] + int(local_start):
-                    row['chromStart'] + int(local_start) + int(block_size)] = (row['name'], row['strand'])
+    domains = domains[domains['chrom'].isin(genome_chromosomes(genome)) &
+                      (domains['chromEnd'] > domains['chromStart'])]
+
+    # one row per block. Every block list has a trailing comma, so the
+    # concatenated lists can be parsed in one go
+    block_counts = domains['chromStarts'].str.count(',').values
+    blocks = domains.iloc[np.repeat(np.arange(len(domains)), block_counts)]
+    local_starts = np.array(
+        ''.join(domains['chromStarts']).split(',')[:-1]).astype(np.int64)
+    block_sizes = np.array(
+        ''.join(domains['blockSizes']).split(',')[:-1]).astype(np.int64)
+    starts = blocks['chromStart'].values + local_starts
+    ends = starts + block_sizes
+
+    # TODO, DELETE, strand is for verification only
+    trees = build_interval_indexes(
+        genome_chromosomes(genome), blocks['chrom'].values, starts, ends,
+        records(name=blocks['name'].values, strand=blocks['strand'].values))
 
     logging.info('Built domain tree with {} nodes'
                  .format(sum([len(tree) for tree in trees.values()])))
@@ -345,7 +724,7 @@ def domain_interval_trees():
     return trees
 
 
-@buffer_return_value
+@memoize
 def cnn38_model():
     model = CNN38(160)
     model.load_state_dict(torch.load(os.path.join(DATADIR, 'cnn38.torch')))
@@ -353,7 +732,7 @@ def cnn38_model():
 
 
 # TODO delete
-@buffer_return_value
+@memoize
 def read_appris():
     return pd.read_csv(
         APPRIS_FILE,
@@ -361,3 +740,43 @@ def read_appris():
         header=None,
         names=['gene_symbol', 'gene_id', 'transcript_id', 'ccds_id', 'type'],
         index_col=False).set_index('gene_id')
+
+
+def preload(loaders):
+    '''
+    Call the given (buffered) loaders once in the current process and freeze
+    the garbage collector afterwards.
+
+    Worker processes forked afterwards inherit the loaded data instead of
+    loading it again. What they share depends on how the data is held:
+
+    - the genome, the interval indexes and the numeric columns of
+      snapshotted frames are memory-mapped (see pavooc.snapshot), their
+      pages are shared through the page cache
+    - Python objects (e.g. the str columns of frames) are shared until they
+      are touched. Freezing moves them into the permanent generation, so the
+      garbage collector of the workers doesn't write to them, but reference
+      counting still copies the pages a worker reads from
+    '''
+    for loader in loaders:
+        logging.info(f'Preloading {loader.__name__}')
+        loader()
+    if hasattr(gc, 'freeze'):  # python >= 3.7
+        gc.collect()
+        gc.freeze()
+
+
+@contextmanager
+def preloaded_pool(loaders, processes=COMPUTATION_CORES):
+    '''
+    Preload the given loaders and fork a worker pool sharing their data.
+    The garbage collector is unfrozen again when the pool is closed
+    :returns: context manager yielding a multiprocessing Pool
+    '''
+    preload(loaders)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            yield pool
+    finally:
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
@@ -27,7 +27,6 @@ ESSENTIAL_URLS = [
     'ftp://ftp.ebi.ac.uk/pub/databases/Pfam/mappings/pdb_pfam_mapping.txt',
     'ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_sprot.dat.gz',  # noqa
     'ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_sprot_varsplic.fasta.gz',  # noqa
-    f'ftp://hgdownload.cse.ucsc.edu/goldenPath/{GENOME}/database/ucscGenePfam.txt.gz',  # noqa
     'http://hgdownload.cse.ucsc.edu/admin/exe/linux.x86_64/bedToBigBed',
     f'http://hgdownload.cse.ucsc.edu/goldenPath/{GENOME}/bigZips/{GENOME}.chrom.sizes',
     'http://portals.broadinstitute.org/achilles/datasets/19/download/guide_activity_scores.tsv',  # noqa
@@ -200,6 +199,10 @@ def main(only_init=False):
 
     for url in urls:
         download_unzip(url)
+    # Pfam domains are kept per genome (see pavooc.config.pfam_domains_file)
+    download_unzip(
+        f'ftp://hgdownload.cse.ucsc.edu/goldenPath/{GENOME}/database/ucscGenePfam.txt.gz',  # noqa
+        f'_{GENOME}')
 
     download_sifts()
 
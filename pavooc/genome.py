@@ -0,0 +1,254 @@
+'''
+2-bit packed, memory-mapped chromosome sequences
+
+Every base is stored in two bits (A=0, C=1, G=2, T=3, the same code as
+pavooc.util.kmer_to_int), four bases per byte with the first base in the
+highest bits. Stretches of non-ACGT bases are stored separately as N-blocks.
+Soft-masking (lower case) is not retained, all sequences come out in upper
+case.
+
+File layout (little endian):
+    magic (4 bytes), version (uint32), length (uint64), n_block_count (uint64)
+    n_block_starts (uint64 * n_block_count)
+    n_block_ends (uint64 * n_block_count)
+    packed bases (uint8 * ceil(length / 4))
+'''
+import numpy as np
+
+MAGIC = b'PVC2'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'),
+                         ('length', '<u8'), ('n_block_count', '<u8')])
+
+# code used for N (and every other non-ACGT base) in unpacked arrays
+N_CODE = 4
+ALPHABET = np.frombuffer(b'ACGTN', dtype=np.uint8)
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+_ENCODING = np.full(256, N_CODE, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+    _ENCODING[_base] = _code
+    _ENCODING[ord(chr(_base).lower())] = _code
+
+
+def encode_bases(sequence):
+    '''
+    Translate a DNA sequence into an array of base codes
+    :sequence: str or bytes, case insensitive
+    :returns: uint8 array with values 0-3 for ACGT and N_CODE for the rest
+    '''
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    return _ENCODING[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def decode_bases(codes):
+    '''
+    Inverse of encode_bases
+    :returns: upper case str
+    '''
+    return ALPHABET[codes].tobytes().decode('ascii')
+
+
+def pack_codes(codes):
+    '''
+    Pack base codes four per byte. N codes are packed as A (0), they are
+    restored from the N-blocks
+    '''
+    padded = np.zeros(4 * ((len(codes) + 3) // 4), dtype=np.uint8)
+    padded[:len(codes)] = codes & 3
+    padded = padded.reshape(-1, 4) << _SHIFTS
+    return np.bitwise_or.reduce(padded, axis=1).astype(np.uint8)
+
+
+def n_blocks(codes):
+    '''
+    :returns: tuple (starts, ends) of all stretches of N_CODE in codes
+    '''
+    is_n = np.concatenate([[False], codes == N_CODE, [False]])
+    changes = np.flatnonzero(is_n[1:] != is_n[:-1])
+    return (changes[::2].astype(np.uint64),
+            changes[1::2].astype(np.uint64))
+
+
+def write_packed_chromosome(filename, sequence):
+    '''
+    Save a chromosome sequence in the 2-bit packed format
+    :sequence: str or bytes of the plain chromosome (no header, no newlines)
+    '''
+    codes = encode_bases(sequence)
+    starts, ends = n_blocks(codes)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['length'] = len(codes)
+    header['n_block_count'] = len(starts)
+
+    with open(filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(starts.astype('<u8').tobytes())
+        f.write(ends.astype('<u8').tobytes())
+        f.write(pack_codes(codes).tobytes())
+
+
+class PackedChromosome:
+    '''
+    Read-only, memory-mapped view of a packed chromosome
+
+    Slicing behaves like slicing the plain chromosome str (it returns
+    upper case str), but only the requested bytes are touched.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{filename} is not a packed chromosome file')
+        if header['version'][0] != VERSION:
+            raise ValueError('{} has version {}, expected {}'.format(
+                filename, header['version'][0], VERSION))
+
+        self.length = int(header['length'][0])
+        block_count = int(header['n_block_count'][0])
+        offset = HEADER_DTYPE.itemsize
+        self.n_starts = np.memmap(filename, dtype='<u8', mode='r',
+                                  offset=offset, shape=(block_count,)) \
+            .astype(np.int64) if block_count else np.zeros(0, np.int64)
+        offset += 8 * block_count
+        self.n_ends = np.memmap(filename, dtype='<u8', mode='r',
+                                offset=offset, shape=(block_count,)) \
+            .astype(np.int64) if block_count else np.zeros(0, np.int64)
+        offset += 8 * block_count
+        self.packed = np.memmap(filename, dtype=np.uint8, mode='r',
+                                offset=offset,
+                                shape=((self.length + 3) // 4,))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.n_starts.nbytes + self.n_ends.nbytes
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return decode_bases(
+                    self.gather(np.arange(start, stop, step)))
+            return decode_bases(self.codes(start, stop))
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError('chromosome index out of range')
+        return decode_bases(self.codes(key, key + 1))
+
+    def codes(self, start, end):
+        '''
+        Unpack a contiguous region
+        :returns: uint8 array of base codes for [start, end)
+        '''
+        start = max(0, start)
+        end = min(self.length, end)
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+        first_byte = start // 4
+        data = np.asarray(self.packed[first_byte:(end + 3) // 4])
+        codes = ((data[:, None] >> _SHIFTS) & 3).reshape(-1)
+        codes = codes[start - 4 * first_byte:end - 4 * first_byte]
+
+        first = np.searchsorted(self.n_ends, start, side='right')
+        last = np.searchsorted(self.n_starts, end, side='left')
+        for block_start, block_end in zip(self.n_starts[first:last],
+                                          self.n_ends[first:last]):
+            codes[max(block_start, start) - start:
+                  min(block_end, end) - start] = N_CODE
+        return codes
+
+    def gather(self, positions):
+        '''
+        Look up the bases at arbitrary positions in one vectorized pass
+        :positions: integer array of any shape
+        :returns: uint8 code array of the same shape. Positions outside of the
+            chromosome are returned as N_CODE
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        valid = (positions >= 0) & (positions < self.length)
+        clipped = np.where(valid, positions, 0)
+        shifts = (6 - 2 * (clipped & 3)).astype(np.uint8)
+        codes = (np.asarray(self.packed[clipped >> 2]) >> shifts) & 3
+
+        codes[~valid] = N_CODE
+        if len(self.n_starts):
+            block = np.searchsorted(self.n_starts, clipped, side='right') - 1
+            in_block = (block >= 0) & \
+                (clipped < self.n_ends[np.maximum(block, 0)])
+            codes[in_block] = N_CODE
+        return codes.astype(np.uint8)
+
+
+# complement of every base code (index with a code array)
+COMPLEMENT = np.array([3, 2, 1, 0, N_CODE], dtype=np.uint8)
+
+
+def reverse_complement_codes(codes):
+    '''
+    Reverse complement code arrays along their last axis (N stays N)
+    '''
+    return COMPLEMENT[codes[..., ::-1]]
+
+
+def codes_to_strings(codes):
+    '''
+    Decode a 2D code array into an array of equally long str
+    '''
+    codes = np.ascontiguousarray(ALPHABET[codes])
+    return codes.view('S{}'.format(codes.shape[1])).ravel().astype(
+        'U{}'.format(codes.shape[1]))
+
+
+def extract_contexts(chromosomes, chromosome_names, starts, orientations,
+                     before=4, after=3):
+    '''
+    Extract the azimuth compliant contexts (4bp + protospacer + PAM + 3bp =
+    30mers) of many guides in one vectorized pass per chromosome
+
+    :chromosomes: dict of PackedChromosome (see pavooc.data.chromosomes)
+    :chromosome_names: chromosome of each guide
+    :starts: forward-strand start of each 23bp target (protospacer + PAM)
+    :orientations: 'FWD' or 'RVS' for each guide
+    :returns: array of str in guide direction. Bases outside the chromosome
+        are returned as N
+    '''
+    chromosome_names = np.asarray(chromosome_names)
+    starts = np.asarray(starts, dtype=np.int64)
+    reverse = np.asarray(orientations) == 'RVS'
+    length = before + 23 + after
+
+    # for RVS guides, 'before' lies on the right side in forward direction
+    offsets = np.where(reverse, starts - after, starts - before)
+    positions = offsets[:, None] + np.arange(length)
+
+    codes = np.full((len(starts), length), N_CODE, dtype=np.uint8)
+    for name in np.unique(chromosome_names):
+        rows = chromosome_names == name
+        codes[rows] = chromosomes[name].gather(positions[rows])
+    codes[reverse] = reverse_complement_codes(codes[reverse])
+
+    return codes_to_strings(codes)
+
+
+def invalid_pams(contexts, pam_offset=25):
+    '''
+    Bulk PAM validation of contexts as returned by extract_contexts
+    :returns: boolean array, True for every context without GG at the PAM
+        position
+    '''
+    contexts = np.asarray(contexts, dtype='U')
+    if len(contexts) == 0:
+        return np.zeros(0, dtype=bool)
+    characters = contexts.view(np.uint32).reshape(len(contexts), -1)
+    if characters.shape[1] < pam_offset + 2:
+        return np.ones(len(contexts), dtype=bool)
+    return ~np.all(characters[:, pam_offset:pam_offset + 2] == ord('G'),
+                   axis=1)
@@ -0,0 +1,79 @@
+'''
+Streaming GTF reader
+
+Unlike gtfparse.read_gtf_as_dataframe, rows are filtered while the file is
+parsed and only the requested attributes are decoded, so the discarded rows
+(most of GENCODE) never become Python objects or DataFrame rows.
+'''
+import gzip
+import re
+
+import numpy as np
+import pandas as pd
+
+GTF_COLUMNS = ['seqname', 'source', 'feature', 'start', 'end', 'score',
+               'strand', 'frame']
+GENCODE_ATTRIBUTES = ['gene_id', 'transcript_id', 'exon_id', 'exon_number',
+                      'gene_name', 'gene_type', 'transcript_type', 'tag',
+                      'protein_id']
+# values are quoted, except for numbers like exon_number in GENCODE
+_ATTRIBUTE = re.compile(r'(\w+) "?([^";]*)"?;')
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename)
+
+
+def read_gtf(filename, features=None, seqnames=None, gene_types=None,
+             attributes=GENCODE_ATTRIBUTES):
+    '''
+    Read the rows of a (optionally gzipped) GTF file which pass all filters
+
+    :features: collection of features to keep (e.g. {'gene', 'exon'}) or None
+    :seqnames: collection of sequence names to keep or None
+    :gene_types: collection of gene_type attribute values to keep or None
+    :attributes: attributes to decode into columns. Missing attributes are
+        returned as '', repeated attributes (like tag) are joined with ','
+    :returns: DataFrame with GTF_COLUMNS and the attribute columns, in the
+        same format as gtfparse.read_gtf_as_dataframe
+    '''
+    features = set(features) if features is not None else None
+    seqnames = set(seqnames) if seqnames is not None else None
+    type_markers = ['gene_type "{}"'.format(gene_type)
+                    for gene_type in gene_types] \
+        if gene_types is not None else None
+    wanted = set(attributes)
+
+    columns = {column: [] for column in GTF_COLUMNS + list(attributes)}
+    with _open(filename) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t', 8)
+            if len(fields) < 9:
+                continue
+            if seqnames is not None and fields[0] not in seqnames:
+                continue
+            if features is not None and fields[2] not in features:
+                continue
+            if type_markers is not None and \
+                    not any(marker in fields[8] for marker in type_markers):
+                continue
+
+            values = {}
+            for key, value in _ATTRIBUTE.findall(fields[8]):
+                if key in wanted:
+                    values[key] = values[key] + ',' + value \
+                        if key in values else value
+            for column, value in zip(GTF_COLUMNS, fields):
+                columns[column].append(value)
+            for attribute in attributes:
+                columns[attribute].append(values.get(attribute, ''))
+
+    df = pd.DataFrame(columns)
+    df['start'] = df['start'].astype(np.int64)
+    df['end'] = df['end'].astype(np.int64)
+    df['score'] = pd.to_numeric(df['score'], errors='coerce')
+    return df
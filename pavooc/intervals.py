@@ -0,0 +1,217 @@
+'''
+Array-backed interval index
+
+Replacement for intervaltree.IntervalTree. Intervals are half-open
+[start, end) and stored in numpy arrays sorted by start, along with the
+running maximum of their ends. Overlap queries for many points or ranges
+are answered in one vectorized pass.
+
+Payloads are numpy arrays (structured arrays for records), so a query
+result like `interval[2]['cellline']` or `interval[2][0]` works just like
+with the dict and tuple payloads of IntervalTree.
+
+Indexes are persisted as plain .npy arrays (see interval_snapshot) and
+loaded memory-mapped.
+'''
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from pavooc.snapshot import META_FILE, snapshot
+from pavooc.util import expand_ranges
+
+Interval = namedtuple('Interval', ['begin', 'end', 'data'])
+
+# increment when the on-disk format changes
+INDEX_FORMAT_VERSION = 1
+_ARRAYS = ['starts', 'ends', 'max_ends', 'data']
+
+
+class IntervalIndex:
+    '''
+    Static set of intervals supporting batch overlap queries
+    '''
+
+    def __init__(self, starts, ends, data=None):
+        '''
+        :starts, ends: integer arrays. Empty intervals (end <= start) are
+            dropped like IntervalTree rejects them
+        :data: array with one payload per interval or None
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        valid = ends > starts
+        order = np.argsort(starts[valid], kind='mergesort')
+        self.starts = starts[valid][order]
+        self.ends = ends[valid][order]
+        self.data = np.asarray(data)[valid][order] \
+            if data is not None else None
+        self.max_ends = np.maximum.accumulate(self.ends) \
+            if len(self.ends) else self.ends
+
+    @classmethod
+    def from_arrays(cls, starts, ends, max_ends, data=None):
+        '''
+        Wrap arrays of an already built index (e.g. memory-mapped ones)
+        without copying or sorting them
+        '''
+        index = cls.__new__(cls)
+        index.starts = starts
+        index.ends = ends
+        index.max_ends = max_ends
+        index.data = data
+        return index
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.ends.nbytes + self.max_ends.nbytes + \
+            (self.data.nbytes if self.data is not None else 0)
+
+    def query_ranges(self, starts, ends):
+        '''
+        Find all intervals overlapping the half-open query ranges
+        :returns: tuple of arrays (query indices, interval indices)
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        # intervals starting before the query end...
+        upper = np.searchsorted(self.starts, ends, side='left')
+        # ...after the first one reaching behind the query start
+        lower = np.searchsorted(self.max_ends, starts, side='right')
+        counts = np.maximum(upper - lower, 0)
+
+        queries = np.repeat(np.arange(len(starts)), counts)
+        candidates = expand_ranges(lower, counts)
+        overlapping = self.ends[candidates] > starts[queries]
+        return queries[overlapping], candidates[overlapping]
+
+    def query_points(self, positions):
+        '''
+        Find all intervals containing the positions
+        :returns: tuple of arrays (query indices, interval indices)
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.query_ranges(positions, positions + 1)
+
+    def intervals(self, indices):
+        '''
+        :returns: list of Interval (begin, end, data) for interval indices
+        '''
+        return [Interval(int(self.starts[i]), int(self.ends[i]),
+                         self.data[i] if self.data is not None else None)
+                for i in indices]
+
+    def __getitem__(self, key):
+        '''
+        IntervalTree compatible lookup: index[position] or index[start:end]
+        :returns: list of Interval
+        '''
+        if isinstance(key, slice):
+            _, indices = self.query_ranges([key.start], [key.stop])
+        else:
+            _, indices = self.query_points([key])
+        return self.intervals(indices)
+
+
+def records(**columns):
+    '''
+    Build a payload array of records, e.g. records(type=..., cellline=...).
+    Fields can be accessed by name and by position. str columns are stored
+    as fixed width unicode
+    '''
+    arrays = []
+    for values in columns.values():
+        values = np.asarray(values)
+        if values.dtype.kind == 'O':
+            values = values.astype(str)
+        arrays.append(values)
+    return np.rec.fromarrays(arrays, names=list(columns))
+
+
+def save_interval_indexes(indexes, directory):
+    '''
+    Save a dict of chromosome name to IntervalIndex, one .npy file per array
+    '''
+    os.makedirs(directory, exist_ok=True)
+    names = list(indexes)
+    for i, name in enumerate(names):
+        for array in _ARRAYS:
+            values = getattr(indexes[name], array)
+            if values is not None:
+                np.save(os.path.join(directory, f'{i}.{array}.npy'),
+                        np.asarray(values))
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump({'version': INDEX_FORMAT_VERSION,
+                   'chromosomes': names}, f)
+
+
+def load_interval_indexes(directory, mmap_mode='r'):
+    '''
+    Inverse of save_interval_indexes. The arrays are memory-mapped read-only
+    by default, so all processes loading the same indexes share their pages
+    '''
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    if meta['version'] != INDEX_FORMAT_VERSION:
+        raise ValueError('Interval index {} has format version {}, expected {}'
+                         .format(directory, meta['version'],
+                                 INDEX_FORMAT_VERSION))
+
+    indexes = {}
+    for i, name in enumerate(meta['chromosomes']):
+        arrays = {}
+        for array in _ARRAYS:
+            filename = os.path.join(directory, f'{i}.{array}.npy')
+            arrays[array] = np.load(filename, mmap_mode=mmap_mode) \
+                if os.path.exists(filename) else None
+        indexes[name] = IntervalIndex.from_arrays(**arrays)
+    return indexes
+
+
+def interval_snapshot(name, files, extra=lambda *args, **kwargs: (),
+                      version=1):
+    '''
+    Snapshot decorator for functions returning dicts of IntervalIndex (see
+    pavooc.snapshot.snapshot for the arguments). Snapshots are memory-mapped
+    read-only, so all processes loading them share the same pages
+    '''
+    return snapshot(
+        name, files,
+        lambda *args, **kwargs: (INDEX_FORMAT_VERSION,) +
+        tuple(extra(*args, **kwargs)), version=version,
+        save=save_interval_indexes, load=load_interval_indexes)
+
+
+def build_interval_indexes(chromosome_names, chromosomes, starts, ends,
+                           data=None):
+    '''
+    Build one IntervalIndex per chromosome
+
+    :chromosome_names: chromosomes to build indexes for (intervals on other
+        chromosomes are ignored)
+    :chromosomes, starts, ends, data: one entry per interval
+    :returns: dict of chromosome name to IntervalIndex
+    '''
+    chromosome_names = list(chromosome_names)
+    codes = pd.Index(chromosome_names).get_indexer(chromosomes)
+    # group the rows by chromosome with one stable sort
+    order = np.argsort(codes, kind='mergesort')
+    boundaries = np.searchsorted(codes[order],
+                                 np.arange(len(chromosome_names) + 1))
+    starts = np.asarray(starts)[order]
+    ends = np.asarray(ends)[order]
+    data = np.asarray(data)[order] if data is not None else None
+
+    indexes = {}
+    for code, name in enumerate(chromosome_names):
+        rows = slice(boundaries[code], boundaries[code + 1])
+        indexes[name] = IntervalIndex(
+            starts[rows], ends[rows],
+            data[rows] if data is not None else None)
+    return indexes
@@ -8,6 +8,7 @@ from pavooc.config import (BIG_BED_EXE, CHROM_SIZES_FILE, CNS_BED_FILE,
                            DATADIR, DOMAIN_BED_FILE, EXON_BED_FILE, GENOME,
                            GUIDE_BED_FILE, MONGO_HOST, MONGO_PORT,
                            MUTATION_BED_FILE, PDB_BED_FILE, TRAIN_MODEL)
+from pavooc.data import gene_cns_affection
 from pavooc.data_integration.downloader import main as main_downloader
 from pavooc.preprocessing.exon_guide_search import main as main_guide_search
 from pavooc.preprocessing.extract_conservation_scores import \
@@ -21,6 +22,8 @@ from pavooc.preprocessing.generate_pdb_bed import main as generate_pdb_bed
 from pavooc.preprocessing.generate_snp_bed import main as generate_snp_bed
 from pavooc.preprocessing.guides_to_db import main as main_guides_to_db
 from pavooc.preprocessing.prepare_flashfry import main as main_ff
+from pavooc.preprocessing.sgrna_finder import main as main_sgrna_finder
+from pavooc.scoring.flashfry import main as main_flashfry_score
 from pavooc.preprocessing.preprocessing import (combine_genome,
                                                 generate_raw_chromosomes)
 from pavooc.preprocessing.preprocessing import main as main_preprocessing
@@ -94,10 +97,14 @@ def build_db():
     '''
     main_downloader()
     main_preprocessing()
+    main_sgrna_finder()
     if TRAIN_MODEL:
         main_extract_conservation_scores()
     main_ff()
     main_guide_search()  # ff search
+    main_flashfry_score()  # batched ff scoring
+    if GENOME == 'hg19':
+        gene_cns_affection()  # snapshotted gene -> CNS cellline table
     main_guides_to_db()
     generate_bed_files()
     if TRAIN_MODEL:
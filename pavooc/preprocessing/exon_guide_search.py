@@ -3,18 +3,21 @@ import logging
 import os
 import re
 from tqdm import tqdm
-from multiprocessing import Pool
 import tempfile
 
 import pandas as pd
 import numpy as np
 
 from azimuth.model_comparison import predict as azimuth_predict
-from pavooc.config import JAVA_RAM, FLASHFRY_DB_FILE, EXON_DIR, \
-    GUIDES_FILE, COMPUTATION_CORES, FLASHFRY_EXE
+from pavooc.config import JAVA_RAM, EXON_DIR, GENOME, \
+    GUIDES_FILE, COMPUTATION_CORES, FLASHFRY_EXE, OFFTARGET_BACKEND, \
+    MAX_MISMATCH, MAXIMUM_OFF_TARGETS, FLASHFRY_BATCH_SIZE, \
+    EDIT_OFFTARGET_BACKEND, flashfry_db_file
 from pavooc.data import read_gencode, exon_interval_trees, chromosomes, \
-    azimuth_model, gencode_exons
-from pavooc.preprocessing.guides_to_db import guide_mutations
+    azimuth_model, gencode_exons, preloaded_pool, gencode_gene_index, \
+    exon_gene_index, gene_name_similarity
+from pavooc.preprocessing import offtarget_search
+from pavooc.preprocessing.guides_to_db import guide_mutations_batch
 from pavooc.scoring import flashfry
 from pavooc.util import aa_cut_position, percent_peptide
 
@@ -28,79 +31,139 @@ PATTERN = re.compile(
 )
 
 
-def gene_names_similar(gene_a, gene_b):
-    gc = read_gencode()
-    name_a = gc[gc.gene_id == gene_a].iloc[0].gene_name
-    name_b = gc[gc.gene_id == gene_b].iloc[0].gene_name
-    if name_a[:-1] in name_b or name_b[:-1] in name_a:
-        return True
-    else:
-        return False
+def gene_names_similar(gene_a, gene_b, genome=GENOME):
+    '''
+    True if one gene name without its last character is contained in the
+    other one (see pavooc.data.GeneNameSimilarity)
+    '''
+    return gene_name_similarity(genome)(gene_a, gene_b)
+
+
+def parse_off_targets(off_targets):
+    '''
+    Explode FlashFry offTargets strings (discover with --positionOutput) into
+    one row per off-target locus
+
+    :off_targets: Series of offTargets strings (comma separated entries
+        like PATTERN), indexed by guide
+    :returns: DataFrame with the columns guide (index label of the guide),
+        entry (number of the entry), locus (number of the locus within its
+        entry), protospacer, occurences, mismatch_count, chromosome,
+        position and strand
+    '''
+    entries = off_targets.astype(object).str.split(',').explode()
+    parsed = entries.reset_index(drop=True).str.extract(
+        '^' + PATTERN.pattern)
+    invalid = parsed['protospacer'].isna()
+    if invalid.any():
+        raise ValueError('Invalid off-targets: {}'.format(
+            list(entries[invalid.values][:3])))
+
+    loci = parsed['off_loci'].str.split('|')
+    counts = loci.str.len().values
+    entry_numbers = np.repeat(np.arange(len(parsed)), counts)
+    loci = pd.Series(np.concatenate(loci.values) if len(loci) else [],
+                     dtype=object).str.extract(
+        r'^(?P<chromosome>[^:]*):(?P<position>\d+)\^(?P<strand>.*)$')
+    if loci['position'].isna().any() or \
+            not loci['strand'].isin(['F', 'R']).all():
+        raise ValueError('strand must be either R or F in all loci: {}'
+                         .format(list(parsed['off_loci'][:3])))
+
+    loci['guide'] = entries.index.values[entry_numbers]
+    loci['entry'] = entry_numbers
+    loci['locus'] = np.arange(len(loci)) - \
+        np.repeat(np.cumsum(counts) - counts, counts)
+    loci['protospacer'] = parsed['protospacer'].values[entry_numbers]
+    loci['occurences'] = parsed['occurences'].values[entry_numbers] \
+        .astype(np.int64)
+    loci['mismatch_count'] = parsed['mismatch_count'].values[entry_numbers] \
+        .astype(np.int64)
+    loci['position'] = loci['position'].astype(np.int64)
+    return loci
 
 
 # TODO maybe improve this heuristic
-def off_targets_relevant(off_targets, gene_id, mismatches):
+def relevant_off_targets(loci, gene_id, mismatches, genome=GENOME):
     '''
     ATM just check whether there is a zero mismatch OT in another gene
 
-    :off_targets: string containing all off targets to check for relevance
+    An entry is relevant if one of its loci hits exons, all of them in
+    genes which are not similar to the on-target gene. Loci after the first
+    relevant one of an entry are not evaluated (nor counted)
+
+    :loci: off-target loci as returned by parse_off_targets
     :gene_id: The gene_id of the on-target
-    :mismatches: dictionary to keep statistics of mismatches
+    :mismatches: dictionary to keep statistics of mismatches, keyed by
+        (in exon, mismatch count)
+    :genome: the genome of the loci
+    :returns: array of the guides with relevant off-targets
+    '''
+    loci = loci[loci['mismatch_count'] == 0].reset_index(drop=True)
+    # in flashfry, the position is always the left-handside
+    # (in forward strand direction)
+    cut_positions = loci['position'].values + \
+        np.where(loci['strand'].values == 'F', 17, 6)
+
+    in_exon = np.zeros(len(loci), dtype=bool)
+    similar_hit = np.zeros(len(loci), dtype=bool)
+    trees = exon_interval_trees(genome)
+    for chromosome, rows in loci.groupby('chromosome', sort=False).indices \
+            .items():
+        index = trees[chromosome]
+        locus_numbers, hits = index.query_points(cut_positions[rows])
+        hit_genes = index.data['gene_id'][hits]
+        similar = {hit_gene: gene_names_similar(hit_gene, gene_id, genome)
+                   for hit_gene in np.unique(hit_genes)}
+        in_exon[rows[locus_numbers]] = True
+        similar_hit[rows[locus_numbers[np.array(
+            [similar[hit_gene] for hit_gene in hit_genes],
+            dtype=bool)]]] = True
+
+    # (either, we sort out guides, that cut the same gene while
+    # cutting another gene which might sort out many good guides)
+    # (depends on the design of FF). Right now:
+    # Disallow guides only if that off_target is away from the gene
+    # all instead of any, because any would make this relevant if it was on
+    # the same gene, when there is another exon on the reverse strand
+    # furthermore check if this is in an isozyme
+    relevant = in_exon & ~similar_hit
+    first_relevant = pd.Series(loci['locus'].values[relevant]) \
+        .groupby(loci['entry'].values[relevant]).min()
+    evaluated = loci['locus'].values <= first_relevant.reindex(
+        loci['entry'].values, fill_value=np.iinfo(np.int64).max).values
+
+    statistics = pd.Series(loci['occurences'].values[evaluated]).groupby(
+        [in_exon[evaluated], loci['mismatch_count'].values[evaluated]]).sum()
+    for (locus_in_exon, mismatch_count), occurences in statistics.items():
+        key = (bool(locus_in_exon), int(mismatch_count))
+        mismatches[key] = mismatches.get(key, 0) + int(occurences)
+
+    return pd.unique(loci['guide'].values[relevant])
+
+
+def off_targets_relevant(off_targets, gene_id, mismatches):
+    '''
+    relevant_off_targets for a single offTargets entry
+    :off_targets: string containing all off targets to check for relevance
     :returns: boolean wether off_targets are relevant or not
     '''
-    result = PATTERN.match(off_targets)
-    assert bool(result), off_targets  # check that pattern is valid
-    if int(result.group('mismatch_count')) > 0:
-        return False
-
-    for off_locus in result.group('off_loci').split('|'):
-        # in flashfry, the position is always the left-handside
-        # (in forward strand direction)
-        try:
-            chromosome, rest = off_locus.split(':')
-            position, strand = rest.split('^')
-        except:
-            from IPython.core.debugger import set_trace
-            set_trace()
-        if strand == 'F':
-            position = int(position) + 17
-        elif strand == 'R':
-            position = int(position) + 6
-        else:
-            raise ValueError('strand must be either R or F but is {}'
-                             .format(strand))
-        in_exons = exon_interval_trees()[chromosome][position]
+    return len(relevant_off_targets(
+        parse_off_targets(pd.Series([off_targets])),
+        gene_id, mismatches)) > 0
 
-        try:
-            mismatches[(
-                bool(in_exons),
-                int(result.group('mismatch_count'))
-            )] += int(result.group('occurences'))
-        except KeyError:
-            mismatches[(
-                bool(in_exons),
-                int(result.group('mismatch_count'))
-            )] = int(result.group('occurences'))
-        # (either, we sort out guides, that cut the same gene while
-        # cutting another gene which might sort out many good guides)
-        # (depends on the design of FF). Right now:
-        # Disallow guides only if that off_target is away from the gene
-        # np.all, because np.any would make this relevant if it was on the
-        # same gene, when there is another exon on the reverse strand
-        # furthermore check if this is in an isozyme
-        if bool(in_exons) and \
-                np.all([not gene_names_similar(exon[2][0], gene_id)
-                        for exon in in_exons]):
-            return True
-
-    return False
-
-
-def flashfry_guides(seq_file, target_file):
+
+def flashfry_guides(seq_file, target_file, backend=OFFTARGET_BACKEND,
+                    genome=GENOME):
     '''
     Generates the flashfry guides with off-targets for a gene
+    With backend 'native' the in-process search is used instead of
+    FlashFry (same output format)
     :returns: The filename of the files with the generated guides
     '''
+    if backend == 'native':
+        return offtarget_search.discover(seq_file, target_file,
+                                         genome=genome)
 
     result = subprocess.run([
         'java',
@@ -110,22 +173,24 @@ def flashfry_guides(seq_file, target_file):
         '--analysis', 'discover',
         '--fasta', seq_file,
         '--output', target_file,
-        '--maxMismatch', '5',
-        '--maximumOffTargets', '1500',
+        '--maxMismatch', str(MAX_MISMATCH),
+        '--maximumOffTargets', str(MAXIMUM_OFF_TARGETS),
         '--positionOutput=true',
-        '--database', FLASHFRY_DB_FILE
+        '--database', flashfry_db_file(genome)
     ], stdout=subprocess.DEVNULL)
     if result.returncode != 0:
         raise RuntimeError(result)
     return target_file
 
 
-def generate_edit_guides(gene_id, chromosome, edit_position, offset=200):
+def generate_edit_guides(gene_id, chromosome, edit_position, offset=200,
+                         genome=GENOME):
     '''
     I hope they all have the same index..
     :chromosome: e.g. 'chr12'
     :edit_position: edit_position in chromosome
     :offset: number of nucleotides before and after the edit_position to look for guides
+    :genome: the genome of gene_id
     :returns: A tuple (sequence, before_guides, after_guides) with all scored guides before and after the edit_position
     '''
     seq_file = tempfile.NamedTemporaryFile(delete=False)
@@ -134,14 +199,15 @@ def generate_edit_guides(gene_id, chromosome, edit_position, offset=200):
     seq_file.write(
         bytes(f'>{chromosome}:{gene_id}:{edit_position-offset}-{edit_position+offset}\n', 'ascii'))
     seq_start = edit_position - offset
-    seq = chromosomes()[chromosome][seq_start:edit_position + offset]
+    seq = chromosomes(genome)[chromosome][seq_start:edit_position + offset]
     seq_file.write(bytes(seq, 'ascii'))
     seq_file.close()
 
-    exons = gencode_exons()[gencode_exons().gene_id == gene_id]
+    exons = exon_gene_index(genome).rows(gene_id)
 
-    generate_guides(gene_id, seq_file.name,
-                    target_file.name, check_in_exon=False)
+    generate_guides(gene_id, seq_file.name, target_file.name,
+                    check_in_exon=False, backend=EDIT_OFFTARGET_BACKEND,
+                    genome=genome)
     os.remove(seq_file.name)
 
     # TODO from here on DRY with guides_to_db:build_gene_document
@@ -153,16 +219,15 @@ def generate_edit_guides(gene_id, chromosome, edit_position, offset=200):
                       .format(target_file.name))
         raise
 
-    flashfry_scores = flashfry.score(target_file.name)
+    flashfry_scores = flashfry.score(target_file.name, genome)
     flashfry_scores.fillna(0, inplace=True)
 
     # delete all guides with incomplete context (at the border of the sequence)
     guides = guides[guides.context.apply(len) == 35]
     guides['start'] += seq_start
 
-    gene_start = exons['start'].min()
-    gene_end = exons['end'].max()
-    strand = exons.strand.iloc[0]
+    gene_start, gene_end = exon_gene_index(genome).bounds(gene_id)
+    strand = exon_gene_index(genome).strand(gene_id)
 
     try:
         guides['cut_position'] = guides.apply(
@@ -198,10 +263,13 @@ def generate_edit_guides(gene_id, chromosome, edit_position, offset=200):
     before_guides = []
     after_guides = []
 
+    mutations = dict(zip(guides.index, guide_mutations_batch(
+        chromosome, guides['start'].values, genome)))
+
     # TODO does the index really match????
     for index, guide in guides.iterrows():
         converted = {**guide,
-                     'mutations': guide_mutations(chromosome, guide['start']),
+                     'mutations': mutations[index],
                      'scores': {
                          'azimuth': azimuth_score.loc[index],
                          **flashfry_scores.loc[index][[
@@ -222,21 +290,115 @@ def generate_exon_guides(gene_id):
     return generate_guides(gene_id, seq_file, target_file, check_in_exon=True)
 
 
-def generate_guides(gene_id, seq_file, target_file, check_in_exon):
+def write_batch_fasta(gene_ids, batch_file):
+    '''
+    Concatenate the exon FASTA files of several genes into one file. Exons
+    contained in several genes are only written once
+    :returns: dict of exon_id to the list of gene_ids containing it
+    '''
+    exon_genes = {}
+    with open(batch_file, 'w') as batch:
+        for gene_id in gene_ids:
+            with open(os.path.join(EXON_DIR, gene_id)) as gene_file:
+                write = True
+                for line in gene_file:
+                    if line.startswith('>'):
+                        # header: >exon_id;strand;start;end;transcripts
+                        exon_id = line[1:].split(';')[0]
+                        write = exon_id not in exon_genes
+                        exon_genes.setdefault(exon_id, []).append(gene_id)
+                    if write:
+                        batch.write(line)
+    return exon_genes
+
+
+def split_batch_guides(batch_target_file, exon_genes, gene_ids):
+    '''
+    Distribute the guides of a batched discover run into the GUIDES_FILE of
+    each gene, using the exon_id in the contig column. Genes without guides
+    get a file with the header only, just like a single-gene run
+    '''
+    guides = pd.read_csv(batch_target_file, sep='\t', index_col=False,
+                         dtype=str, keep_default_na=False)
+    owners = pd.DataFrame(
+        [(exon_id, gene_id) for exon_id, genes in exon_genes.items()
+         for gene_id in genes],
+        columns=['exon_id', 'gene_id'])
+    guides['exon_id'] = guides['contig'].str.split(';').str[0]
+    guides = guides.merge(owners, on='exon_id', how='inner', sort=False)
+    gene_guides = dict(iter(guides.groupby('gene_id', sort=False)))
+
+    columns = [c for c in guides.columns if c not in ('exon_id', 'gene_id')]
+    empty = guides.iloc[0:0][columns]
+    for gene_id in gene_ids:
+        gene_guides.get(gene_id, empty)[columns].to_csv(
+            GUIDES_FILE.format(gene_id), sep='\t', index=False)
+
+
+def generate_exon_guides_batch(gene_ids):
+    '''
+    Like generate_exon_guides for several genes, but with only one FlashFry
+    run (JVM start and database load) for all of them
+    :returns: tuple (overflow count, mismatches) summed over the genes
+    '''
+    seq_file = tempfile.NamedTemporaryFile(delete=False, suffix='.fa')
+    target_file = tempfile.NamedTemporaryFile(delete=False)
+    seq_file.close()
+    target_file.close()
+    try:
+        exon_genes = write_batch_fasta(gene_ids, seq_file.name)
+        flashfry_guides(seq_file.name, target_file.name)
+        split_batch_guides(target_file.name, exon_genes, gene_ids)
+    finally:
+        os.remove(seq_file.name)
+        os.remove(target_file.name)
+
+    mismatches = {}
+    overflow_count = 0
+    for gene_id in gene_ids:
+        partial_overflow_count, partial_mismatches = filter_guides(
+            gene_id, GUIDES_FILE.format(gene_id), check_in_exon=True)
+        overflow_count += partial_overflow_count
+        add_mismatches(mismatches, partial_mismatches)
+    return overflow_count, mismatches
+
+
+def add_mismatches(mismatches, partial_mismatches):
+    '''
+    Add the mismatch statistics partial_mismatches to mismatches (in place)
+    '''
+    for key in partial_mismatches:
+        try:
+            mismatches[key] += partial_mismatches[key]
+        except KeyError:
+            mismatches[key] = partial_mismatches[key]
+
+
+def generate_guides(gene_id, seq_file, target_file, check_in_exon,
+                    backend=OFFTARGET_BACKEND, genome=GENOME):
     '''
     Find and prepare guides for a given region
     :gene_id: Needed to check for off targets. Off targets in the same gene
     dont matter
     :seq_file: the provided sequence region as FASTA file
     :target_file: the prepared guides
+    :backend: off-target search, see flashfry_guides
+    :genome: the genome of gene_id
     :returns: tuple (overflow count, mismatches)
     '''
 
     logging.info('Generate guides for {}.'.format(gene_id))
-    mismatches = {}
-    overflow_count = 0
+    flashfry_guides(seq_file, target_file, backend, genome)
+    return filter_guides(gene_id, target_file, check_in_exon, genome)
 
-    flashfry_guides(seq_file, target_file)
+
+def filter_guides(gene_id, target_file, check_in_exon, genome=GENOME):
+    '''
+    Delete guides with relevant off targets (or outside the exons) from the
+    discovered guides in target_file (in place)
+    :returns: tuple (overflow count, mismatches)
+    '''
+    mismatches = {}
 
     # now read the file, analyze and delete unnecessary guides
     data = pd.read_csv(
@@ -255,42 +417,35 @@ def generate_guides(gene_id, seq_file, target_file, check_in_exon):
         }
     )
 
-    delete_indices = set()
-
-    for index, row in data.iterrows():
-        if row['overflow'] == 'OVERFLOW':
-            overflow_count += 1
-            delete_indices.add(index)
-
-        if row['otCount'] == 0:
-            continue
-
-        if check_in_exon:
-            # check if the DSB is really inside the exon
-            # (we padded the exons by 16bps on both sides)
-            # row.start is in padded coordinates
-            exon_data = row['contig'].split(';')
-            exon_length = int(exon_data[3]) - int(exon_data[2])
-
-            if (row['orientation'] == 'FWD' and
-                row['start'] + 16 > exon_length + 16) or \
-                (row['orientation'] == 'RVS' and
-                 row['start'] < 10):
-                delete_indices.add(index)
-                continue
-
-
-        # check for off_target duplicates inside the exome
-        for off_targets in row['offTargets'].split(','):
-            if off_targets_relevant(off_targets, gene_id, mismatches):
-                delete_indices.add(index)
-
-    data.drop(delete_indices, inplace=True)
-    data.reset_index(inplace=True, drop=True)
+    overflow = (data['overflow'] == 'OVERFLOW').values
+    overflow_count = int(overflow.sum())
+    delete = overflow.copy()
+    candidates = (data['otCount'] != 0).to_numpy(copy=True)
+
+    if check_in_exon:
+        # check if the DSB is really inside the exon
+        # (we padded the exons by 16bps on both sides)
+        # row.start is in padded coordinates
+        exon_data = data['contig'].str.split(';')
+        exon_length = exon_data.str[3].astype(int) - \
+            exon_data.str[2].astype(int)
+        outside = (((data['orientation'] == 'FWD') &
+                    (data['start'] + 16 > exon_length + 16)) |
+                   ((data['orientation'] == 'RVS') &
+                    (data['start'] < 10))).values & candidates
+        delete |= outside
+        candidates &= ~outside
+
+    # check for off_target duplicates inside the exome
+    loci = parse_off_targets(data.loc[candidates, 'offTargets'])
+    delete |= data.index.isin(
+        relevant_off_targets(loci, gene_id, mismatches, genome))
+
+    data = data[~delete].reset_index(drop=True)
 
     # delete position_markers (they are incompatible with the scoring)
-    data['offTargets'] = data['offTargets'].map(
-        lambda ot: re.sub('<.*?>', '', ot))
+    data['offTargets'] = data['offTargets'].str.replace(
+        '<.*?>', '', regex=True)
     data.to_csv(target_file, sep='\t', index=False)
 
     return overflow_count, mismatches
@@ -299,31 +454,27 @@ def generate_guides(gene_id, seq_file, target_file, check_in_exon):
 def main():
     mismatches = {}
     overflow_count = 0
-    gene_ids = read_gencode().gene_id.drop_duplicates()
+    gene_ids = list(read_gencode().gene_id.drop_duplicates())
+    batches = [gene_ids[i:i + FLASHFRY_BATCH_SIZE]
+               for i in range(0, len(gene_ids), FLASHFRY_BATCH_SIZE)]
     if COMPUTATION_CORES > 1:
-        with Pool(COMPUTATION_CORES) as pool:
+        with preloaded_pool([read_gencode, gencode_exons,
+                             gencode_gene_index, gene_name_similarity,
+                             exon_interval_trees]) as pool:
             for partial_overflow_count, partial_mismatches in tqdm(
                     pool.imap_unordered(
-                        generate_exon_guides,
-                        gene_ids),
-                    total=len(gene_ids)):
+                        generate_exon_guides_batch,
+                        batches),
+                    total=len(batches)):
                 overflow_count += partial_overflow_count
-                for key in partial_mismatches:
-                    try:
-                        mismatches[key] += partial_mismatches[key]
-                    except KeyError:
-                        mismatches[key] = partial_mismatches[key]
+                add_mismatches(mismatches, partial_mismatches)
     else:
         # debuggable
-        for gene_id in tqdm(gene_ids, total=len(gene_ids)):
-            partial_overflow_count, partial_mismatches = generate_exon_guides(
-                gene_id)
+        for batch in tqdm(batches, total=len(batches)):
+            partial_overflow_count, partial_mismatches = \
+                generate_exon_guides_batch(batch)
             overflow_count += partial_overflow_count
-            for key in partial_mismatches:
-                try:
-                    mismatches[key] += partial_mismatches[key]
-                except KeyError:
-                    mismatches[key] = partial_mismatches[key]
+            add_mismatches(mismatches, partial_mismatches)
 
     # save anaysis data
     print('Overflow count: {}'.format(overflow_count))
@@ -23,13 +23,13 @@ import re
 
 from skbio.sequence import DNA
 from gtfparse import read_gtf_as_dataframe
-from intervaltree import IntervalTree
 import numpy as np
 import pandas as pd
 
 from pavooc.config import DATADIR, CONSERVATION_FEATURES_FILE, \
         GENCODE_HG38_FILE, GENCODE_MM10_FILE, MOUSE_CHROMOSOMES
-from pavooc.util import buffer_return_value
+from pavooc.intervals import IntervalIndex, interval_snapshot
+from pavooc.util import memoize
 from pavooc.scoring.azimuth_dataset import load_dataset as azimuth_dataset
 # from pavooc.scoring.achilles_dataset import load_dataset as achilles_dataset
 
@@ -72,7 +72,7 @@ def cut_chromosomes(species='hg38'):
         chromosome_file.close()
 
 
-@buffer_return_value
+@memoize
 def read_mm10():
     print('read gencode')
     df = read_gtf_as_dataframe(GENCODE_MM10_FILE)
@@ -81,7 +81,7 @@ def read_mm10():
     return df
 
 
-@buffer_return_value
+@memoize
 def read_hg38():
     print('read gencode')
     df = read_gtf_as_dataframe(GENCODE_HG38_FILE)
@@ -90,7 +90,7 @@ def read_hg38():
     return df
 
 
-@buffer_return_value
+@memoize
 def human_chromosomes():
     print('Loading human chromosomes')
     species = 'hg38'
@@ -99,7 +99,7 @@ def human_chromosomes():
         for c in HUMAN_CHROMOSOMES}
 
 
-@buffer_return_value
+@memoize
 def mouse_chromosomes():
     print('Loading mouse chromosomes')
     species = 'mm10'
@@ -184,42 +184,34 @@ def find_guide_context(gene, context, sense):
     return species, chromosome, cut_position
 
 
-def pickle_return_value(func):
-    import pickle
+def _phast_files(chromosome_names, filename_suffix):
+    return [os.path.join(DATADIR, chromosome + filename_suffix)
+            for chromosome in chromosome_names]
 
-    def wrapper(*args, **kwargs):
-        filename = os.path.join(DATADIR, f'buffered_{func.__name__}.pickle')
-        try:
-            with open(filename, 'rb') as f:
-                return pickle.load(f)
-        except FileNotFoundError:
-            ret = func(*args, **kwargs)
-            with open(filename, 'wb') as f:
-                pickle.dump(ret, f)
-            return ret
-
-    return wrapper
 
-
-@buffer_return_value
-@pickle_return_value  # delete me later?
+@memoize
+@interval_snapshot('phast_mm10', lambda: _phast_files(
+    MOUSE_CHROMOSOMES, '.phastCons60way.wigFix'))
 def index_phast_mm10():
     return _index_phast(MOUSE_CHROMOSOMES, '.phastCons60way.wigFix')
 
 
-@buffer_return_value
-@pickle_return_value  # delete me later?
+@memoize
+@interval_snapshot('phast_hg38', lambda: _phast_files(
+    HUMAN_CHROMOSOMES, '.phastCons100way.wigFix.hg38'))
 def index_phast_hg38():
     return _index_phast(HUMAN_CHROMOSOMES, '.phastCons100way.wigFix.hg38')
 
-@buffer_return_value
-@pickle_return_value  # delete me later?
+
+@memoize
+@interval_snapshot('phast_hg19', lambda: _phast_files(
+    HUMAN_CHROMOSOMES, '.phastCons100way.wigFix'))
 def index_phast_hg19():
     return _index_phast(HUMAN_CHROMOSOMES, '.phastCons100way.wigFix')
 
 
 def _index_phast(chromosome_names, filename_suffix):
-    '''Find all headers and insert them into intervaltrees
+    '''Find all headers and insert them into interval indexes
 
     each line has 6 characters. example:
     0.123\n
@@ -228,31 +220,30 @@ def _index_phast(chromosome_names, filename_suffix):
 
     print('indexing phast headers')
     trees = {}
-    base_count = 0
-    start_file_pos = None
     for chromosome in chromosome_names:
+        starts, ends, start_file_positions = [], [], []
+        base_count = 0
+        start_file_pos = None
         file_pos = 0
         with open(os.path.join(DATADIR, chromosome + filename_suffix)) as f:
             for line in f:
                 file_pos += len(line)
                 if line[:5] == 'fixed':
                     if start_file_pos:  # the first header is not an interval
-                        try:
-                            trees[chromosome]
-                        except KeyError:
-                            trees[chromosome] = IntervalTree()
-                        trees[chromosome][start - 1:start -
-                                          1 + base_count] = start_file_pos
+                        starts.append(start - 1)
+                        ends.append(start - 1 + base_count)
+                        start_file_positions.append(start_file_pos)
 
                     start = int(re.search('start=(\d+)', line).groups()[0])
                     start_file_pos = file_pos
                     base_count = 0
                 else:
                     base_count += 1
-            trees[chromosome][start - 1:start -
-                              1 + base_count] = start_file_pos
-            base_count = 0
-            start_file_pos = None
+            starts.append(start - 1)
+            ends.append(start - 1 + base_count)
+            start_file_positions.append(start_file_pos)
+        trees[chromosome] = IntervalIndex(
+            starts, ends, np.array(start_file_positions, dtype=np.int64))
     return trees
 
 
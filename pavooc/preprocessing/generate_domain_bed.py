@@ -1,11 +1,10 @@
-import os
 import pandas as pd
 
-from pavooc.config import DATADIR, DOMAIN_BED_FILE
+from pavooc.config import DOMAIN_BED_FILE, PFAM_DOMAINS_FILE
 
 
 def main():
-    df = pd.read_csv(os.path.join(DATADIR, 'ucscGenePfam.txt'), sep='\t',
+    df = pd.read_csv(PFAM_DOMAINS_FILE, sep='\t',
                      header=0, names=['q1', 'chr', 'start', 'end', 'name',
                                       'q2', 'strand', 'q3', 'q4', 'q5',
                                       'q6', 'lengths', 'starts'])
@@ -9,7 +9,7 @@ import numpy as np
 from tqdm import tqdm
 
 from pavooc.config import PDB_BED_FILE, SINGLE_PDBS
-from pavooc.data import gencode_exons, pdb_list
+from pavooc.data import GeneIndex, gencode_exons, pdb_list
 from pavooc.pdb import pdb_mappings
 from pavooc.util import normalize_pid
 
@@ -130,6 +130,7 @@ def main():
     exons = exons.loc[exons.swissprot_id.map(
         lambda spid: type(spid) == str)].copy()
     exons.swissprot_id = exons.swissprot_id.map(normalize_pid)
+    genes = GeneIndex(exons)
     with open(PDB_BED_FILE, 'w') as f:
         for _, pdb in tqdm(pdb_list().iterrows(), total=len(pdb_list())):
             # find the transcript, that corresponds to the pdb
@@ -144,8 +145,7 @@ def main():
 
             gene_id = gene_id.iloc[0]
 
-            pdb_exons = exons.loc[
-                exons.gene_id == gene_id].copy().sort_values('exon_number')
+            pdb_exons = genes.rows(gene_id).copy().sort_values('exon_number')
 
             try:
                 data = pdb_coordinates(pdb, pdb_exons)
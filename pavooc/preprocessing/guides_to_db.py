@@ -4,20 +4,22 @@ into mongoDB
 '''
 import logging
 import time
-from multiprocessing import Pool
 
 import mygene
 import numpy as np
 import pandas as pd
 from requests.exceptions import ConnectionError
-from skbio.sequence import DNA
 from tqdm import tqdm
 
-from pavooc.config import COMPUTATION_CORES, DEBUG, GENOME, GUIDES_FILE
-from pavooc.data import (cellline_mutation_trees, chromosomes, cns_trees,
-                         domain_interval_trees, gencode_exons, pdb_list,
-                         pfam_mapping, read_gencode)
+from pavooc.config import (CCLE_GENOME, COMPUTATION_CORES, DEBUG, GENOME,
+                           GUIDES_FILE)
+from pavooc.data import (azimuth_model, cellline_mutation_trees, chromosomes,
+                         decode_celllines, domain_interval_trees,
+                         gencode_exons, gencode_gene_index,
+                         gene_cns_celllines, pdb_list, pfam_mapping,
+                         preloaded_pool, read_gencode)
 from pavooc.db import guide_collection
+from pavooc.genome import extract_contexts, invalid_pams
 from pavooc.pdb import pdb_mappings
 from pavooc.scoring import azimuth, flashfry  # , pavooc
 from pavooc.util import aa_cut_position, normalize_pid, percent_peptide
@@ -31,6 +33,8 @@ mg = mygene.MyGeneInfo()
 
 def _context_guide(exon_id, start, guide_direction, chromosome, context_length=5):
     '''
+    Single-guide variant of pavooc.genome.extract_contexts. Use the latter for
+    many guides.
     :exon_id: ensembl id
     :start: bp position start of guide(!) relative to chromosome
     :guide_direction: either 'FWD' or 'RVS'
@@ -47,19 +51,10 @@ def _context_guide(exon_id, start, guide_direction, chromosome, context_length=5
             logging.error(f'azimuth.py: same exon_id with different starts {exon}')
         exon = exon.iloc[0]
 
-    if guide_direction == 'RVS':
-        start -= 3
-    else:
-        start -= 4
-
-    seq = chromosomes()[exon['seqname']
-                        ][start:start + 30].upper()
+    seq = extract_contexts(chromosomes(), [exon['seqname']], [start],
+                           [guide_direction])[0]
 
-    # if the strands don't match, it needs to be reversed
-    if guide_direction == 'RVS':
-        seq = str(DNA(seq).reverse_complement())
-
-    assert seq[25:27] == 'GG', \
+    assert not invalid_pams([seq])[0], \
         'the generated context is invalid (PAM) site. {}, {}, {}'.format(
         seq, exon['strand'], guide_direction)
     return seq
@@ -75,14 +70,13 @@ def filter_bad_guides(guides, score):
 
 def cns_affection(exons):
     '''
-    :returns: boolean whether the gene is affected by a CNS or not
+    :returns: ids (see pavooc.data.encode_celllines) of the celllines with
+        a copy number segment overlapping the gene (see
+        pavooc.data.gene_cns_affection)
     '''
-    if GENOME != 'hg19':
+    if GENOME != CCLE_GENOME:
         return []
-    chromosome = exons.iloc[0].seqname
-    start = exons.start.min()
-    end = exons.end.max()
-    return [v[2]['cellline'] for v in cns_trees()[chromosome][start:end]]
+    return gene_cns_celllines().get(exons.iloc[0].gene_id, [])
 
 
 def guide_mutations(chromosome, position):
@@ -95,18 +89,43 @@ def guide_mutations(chromosome, position):
     #         cellline_mutation_trees[chromosome][position:position + 23]]
     # as long as other datais not necessary, we just return the cellline
     # TODO add CNS?
-    if GENOME != 'hg19':
-        return []
-    mutations = [mut[2]['cellline'] for mut in
-                 cellline_mutation_trees()[chromosome][position:position + 23]]
-    return mutations
+    return guide_mutations_batch(chromosome, [position])[0]
+
+
+def guide_mutations_batch(chromosome, positions, genome=GENOME):
+    '''
+    Same as guide_mutations for many guides with one interval query
+    :positions: guide start positions on chromosome
+    :returns: list with the list of mutated celllines for each position
+    '''
+    return [decode_celllines(ids)
+            for ids in guide_mutation_ids(chromosome, positions, genome)]
+
+
+def guide_mutation_ids(chromosome, positions, genome=GENOME):
+    '''
+    Like guide_mutations_batch, but returns cellline ids (see
+    pavooc.data.encode_celllines) as stored in the guide documents
+    :returns: list with the list of cellline ids for each position
+    '''
+    if genome != CCLE_GENOME:
+        return [[] for _ in positions]
+    positions = np.asarray(positions, dtype=np.int64)
+    index = cellline_mutation_trees(genome)[chromosome]
+    guide_numbers, mutations = index.query_ranges(positions, positions + 23)
+    ids = index.data['cellline'][mutations].tolist()
+
+    # query_ranges returns the hits grouped by guide
+    boundaries = np.cumsum(np.bincount(guide_numbers,
+                                       minlength=len(positions)))
+    return [ids[end - count:end] for end, count in
+            zip(boundaries, np.diff(boundaries, prepend=0))]
 
 
 def pdbs_for_gene(gene_id):
-    gencode = read_gencode()
     pdbs = pdb_list()
-    protein_ids = gencode.loc[(gencode['gene_id'] == gene_id)
-                              ]['swissprot_id'].drop_duplicates().dropna()
+    protein_ids = gencode_gene_index().rows(gene_id)[
+        'swissprot_id'].drop_duplicates().dropna()
 
     canonical_pids = np.unique([normalize_pid(pid)
                                 for pid in protein_ids if pid]).astype('O')
@@ -240,11 +259,18 @@ def load_guides(gene_id, exons):
         lambda row: percent_peptide(row, gene_start, gene_end, strand),
         axis=1)
 
-    guides['context'] = guides.apply(lambda row: _context_guide(
-        row['exon_id'],
-        row['start'],
-        row['orientation'],
-        chromosome), axis=1)
+    guides['context'] = extract_contexts(
+        chromosomes(),
+        np.repeat(chromosome, len(guides)),
+        guides['start'].values,
+        guides['orientation'].values)
+
+    bad_pams = invalid_pams(guides['context'].values)
+    if bad_pams.any():
+        logging.error('{}: dropping {} guides with invalid PAM context: {}'
+                      .format(gene_id, bad_pams.sum(),
+                              list(guides.loc[bad_pams, 'context'])))
+        guides = guides[~bad_pams].copy()
 
     return guides
 
@@ -281,8 +307,7 @@ def build_gene_document(gene, check_exists=True):
         azimuth_score = pd.Series(0, index=guides.index)
     logging.info('calculating pavooc score for {}'.format(gene_id))
 
-    guides_file = GUIDES_FILE.format(gene_id)
-    flashfry_scores = flashfry.score(guides_file)
+    flashfry_scores = flashfry.load_scores(gene_id)
     flashfry_scores.fillna(0, inplace=True)
     try:
         raise ValueError  # we don't want pavooc score for now..
@@ -298,13 +323,17 @@ def build_gene_document(gene, check_exists=True):
     logging.info(
         'Insert gene {} with its data into mongodb'.format(gene_id))
 
+    # celllines are stored as ids, the server translates them to names
+    mutations = dict(zip(guides.index, guide_mutation_ids(
+        chromosome, guides['start'].values)))
+
     # transform dataframe to list of dicts and extract scores into
     # a nested format
     guides_list = [{
         **row[
             ['exon_id', 'start', 'orientation', 'otCount', 'target',
                 'cut_position', 'aa_cut_position']].to_dict(),
-        'mutations': guide_mutations(chromosome, row['start']),
+        'mutations': mutations[index],
         'scores': {**flashfry_scores.loc[index][
             ['Doench2014OnTarget', 'Doench2016CFDScore',
              'dangerous_GC', 'dangerous_polyT',
@@ -335,7 +364,12 @@ def integrate():
     gencode_genes = gencode_exons().groupby('gene_id')
 
     if COMPUTATION_CORES > 1:
-        with Pool(COMPUTATION_CORES) as pool:
+        loaders = [read_gencode, gencode_exons, gencode_gene_index,
+                   chromosomes, azimuth_model, domain_interval_trees,
+                   pdb_list, pfam_mapping]
+        if GENOME == CCLE_GENOME:
+            loaders.extend([cellline_mutation_trees, gene_cns_celllines])
+        with preloaded_pool(loaders) as pool:
             for doc in tqdm(pool.imap_unordered(
                     build_gene_document,
                     gencode_genes), total=len(gencode_genes)):
@@ -0,0 +1,278 @@
+'''
+In-process, mismatch-tolerant off-target search as an alternative to FlashFry
+discover (select it with OFFTARGET_BACKEND=native, /api/edit uses it unless
+EDIT_OFFTARGET_BACKEND=flashfry).
+
+The search runs over the OffTargetIndex built by
+pavooc.preprocessing.sgrna_finder. If a 20mer differs from a guide in at most
+m positions, one of its 10bp halves differs in at most m // 2 positions. So
+for every guide all variants of both halves within m // 2 mismatches are
+looked up in the half bucket tables, and the resulting candidates are
+verified with a vectorized mismatch count.
+
+discover() writes the same tab-separated format as FlashFry discover with
+--positionOutput=true, which is what generate_guides and the FlashFry scoring
+expect.
+'''
+import logging
+from functools import lru_cache
+from itertools import combinations, product
+
+import numpy as np
+import pandas as pd
+
+from pavooc.config import GENOME, MAX_MISMATCH, MAXIMUM_OFF_TARGETS
+from pavooc.data import chromosomes, offtarget_index
+from pavooc.genome import (ALPHABET, COMPLEMENT, codes_to_strings,
+                           decode_bases, encode_bases,
+                           reverse_complement_codes)
+from pavooc.preprocessing.sgrna_finder import TARGET_LENGTH, scan_codes
+from pavooc.protospacer_index import HALF_LENGTH, HALF_MASK, HALF_SHIFT
+from pavooc.util import expand_ranges, ints_to_kmers
+
+# number of guides searched at once. bounds the candidate arrays
+QUERY_BATCH_SIZE = 16
+# bases of context on both sides of a target (like FlashFry)
+CONTEXT_PADDING = 6
+OUTPUT_COLUMNS = ['contig', 'start', 'stop', 'target', 'context', 'overflow',
+                  'orientation', 'otCount', 'offTargets']
+
+_EVEN_BITS = np.uint64(0x5555555555555555)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def mismatch_counts(a, b):
+    '''
+    :a, b: arrays of 2-bit encoded k-mers (broadcastable)
+    :returns: number of differing bases for each pair
+    '''
+    x = np.bitwise_xor(a, b).astype(np.uint64)
+    x = np.ascontiguousarray((x | (x >> np.uint64(1))) & _EVEN_BITS)
+    return _POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+@lru_cache()
+def variant_masks(length, max_mismatch):
+    '''
+    :returns: XOR masks which turn a 2-bit encoded k-mer of the given length
+        into all k-mers with at most max_mismatch substitutions
+    '''
+    masks = [0]
+    for count in range(1, max_mismatch + 1):
+        for positions in combinations(range(length), count):
+            for changes in product((1, 2, 3), repeat=count):
+                mask = 0
+                for position, change in zip(positions, changes):
+                    mask |= change << (2 * position)
+                masks.append(mask)
+    return np.array(masks, dtype=np.uint64)
+
+
+def _bucket_ranges(offsets, buckets):
+    starts = offsets[buckets].astype(np.int64)
+    return starts, offsets[buckets + np.uint64(1)].astype(np.int64) - starts
+
+
+def search(queries, index, max_mismatch=MAX_MISMATCH):
+    '''
+    Find all protospacers of the index within max_mismatch of the queries
+
+    :queries: uint64 array of 2-bit encoded 20mers
+    :index: OffTargetIndex
+    :returns: tuple of arrays (query indices, key indices, mismatch counts)
+    '''
+    queries = np.asarray(queries, dtype=np.uint64)
+    half_mismatch = max_mismatch // 2
+    masks = variant_masks(HALF_LENGTH, half_mismatch)
+    keys = index.keys
+    results = []
+
+    for batch_start in range(0, len(queries), QUERY_BATCH_SIZE):
+        batch = queries[batch_start:batch_start + QUERY_BATCH_SIZE]
+        batch_ids = np.repeat(
+            np.arange(batch_start, batch_start + len(batch)), len(masks))
+
+        # left half. keys are sorted, hence sorted by their left half too
+        buckets = ((batch >> HALF_SHIFT)[:, None] ^ masks).ravel()
+        starts, counts = _bucket_ranges(index.left_offsets, buckets)
+        left_candidates = expand_ranges(starts, counts)
+        left_queries = np.repeat(batch_ids, counts)
+
+        # right half. skip candidates which were found via the left half
+        buckets = ((batch & HALF_MASK)[:, None] ^ masks).ravel()
+        starts, counts = _bucket_ranges(index.right_offsets, buckets)
+        right_candidates = index.right_order[
+            expand_ranges(starts, counts)].astype(np.int64)
+        right_queries = np.repeat(batch_ids, counts)
+        new = mismatch_counts(
+            keys[right_candidates] >> HALF_SHIFT,
+            queries[right_queries] >> HALF_SHIFT) > half_mismatch
+
+        candidates = np.concatenate([left_candidates,
+                                     right_candidates[new]])
+        candidate_queries = np.concatenate([left_queries,
+                                            right_queries[new]])
+        mismatches = mismatch_counts(keys[candidates],
+                                     queries[candidate_queries])
+        hits = mismatches <= max_mismatch
+        results.append((candidate_queries[hits], candidates[hits],
+                        mismatches[hits]))
+
+    if not results:
+        return (np.zeros(0, np.int64), np.zeros(0, np.int64),
+                np.zeros(0, np.int64))
+    return tuple(np.concatenate(columns) for columns in zip(*results))
+
+
+def read_fasta(filename):
+    '''
+    :returns: list of tuples (contig name, sequence)
+    '''
+    contigs = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                contigs.append((line[1:], []))
+            elif line:
+                contigs[-1][1].append(line)
+    return [(name, ''.join(lines)) for name, lines in contigs]
+
+
+def find_targets(contigs):
+    '''
+    Find all targets (NGG on both strands) in the given contigs
+    :contigs: list of tuples (contig name, sequence)
+    :returns: DataFrame with the target columns of the FlashFry discover
+        output plus the 2-bit encoded protospacer
+    '''
+    targets = []
+    for name, sequence in contigs:
+        codes = encode_bases(sequence)
+        position, strand, protospacer = scan_codes(codes)
+        position = position.astype(np.int64)
+        reverse = strand == b'-'
+
+        target_codes = codes[position[:, None] + np.arange(TARGET_LENGTH)]
+        target_codes[reverse] = reverse_complement_codes(
+            target_codes[reverse])
+        forward_contexts = [sequence[max(0, start - CONTEXT_PADDING):
+                                     start + TARGET_LENGTH + CONTEXT_PADDING]
+                            for start in position]
+        contexts = [_guide_direction(context, is_reverse)
+                    for context, is_reverse in zip(forward_contexts, reverse)]
+
+        targets.append(pd.DataFrame({
+            'contig': name,
+            'start': position,
+            'stop': position + TARGET_LENGTH,
+            'target': codes_to_strings(target_codes) if len(position)
+            else np.zeros(0, dtype='U'),
+            'context': contexts,
+            'orientation': np.where(reverse, 'RVS', 'FWD'),
+            'protospacer': protospacer}))
+
+    if not targets:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS[:5] + ['orientation',
+                                                          'protospacer'])
+    return pd.concat(targets, ignore_index=True)
+
+
+def _guide_direction(sequence, reverse):
+    codes = encode_bases(sequence)
+    if reverse:
+        codes = reverse_complement_codes(codes)
+    return decode_bases(codes)
+
+
+def _pam_bases(chromosome_names, positions, strands, genome):
+    '''
+    :returns: codes of the N in the NGG of the given genome loci
+    '''
+    bases = np.zeros(len(positions), dtype=np.uint8)
+    reverse = strands == b'-'
+    # '+': protospacer, N, G, G. '-': C, C, N, protospacer (reverse strand)
+    pam_positions = positions.astype(np.int64) + np.where(reverse, 2, 20)
+    for name in np.unique(chromosome_names):
+        rows = chromosome_names == name
+        bases[rows] = chromosomes(genome)[name].gather(pam_positions[rows])
+    bases[reverse] = COMPLEMENT[bases[reverse]]
+    return bases
+
+
+def off_targets(targets, index, max_mismatch=MAX_MISMATCH,
+                maximum_off_targets=MAXIMUM_OFF_TARGETS, genome=GENOME):
+    '''
+    :targets: DataFrame as returned by find_targets
+    :genome: the genome of index
+    :returns: DataFrame with the columns overflow, otCount and offTargets
+        (FlashFry format) for each target
+    '''
+    query_ids, key_ids, mismatches = search(
+        targets['protospacer'].values, index, max_mismatch)
+    result = pd.DataFrame({'overflow': 'OK', 'otCount': 0, 'offTargets': ''},
+                          index=targets.index)
+    if len(query_ids) == 0:
+        return result
+
+    hits = pd.DataFrame({'query': query_ids, 'key': key_ids,
+                         'mismatches': mismatches})
+    loci_keys, loci_chromosomes, loci_positions, loci_strands = \
+        index.loci(hits['key'].values)
+    loci = pd.DataFrame({
+        'query': np.repeat(hits['query'].values, index.counts[hits['key']]),
+        'key': loci_keys,
+        'mismatches': np.repeat(hits['mismatches'].values,
+                                index.counts[hits['key']]),
+        'chromosome': loci_chromosomes,
+        'position': loci_positions,
+        'strand': np.where(loci_strands == b'-', 'R', 'F'),
+        'pam': _pam_bases(loci_chromosomes, loci_positions, loci_strands,
+                          genome)})
+
+    loci.sort_values(['query', 'mismatches', 'key', 'chromosome',
+                      'position'], inplace=True, kind='mergesort')
+    loci['rank'] = loci.groupby('query').cumcount()
+    overflow = loci.groupby('query')['rank'].max() >= maximum_off_targets
+    loci = loci[loci['rank'] < maximum_off_targets].copy()
+
+    loci['locus'] = loci['chromosome'] + ':' + \
+        loci['position'].astype(str) + '^' + loci['strand']
+    groups = loci.groupby(['query', 'mismatches', 'key', 'pam'], sort=False)
+    entries = groups['locus'].agg('|'.join).reset_index()
+    entries['occurrences'] = groups.size().values
+    entries['sequence'] = [
+        kmer.decode('ascii') + chr(ALPHABET[pam]) + 'GG'
+        for kmer, pam in zip(ints_to_kmers(index.keys[entries['key'].values]),
+                             entries['pam'].values)]
+    entries['entry'] = entries['sequence'] + '_' + \
+        entries['occurrences'].astype(str) + '_' + \
+        entries['mismatches'].astype(str) + '<' + entries['locus'] + '>'
+
+    per_query = entries.groupby('query')
+    query_index = targets.index[per_query.size().index.values]
+    result.loc[query_index, 'offTargets'] = \
+        per_query['entry'].agg(','.join).values
+    result.loc[query_index, 'otCount'] = \
+        per_query['occurrences'].sum().values
+    result.loc[targets.index[overflow.index[overflow].values],
+               'overflow'] = 'OVERFLOW'
+    return result
+
+
+def discover(seq_file, target_file, max_mismatch=MAX_MISMATCH,
+             maximum_off_targets=MAXIMUM_OFF_TARGETS, genome=GENOME):
+    '''
+    Drop-in replacement of FlashFry discover
+    :seq_file: FASTA file with the regions to search guides in
+    :target_file: output file (FlashFry discover format)
+    :genome: the genome to search off-targets in
+    :returns: target_file
+    '''
+    targets = find_targets(read_fasta(seq_file))
+    logging.info('Searching off-targets for {} targets'.format(len(targets)))
+    targets = targets.join(off_targets(
+        targets, offtarget_index(genome), max_mismatch, maximum_off_targets,
+        genome))
+    targets[OUTPUT_COLUMNS].to_csv(target_file, sep='\t', index=False)
+    return target_file
@@ -4,12 +4,13 @@ import logging
 import os
 import pickle
 
-from intervaltree import IntervalTree
 from skbio.sequence import DNA
 
-from pavooc.config import (CHROMOSOME_FILE, CHROMOSOME_RAW_FILE, CHROMOSOMES,
-                           EXON_DIR, GENOME, GENOME_FILE)
+from pavooc.config import (CHROMOSOME_FILE, CHROMOSOME_PACKED_FILE,
+                           CHROMOSOME_RAW_FILE, CHROMOSOMES, EXON_DIR, GENOME,
+                           GENOME_FILE)
 from pavooc.data import chromosomes, gencode_exons
+from pavooc.genome import write_packed_chromosome
 
 logging.basicConfig(level=logging.INFO)
 
@@ -21,19 +22,25 @@ except OSError:
 
 
 def generate_raw_chromosomes():
-    # delete newlines from chromosomes
-    logging.info('Convert chromosomes into raw form')
-
+    '''
+    Delete newlines from chromosomes and save them in raw and in 2-bit packed
+    form (the latter is what pavooc.data.chromosomes() memory-maps)
+    '''
+    logging.info('Convert chromosomes into raw and packed form')
 
     for chromosome_number in CHROMOSOMES:
         chromosome_filename = CHROMOSOME_FILE.format(chromosome_number)
         with open(chromosome_filename) as chromosome_file:
             chromosome = chromosome_file.read()
+        chromosome = chromosome[2 + len(chromosome_number):].replace('\n', '')
 
         raw_chromose_file = CHROMOSOME_RAW_FILE.format(chromosome_number)
         with open(raw_chromose_file, 'w') as chromosome_file:
-            chromosome_file.write(
-                chromosome[2 + len(chromosome_number):].replace('\n', ''))
+            chromosome_file.write(chromosome)
+
+        write_packed_chromosome(
+            CHROMOSOME_PACKED_FILE.format(GENOME, chromosome_number),
+            chromosome)
 
 
 def exon_to_fasta(exon_id, exon_data):
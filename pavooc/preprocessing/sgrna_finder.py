@@ -1,106 +1,173 @@
 '''
-DEPRECATED!
-Find sgRNAs and save them in a CSV file
-Corresponding Protospacers are saved to a separate CSV file
+Find all sgRNA sites (NGG PAMs on both strands) of the genome and save them
+in a columnar protospacer catalog.
 
-While this code, doesn't seem to be quite intuitive, it is designed
-to fit into 8GB of memory.
+The chromosomes are scanned as uint8 code arrays (see pavooc.genome), chunk by
+chunk and chromosome by chromosome in parallel. For every chromosome three
+arrays are saved (same length, sorted by position):
+
+- position: forward-strand position of the leftmost base of the 23bp target
+  (like the FlashFry positions). For '+' sites that is the first protospacer
+  base, for '-' sites the first C of the CCN
+- strand: b'+' or b'-'
+- protospacer: the 20mer in guide direction, 2-bit encoded as in
+  pavooc.util.kmer_to_int
+
+Sites with an N anywhere in the target are skipped.
+
+Afterwards the catalogs are condensed into an OffTargetIndex (see
+pavooc.protospacer_index), which serves exact-match genome frequency queries
+as well as the mismatch search of pavooc.preprocessing.offtarget_search.
 '''
 
-import os
 import logging
-import pickle
-
+import os
 
-from skbio.sequence import DNA
-import pymongo
+import numpy as np
+from tqdm import tqdm
 
-from pavooc.config import CHROMOSOMES, DATADIR, EXON_INTERVAL_TREES_FILE
-from pavooc.db import sgRNA_collection
-from pavooc.util import kmer_to_int
+from pavooc.config import (CHROMOSOMES, COMPUTATION_CORES,
+                           PROTOSPACER_CATALOG_FILE, PROTOSPACER_DIR,
+                           PROTOSPACER_INDEX_FILE)
+from pavooc.data import chromosomes, preloaded_pool
+from pavooc.genome import N_CODE, reverse_complement_codes
+from pavooc.protospacer_index import OffTargetIndex
+from pavooc.util import codes_to_ints
 
 logging.basicConfig(level=logging.INFO)
 
-EXON_FILE = os.path.join(DATADIR, 'exons/{}_{}')
-CHROMOSOME_RAW_FILE = os.path.join(DATADIR, '{}.raw')
+PROTOSPACER_LENGTH = 20
+TARGET_LENGTH = 23
+CATALOG_COLUMNS = ('position', 'strand', 'protospacer')
+# number of bases decoded at once. bounds the memory per worker
+CHUNK_SIZE = 2 ** 24
 
+_G = 2
+_C = 1
+
+
+def _encode_protospacers(codes, starts, reverse):
+    '''
+    2-bit encode the 20mers at starts (in guide direction)
+    '''
+    protospacers = codes[starts[:, None] + np.arange(PROTOSPACER_LENGTH)]
+    if reverse:
+        protospacers = reverse_complement_codes(protospacers)
+    return codes_to_ints(protospacers)
 
-# TODO exon_interval_tree changed. is now a dict
-def process_sgRNA(guide_position, chr_sequence, strand, chromosome,
-                  exon_interval_trees):
-    # if backward strand, reverse the position to a forward strand position
-    if strand == '-':
-        position = len(chr_sequence) - guide_position.start
-        dsb_position = position - 17
-    else:
-        position = guide_position.start
-        dsb_position = position + 17
 
-    exons = exon_interval_trees[chromosome][dsb_position]
+def scan_codes(codes):
+    '''
+    Find all sgRNA sites in a code array
+
+    :codes: uint8 base codes (see pavooc.genome.encode_bases)
+    :returns: tuple of arrays (position, strand, protospacer) sorted by
+        position
+    '''
+    codes = np.asarray(codes, dtype=np.uint8)
+    site_count = len(codes) - TARGET_LENGTH + 1
+    if site_count <= 0:
+        return (np.zeros(0, np.uint32), np.zeros(0, 'S1'),
+                np.zeros(0, np.uint64))
+
+    # number of Ns before each position, to exclude targets containing N
+    n_count = np.concatenate([[0], np.cumsum(codes == N_CODE)])
+    starts = np.arange(site_count)
+    clean = n_count[starts + TARGET_LENGTH] == n_count[starts]
+
+    # NGG: protospacer first, PAM at the end
+    forward = np.flatnonzero(
+        clean &
+        (codes[PROTOSPACER_LENGTH + 1:site_count + PROTOSPACER_LENGTH + 1] ==
+         _G) &
+        (codes[PROTOSPACER_LENGTH + 2:] == _G))
+    # CCN on the forward strand is NGG on the reverse strand
+    reverse = np.flatnonzero(
+        clean &
+        (codes[:site_count] == _C) &
+        (codes[1:site_count + 1] == _C))
+
+    position = np.concatenate([forward, reverse])
+    strand = np.concatenate([np.full(len(forward), b'+', 'S1'),
+                             np.full(len(reverse), b'-', 'S1')])
+    protospacer = np.concatenate([
+        _encode_protospacers(codes, forward, reverse=False),
+        _encode_protospacers(codes, reverse + 3, reverse=True)])
+
+    order = np.argsort(position, kind='mergesort')
+    return (position[order].astype(np.uint32), strand[order],
+            protospacer[order])
+
+
+def scan_chromosome(chromosome):
+    '''
+    Scan a chromosome chunk by chunk and save its catalog
+    :returns: tuple (chromosome, number of found sites)
+    '''
+    sequence = chromosomes()[chromosome]
+    results = []
+    for chunk_start in range(0, len(sequence), CHUNK_SIZE):
+        # overlap chunks so targets spanning a chunk border are found
+        codes = sequence.codes(chunk_start,
+                               chunk_start + CHUNK_SIZE + TARGET_LENGTH - 1)
+        position, strand, protospacer = scan_codes(codes)
+        inside = position < CHUNK_SIZE
+        results.append((position[inside] + np.uint32(chunk_start),
+                        strand[inside], protospacer[inside]))
+
+    for column, values in zip(CATALOG_COLUMNS, zip(*results)):
+        np.save(PROTOSPACER_CATALOG_FILE.format(chromosome, column),
+                np.concatenate(values))
 
-    # save the sgRNA
-    doc = {
-            'chromosome': chromosome,
-            'strand': strand,
-            'position': int(position),  # convert from np.int64
-            'exons': [exon[2] for exon in exons],
-            'protospacer': str(chr_sequence[guide_position])
-    }
-    sgRNA_collection.insert_one(doc)
+    return chromosome, sum(len(result[0]) for result in results)
+
+
+def load_catalog(chromosome, mmap_mode='r'):
+    '''
+    :returns: dict with the memory-mapped catalog columns of a chromosome
+    '''
+    return {column: np.load(
+        PROTOSPACER_CATALOG_FILE.format(chromosome, column),
+        mmap_mode=mmap_mode) for column in CATALOG_COLUMNS}
 
 
 def find_sgRNAs():
     '''
-    Search for PAMs and their positions of their corresponding sgRNAs
-    Return the position just before the sgRNA, along with the strand direction.
-    Save the sgRNAs along with their positions and included exons
-    PAMs on the reverse strand are described similar:
-    Example:
-    'tcg^acgtataaatatatcgatatNGG' would result in a tuple (3, '+')
-    'atttgCCNgateagctcgatctattata^tgat' would result in a tuple (8, '-')
+    Build the protospacer catalog for all chromosomes
     '''
+    try:
+        os.mkdir(PROTOSPACER_DIR)
+    except FileExistsError:
+        pass
 
-    with open(EXON_INTERVAL_TREES_FILE, 'rb') as f:
-        exon_interval_trees = pickle.load(f)
     sgRNA_count = 0
-    sgRNA_dict = {}
-    sgRNA_collection.drop()
-    logging.info('Old sgRNA collection deleted')
-    for chromosome in CHROMOSOMES:
-        logging.info('find pams in {}'.format(chromosome))
-        with open(CHROMOSOME_RAW_FILE.format(chromosome)) as chr_file:
-            chr_sequence = DNA(chr_file.read().upper())
-            for strand in ['+', '-']:
-                # for the reverse strand, inversecomplement the chromosome
-                if strand == '-':
-                    chr_sequence = chr_sequence.reverse_complement()
-                # 20 Protospacer + 1 PAM-nucleotide, find overlapping sequences
-                for guide_position in chr_sequence. \
-                        find_with_regex('(?=([ACTG]{20})[ACTG]GG)'):
-
-                    process_sgRNA(guide_position, chr_sequence, chromosome,
-                                  strand, exon_interval_trees)
-                    try:
-                        sgRNA_dict[kmer_to_int(chr_sequence[guide_position])] += 1
-                    except KeyError:
-                        sgRNA_dict[kmer_to_int(chr_sequence[guide_position])] = 1
-                    sgRNA_count += 1
+    if COMPUTATION_CORES > 1:
+        with preloaded_pool([chromosomes]) as pool:
+            for chromosome, count in tqdm(
+                    pool.imap_unordered(scan_chromosome, CHROMOSOMES),
+                    total=len(CHROMOSOMES)):
+                logging.info(f'Found {count} sgRNA sites in {chromosome}')
+                sgRNA_count += count
+    else:
+        for chromosome in tqdm(CHROMOSOMES):
+            _, count = scan_chromosome(chromosome)
+            logging.info(f'Found {count} sgRNA sites in {chromosome}')
+            sgRNA_count += count
 
     logging.info('Found {} sgRNA sites'.format(sgRNA_count))
-    logging.info('Found {} distinct protospacers'.format(len(sgRNA_dict)))
-    with open(os.path.join(DATADIR, 'sgRNA_dict.pkl')) as f:
-        pickle.dump(sgRNA_dict, f)
 
 
-def create_protospacer_index():
+def build_protospacer_index():
     logging.info('Create Protospacer index')
-    sgRNA_collection.create_index([("chromosome", pymongo.DESCENDING),
-                                   ("protospacer", pymongo.DESCENDING)])
+    index = OffTargetIndex.build(
+        {chromosome: load_catalog(chromosome) for chromosome in CHROMOSOMES})
+    index.save(PROTOSPACER_INDEX_FILE)
+    logging.info('Found {} distinct protospacers'.format(len(index)))
 
 
 def main():
     find_sgRNAs()
-    create_protospacer_index()
+    build_protospacer_index()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+'''
+Sorted uint64 index of all protospacers in the genome
+
+Every distinct 20mer (2-bit encoded, see pavooc.util.kmer_to_int) is stored
+once in a sorted array along with the number of its occurrences on both
+strands. Batch lookups are binary searches.
+'''
+import numpy as np
+
+from pavooc.util import expand_ranges, kmers_to_ints
+
+INDEX_COLUMNS = ('keys', 'counts')
+
+
+class ProtospacerIndex:
+    '''
+    Exact-match genome frequencies of protospacers
+    '''
+
+    def __init__(self, keys, counts):
+        self.keys = keys
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.counts.nbytes
+
+    @classmethod
+    def build(cls, protospacer_arrays):
+        '''
+        :protospacer_arrays: iterable of uint64 arrays (one per chromosome for
+            example, see pavooc.preprocessing.sgrna_finder)
+        '''
+        keys = []
+        counts = []
+        for protospacers in protospacer_arrays:
+            chromosome_keys, chromosome_counts = np.unique(
+                protospacers, return_counts=True)
+            keys.append(chromosome_keys)
+            counts.append(chromosome_counts)
+
+        if not keys:
+            return cls(np.zeros(0, np.uint64), np.zeros(0, np.uint32))
+
+        keys = np.concatenate(keys)
+        counts = np.concatenate(counts)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        first = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        return cls(keys[first],
+                   np.add.reduceat(counts[order], first).astype(np.uint32))
+
+    def save(self, filename_template):
+        '''
+        :filename_template: filename with one {} for the column name
+        '''
+        for column in INDEX_COLUMNS:
+            np.save(filename_template.format(column), getattr(self, column))
+
+    @classmethod
+    def load(cls, filename_template, mmap_mode='r'):
+        return cls(*[np.load(filename_template.format(column),
+                             mmap_mode=mmap_mode)
+                     for column in INDEX_COLUMNS])
+
+    def lookup(self, kmers):
+        '''
+        :kmers: 20mers as str or as encoded uint64 values
+        :returns: tuple (index positions, found mask)
+        '''
+        kmers = np.asarray(kmers)
+        if kmers.dtype.kind in 'US':
+            kmers = kmers_to_ints(kmers)
+        kmers = kmers.astype(np.uint64)
+        positions = np.searchsorted(self.keys, kmers)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == kmers[found]
+        return positions, found
+
+    def occurrences(self, kmers):
+        '''
+        How many exact copies of each 20mer exist in the genome
+        :kmers: 20mers as str or as encoded uint64 values
+        :returns: int array
+        '''
+        positions, found = self.lookup(kmers)
+        result = np.zeros(len(positions), dtype=np.int64)
+        result[found] = self.counts[positions[found]]
+        return result
+
+
+HALF_LENGTH = 10
+HALF_BUCKETS = 4 ** HALF_LENGTH
+HALF_MASK = np.uint64(HALF_BUCKETS - 1)
+HALF_SHIFT = np.uint64(2 * HALF_LENGTH)
+OFFTARGET_COLUMNS = INDEX_COLUMNS + (
+    'loci_offsets', 'loci_chromosome', 'loci_position', 'loci_strand',
+    'left_offsets', 'right_order', 'right_offsets', 'chromosomes')
+
+
+class OffTargetIndex(ProtospacerIndex):
+    '''
+    ProtospacerIndex extended by the genome loci of every protospacer and by
+    bucket tables over both 10bp halves of the 20mers (used for
+    mismatch-tolerant search, see pavooc.preprocessing.offtarget_search)
+
+    - loci of keys[i] are loci_*[loci_offsets[i]:loci_offsets[i + 1]]
+    - keys with left half h are keys[left_offsets[h]:left_offsets[h + 1]]
+      (keys are sorted, so they are sorted by their left half as well)
+    - keys with right half h are
+      keys[right_order[right_offsets[h]:right_offsets[h + 1]]]
+    '''
+
+    def __init__(self, keys, counts, loci_offsets, loci_chromosome,
+                 loci_position, loci_strand, left_offsets, right_order,
+                 right_offsets, chromosomes):
+        super().__init__(keys, counts)
+        self.loci_offsets = loci_offsets
+        self.loci_chromosome = loci_chromosome
+        self.loci_position = loci_position
+        self.loci_strand = loci_strand
+        self.left_offsets = left_offsets
+        self.right_order = right_order
+        self.right_offsets = right_offsets
+        self.chromosomes = chromosomes
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, column).nbytes
+                   for column in OFFTARGET_COLUMNS)
+
+    @classmethod
+    def build(cls, catalogs):
+        '''
+        :catalogs: dict of chromosome name to catalog (dict of the columns
+            position, strand, protospacer as saved by
+            pavooc.preprocessing.sgrna_finder)
+        '''
+        chromosomes = np.array(list(catalogs.keys()), dtype='U')
+        protospacers = np.concatenate(
+            [catalog['protospacer'] for catalog in catalogs.values()])
+        loci_chromosome = np.concatenate([
+            np.full(len(catalog['protospacer']), i, dtype=np.uint8)
+            for i, catalog in enumerate(catalogs.values())])
+
+        order = np.argsort(protospacers, kind='mergesort')
+        protospacers = protospacers[order]
+        first = np.flatnonzero(np.concatenate(
+            [[True], protospacers[1:] != protospacers[:-1]]))
+        keys = protospacers[first]
+        loci_offsets = np.append(first, len(protospacers)).astype(np.uint64)
+        counts = np.diff(loci_offsets).astype(np.uint32)
+        del protospacers
+
+        loci_chromosome = loci_chromosome[order]
+        loci_position = np.concatenate(
+            [catalog['position'] for catalog in catalogs.values()])[order]
+        loci_strand = np.concatenate(
+            [catalog['strand'] for catalog in catalogs.values()])[order]
+
+        buckets = np.arange(HALF_BUCKETS + 1, dtype=np.uint64)
+        left_offsets = np.searchsorted(
+            keys >> HALF_SHIFT, buckets).astype(np.uint64)
+        right = keys & HALF_MASK
+        right_order = np.argsort(right, kind='mergesort').astype(
+            np.uint32 if len(keys) < 2 ** 32 else np.uint64)
+        right_offsets = np.searchsorted(
+            right[right_order], buckets).astype(np.uint64)
+
+        return cls(keys, counts, loci_offsets, loci_chromosome,
+                   loci_position, loci_strand, left_offsets, right_order,
+                   right_offsets, chromosomes)
+
+    def save(self, filename_template):
+        for column in OFFTARGET_COLUMNS:
+            np.save(filename_template.format(column), getattr(self, column))
+
+    @classmethod
+    def load(cls, filename_template, mmap_mode='r'):
+        return cls(*[np.load(filename_template.format(column),
+                             mmap_mode=mmap_mode)
+                     for column in OFFTARGET_COLUMNS])
+
+    def loci(self, key_indices):
+        '''
+        :returns: tuple of arrays (key_indices, chromosome names, positions,
+            strands) with one entry per genome locus of the given keys
+        '''
+        key_indices = np.asarray(key_indices, dtype=np.int64)
+        starts = self.loci_offsets[key_indices].astype(np.int64)
+        counts = self.loci_offsets[key_indices + 1].astype(np.int64) - starts
+        loci = expand_ranges(starts, counts)
+        return (np.repeat(key_indices, counts),
+                self.chromosomes[self.loci_chromosome[loci]],
+                self.loci_position[loci],
+                self.loci_strand[loci])
+
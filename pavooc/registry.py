@@ -0,0 +1,109 @@
+'''
+Per-genome registry of the data the API server needs
+
+The process-wide configuration (GENOME, CHROMOSOMES) only fixes the default
+genome. The registry loads the assets of every requested genome lazily and
+side by side, e.g. hg19 and mm10 exons in one server process. The assets
+are the memoized loaders of pavooc.data called with the genome, so they
+share the cache (and CACHE_MEMORY_BUDGET) with the rest of the code base.
+'''
+import logging
+import threading
+
+from pavooc.config import SUPPORTED_GENOMES
+from pavooc.data import (cellline_mutation_trees, chromosomes, cns_trees,
+                         domain_interval_trees, exon_gene_index,
+                         exon_interval_trees, gencode_exons,
+                         gencode_gene_index, gene_cns_affection,
+                         gene_cns_celllines, gene_name_similarity,
+                         offtarget_index, read_gencode)
+
+# asset name -> memoized loader taking the genome as only argument
+ASSET_LOADERS = {
+    'gencode': read_gencode,
+    'exons': gencode_exons,
+    'gene_index': gencode_gene_index,
+    'exon_index': exon_gene_index,
+    'exon_trees': exon_interval_trees,
+    'chromosomes': chromosomes,
+    'cns_trees': cns_trees,
+    'mutation_trees': cellline_mutation_trees,
+    'gene_cns': gene_cns_affection,
+    'gene_cns_celllines': gene_cns_celllines,
+    'domain_trees': domain_interval_trees,
+    'gene_name_similarity': gene_name_similarity,
+    'offtarget_index': offtarget_index,
+}
+
+
+class GenomeAssets:
+    '''
+    Lazily loaded data of one genome build
+    '''
+
+    def __init__(self, genome):
+        self.genome = genome
+
+    def __getattr__(self, asset):
+        try:
+            loader = ASSET_LOADERS[asset]
+        except KeyError:
+            raise AttributeError(asset)
+        return loader(self.genome)
+
+    def sequence(self, chromosome, start, end):
+        '''
+        :returns: upper case sequence of [start, end) on a chromosome
+        '''
+        return self.chromosomes[chromosome][start:end]
+
+    def gene_sequence(self, gene_id):
+        '''
+        :returns: tuple (chromosome, start, sequence) spanning all exons of a
+            gene
+        '''
+        chromosome = self.exon_index.chromosome(gene_id)
+        start, end = self.exon_index.bounds(gene_id)
+        return chromosome, start, self.sequence(chromosome, start, end)
+
+    def preload(self, assets=('exons', 'exon_index')):
+        for asset in assets:
+            logging.info(f'Loading {asset} for {self.genome}')
+            getattr(self, asset)
+
+    def memory_usage(self):
+        '''
+        :returns: dict of loaded asset name to its estimated size in bytes
+        '''
+        usage = {}
+        for asset, loader in ASSET_LOADERS.items():
+            size = loader.cached_size(self.genome)
+            if size is not None:
+                usage[asset] = size
+        return usage
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def genome_assets(genome):
+    '''
+    :returns: the GenomeAssets of a genome
+    :raises ValueError: for unsupported genomes
+    '''
+    if genome not in SUPPORTED_GENOMES:
+        raise ValueError(f'{genome} not supported')
+    with _registry_lock:
+        if genome not in _registry:
+            _registry[genome] = GenomeAssets(genome)
+        return _registry[genome]
+
+
+def memory_usage():
+    '''
+    :returns: dict of genome to dict of asset to bytes for all loaded assets
+    '''
+    with _registry_lock:
+        registered = list(_registry.values())
+    return {assets.genome: assets.memory_usage() for assets in registered}
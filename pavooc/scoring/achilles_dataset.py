@@ -3,7 +3,8 @@ from skbio.sequence import DNA
 from gtfparse import read_gtf_as_dataframe
 
 from pavooc.config import ACHILLES_GUIDE_ACTIVITY_SCORES_FILE, \
-    ACHILLES_GUIDE_MAPPING, CHROMOSOME_RAW_FILE, GENCODE_HG38_FILE
+    ACHILLES_GUIDE_MAPPING, GENCODE_HG38_FILE
+from pavooc.data import chromosomes
 from pavooc.scoring.missing_gene_id_mappings import GENE_ID_MAPPING
 
 
@@ -22,22 +23,27 @@ def _find_context(guide, chromosome, position):
     OFFSET = 50
     if isinstance(position, str):
         position = int(position)
-    with open(CHROMOSOME_RAW_FILE.format(chromosome)) as f:
-        f.seek(position - OFFSET)
-        seq = f.read(2 * OFFSET + 20).upper()
-        index = seq.find(guide)
-        if index == -1:
-            rev_seq = str(DNA(seq).reverse_complement())
-            rev_index = rev_seq.find(guide)
-            assert rev_index >= 0, f'guide not found.. {chromosome} {position}'
-            ret = rev_seq[rev_index - 4:rev_index + 23 + 3]
-        else:
-            ret = seq[index - 4:index + 23 + 3]
-        if ret[25:27] != 'GG':
-            print(
-                f'gg required... {chromosome} {position} {guide}. Dropping :/')
-            return None, None
-        return ret, 'sense' if index == -1 else 'antisense'
+    chromosome_sequence = chromosomes()[chromosome]
+    # negative slice starts would wrap around instead of failing
+    if position < OFFSET or \
+            position + OFFSET + 20 > len(chromosome_sequence):
+        print(f'context out of bounds... {chromosome} {position} {guide}. '
+              'Dropping :/')
+        return None, None
+    seq = chromosome_sequence[position - OFFSET:position + OFFSET + 20]
+    index = seq.find(guide)
+    if index == -1:
+        rev_seq = str(DNA(seq).reverse_complement())
+        rev_index = rev_seq.find(guide)
+        assert rev_index >= 0, f'guide not found.. {chromosome} {position}'
+        ret = rev_seq[rev_index - 4:rev_index + 23 + 3]
+    else:
+        ret = seq[index - 4:index + 23 + 3]
+    if len(ret) != 30 or ret[25:27] != 'GG':
+        print(
+            f'gg required... {chromosome} {position} {guide}. Dropping :/')
+        return None, None
+    return ret, 'sense' if index == -1 else 'antisense'
 
 
 def load_dataset(drop_locus=True):
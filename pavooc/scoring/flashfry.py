@@ -1,21 +1,20 @@
+import logging
+import multiprocessing
 import subprocess
 import tempfile
 import os
 
+import numpy as np
 import pandas as pd
+from tqdm import tqdm
 
-from pavooc.config import GUIDES_FILE, SCORES_FILE, JAVA_RAM, \
-        COMPUTATION_CORES, FLASHFRY_DB_FILE, FLASHFRY_EXE
+from pavooc.config import GUIDES_FILE, SCORES_FILE, JAVA_RAM, GENOME, \
+        COMPUTATION_CORES, FLASHFRY_EXE, FLASHFRY_BATCH_SIZE, \
+        flashfry_db_file
+from pavooc.data import read_gencode
 
 
-def score(guides_file):
-    '''
-    Generates the scores implemented by flashfry
-    :returns: a dataframe with the scores
-    '''
-
-    scores_file = tempfile.NamedTemporaryFile(delete=False)
-    scores_file.close()
+def _run_score(guides_file, scores_file, genome=GENOME):
     result = subprocess.run([
         'java',
         '-Xmx{}M'.format(int((1024 * float(JAVA_RAM)) //
@@ -23,16 +22,110 @@ def score(guides_file):
         '-jar', FLASHFRY_EXE,
         '--analysis', 'score',
         '--input', guides_file,
-        '--output', scores_file.name,
+        '--output', scores_file,
         '--scoringMetrics',
         'doench2014ontarget,doench2016cfd,dangerous,hsu2013',
-        '--database', FLASHFRY_DB_FILE
+        '--database', flashfry_db_file(genome)
     ], stdout=subprocess.DEVNULL)
 
     if result.returncode != 0:
         raise RuntimeError(result)
 
+
+def score(guides_file, genome=GENOME):
+    '''
+    Generates the scores implemented by flashfry
+    :genome: the genome of the FlashFry database to score against
+    :returns: a dataframe with the scores
+    '''
+
+    scores_file = tempfile.NamedTemporaryFile(delete=False)
+    scores_file.close()
+    _run_score(guides_file, scores_file.name, genome)
+
     ret = pd.read_csv(scores_file.name, sep='\t', index_col=False)
     os.remove(scores_file.name)
     return ret
 
+
+def score_batch(gene_ids):
+    '''
+    Score the guides of several genes with one FlashFry run and save them
+    to the SCORES_FILE of each gene. The scores of a gene have the same row
+    order as its GUIDES_FILE (the same as score() returns)
+    :returns: list of the gene_ids which were scored
+    '''
+    tables = []
+    scored_gene_ids = []
+    for gene_id in gene_ids:
+        try:
+            tables.append(pd.read_csv(GUIDES_FILE.format(gene_id), sep='\t',
+                                      index_col=False, dtype=str,
+                                      keep_default_na=False))
+        except (FileNotFoundError, pd.errors.EmptyDataError) as e:
+            logging.warning('No guides to score for {}: {}'.format(gene_id, e))
+            continue
+        scored_gene_ids.append(gene_id)
+    guides = pd.concat(tables, ignore_index=True) if tables else None
+    if guides is None or len(guides) == 0:
+        return []
+
+    guides_file = tempfile.NamedTemporaryFile(delete=False)
+    scores_file = tempfile.NamedTemporaryFile(delete=False)
+    guides_file.close()
+    scores_file.close()
+    try:
+        guides.to_csv(guides_file.name, sep='\t', index=False)
+        _run_score(guides_file.name, scores_file.name)
+        scores = pd.read_csv(scores_file.name, sep='\t', index_col=False,
+                             dtype=str, keep_default_na=False)
+    finally:
+        os.remove(guides_file.name)
+        os.remove(scores_file.name)
+
+    # the key of a guide is (gene, row number). FlashFry keeps the input
+    # order, make sure it did
+    if len(scores) != len(guides) or \
+            (scores['target'].values != guides['target'].values).any():
+        raise RuntimeError('FlashFry scores do not match the batch guides')
+
+    boundaries = np.cumsum([0] + [len(table) for table in tables])
+    for gene_id, start, end in zip(scored_gene_ids, boundaries[:-1],
+                                   boundaries[1:]):
+        scores.iloc[start:end].to_csv(SCORES_FILE.format(gene_id), sep='\t',
+                                      index=False)
+    return scored_gene_ids
+
+
+def load_scores(gene_id):
+    '''
+    Scores of the guides of a gene as computed by score_batch. Falls back to
+    scoring the gene right away if they were not precomputed or are older
+    than the guides
+    :returns: a dataframe with the scores
+    '''
+    guides_file = GUIDES_FILE.format(gene_id)
+    scores_file = SCORES_FILE.format(gene_id)
+    if os.path.exists(scores_file) and \
+            os.path.getmtime(scores_file) >= os.path.getmtime(guides_file):
+        return pd.read_csv(scores_file, sep='\t', index_col=False)
+    return score(guides_file)
+
+
+def main():
+    '''
+    Score the guides of all genes in batches of FLASHFRY_BATCH_SIZE genes
+    '''
+    gene_ids = list(read_gencode().gene_id.drop_duplicates())
+    batches = [gene_ids[i:i + FLASHFRY_BATCH_SIZE]
+               for i in range(0, len(gene_ids), FLASHFRY_BATCH_SIZE)]
+    if COMPUTATION_CORES > 1:
+        # the workers only read guide files and run FlashFry, there is no
+        # data to preload
+        with multiprocessing.Pool(COMPUTATION_CORES) as pool:
+            for _ in tqdm(pool.imap_unordered(score_batch, batches),
+                          total=len(batches)):
+                pass
+    else:
+        for batch in tqdm(batches, total=len(batches)):
+            score_batch(batch)
@@ -11,14 +11,14 @@ from itertools import product
 import logging
 
 from pavooc.data import exon_interval_trees, read_gencode
-from pavooc.util import buffer_return_value
+from pavooc.util import memoize
 from pavooc.config import HAEUSSLER_SCORES_FILE, \
     CHROMOSOME_RAW_FILE, GENCODE_MM10_FILE
 
 
 MOUSE_CHROMOSOMES = ['chr{}'.format(v)
                      for v in range(1, 20)] + ['chrX', 'chrY']
-@buffer_return_value
+@memoize
 def mouse_gene_intervals():
     df = read_gtf_as_dataframe(GENCODE_MM10_FILE)
     df = df[df.feature == 'gene' & df.feature_type == 'protein_coding']
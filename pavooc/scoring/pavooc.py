@@ -8,7 +8,7 @@ import pandas as pd
 import torch
 from torch.autograd import Variable
 
-from pavooc.data import read_gencode, cnn38_model, feature_scaler
+from pavooc.data import gencode_gene_index, cnn38_model, feature_scaler
 from pavooc.preprocessing.extract_conservation_scores import find_guide_context, process_dataframe
 from pavooc.scoring.feature_extraction import extract_features
 
@@ -23,10 +23,10 @@ def score(gene_id, guides):
     if len(guides) == 0:
         return []
 
-    gene = read_gencode()[read_gencode().gene_id == gene_id].iloc[0]
+    chromosome = gencode_gene_index().chromosome(gene_id)
 
     cut_positions = guides.apply(lambda row: (
-        'hg19', gene.seqname, row['cut_position']), axis=1)
+        'hg19', chromosome, row['cut_position']), axis=1)
     conservation_scores = process_dataframe(cut_positions)
 
     # now build the azimuth-style feature data
@@ -3,6 +3,7 @@ The server application
 '''
 # TODO rename gene_ids to ensembl_ids
 
+import logging
 import os
 import sys
 import time
@@ -11,14 +12,17 @@ from os import path
 
 from flask import Flask, request
 from flask_restplus import Api, Resource, fields
-from pyfaidx import Fasta
 from werkzeug.exceptions import BadRequest
 
-from pavooc.config import BASEDIR, DEBUG, GENOME, GENOME_FILE  # noqa
-from pavooc.data import celllines, gencode_exons
+from pavooc.config import (BASEDIR, DEBUG, EDIT_TIMEOUT,  # noqa
+                           EDIT_OFFTARGET_BACKEND, EDIT_WORKERS,
+                           SERVER_GENOMES)
+from pavooc.data import azimuth_model, celllines, decode_celllines, preload
+from pavooc.registry import genome_assets, memory_usage
 from pavooc.db import guide_collection  # noqa
 from pavooc.preprocessing.exon_guide_search import generate_edit_guides
 from pavooc.preprocessing.generate_guide_bed import guides_to_bed
+from pavooc.server.workers import WorkerPool
 
 # bugfix server debugging
 sys.path.append(path.join(path.dirname(path.abspath(__file__)), '../..'))
@@ -27,6 +31,9 @@ sys.path.append(path.join(path.dirname(path.abspath(__file__)), '../..'))
 app = Flask(__name__)
 api = Api(app, doc='/api/')
 
+# resident processes for /api/edit, started by main()
+edit_workers = None
+
 
 @app.after_request
 def after_request(response):
@@ -43,7 +50,8 @@ guide_field = fields.Nested(api.model('Guide', {
     'aa_cut_position': fields.Integer,
     'otCount': fields.Integer,
     'orientation': fields.String,
-    'mutations': fields.List(fields.String),
+    # cellline names or, if not expanded, ids into InitialData.celllines
+    'mutations': fields.List(fields.Raw),
     'scores': fields.Nested(api.model('Score', {
         'azimuth': fields.Float,
         'pavooc': fields.Float,
@@ -73,6 +81,7 @@ exon_field = fields.Nested(api.model('Exon', {
 
 edit_input = api.model('EditInput', {
     'gene_id': fields.String,
+    'genome': fields.String,
     'edit_position': fields.Integer,
     'padding': fields.Integer,
 })
@@ -89,7 +98,10 @@ edit_output = api.model('EditGuides', {
 knockout_input = api.model('KnockoutInput', {
     'gene_ids': fields.List(fields.String),
     'edit': fields.Boolean(default=False),
-    'genome': fields.String()
+    'genome': fields.String(),
+    # cellline ids (indices into InitialData.celllines) are returned unless
+    # True
+    'expand_mutations': fields.Boolean(default=False)
 })
 
 knockout_output = api.model('KnockoutGuides', {
@@ -97,7 +109,7 @@ knockout_output = api.model('KnockoutGuides', {
     'gene_symbol': fields.String,
     'chromosome': fields.String,
     'strand': fields.String,
-    'cns': fields.List(fields.String),
+    'cns': fields.List(fields.Raw),
     'exons': fields.List(exon_field),
     'sequence': fields.String(default=''),
     'domains': fields.List(
@@ -140,6 +152,18 @@ initial_output = api.model('InitialData', {
 })
 
 
+def expand_celllines(gene):
+    '''
+    Replace the cellline ids in the cns and guide mutations of a gene
+    document by cellline names
+    '''
+    if 'cns' in gene:
+        gene['cns'] = decode_celllines(gene['cns'])
+    for guide in gene.get('guides', []):
+        guide['mutations'] = decode_celllines(guide['mutations'])
+    return gene
+
+
 @lru_cache()
 def gene_list():
     return list(guide_collection.find(
@@ -185,10 +209,12 @@ class KnockoutGuides(Resource):
         gene_ids = request.get_json(force=True)['gene_ids']
         edit = request.get_json(force=True)['edit']
         genome = request.get_json(force=True)['genome']
+        expand_mutations = request.get_json(force=True).get(
+            'expand_mutations', False)
         if not gene_ids:  # TODO improve
             raise BadRequest('gene_ids not set')
 
-        if genome not in ['hg19', 'mm10']:  #
+        if genome not in SERVER_GENOMES:
             raise BadRequest(f'{genome} not supported')
 
         if edit and len(gene_ids) != 1:
@@ -215,14 +241,10 @@ class KnockoutGuides(Resource):
             # }},
         ]
         result = list(guide_collection.aggregate(aggregation_pipeline))
+        if expand_mutations:
+            result = [expand_celllines(gene) for gene in result]
         if edit:
-            df = gencode_exons(genome)
-            exons = df[(df.gene_id == gene_ids[0])]
-            chromosome = exons.seqname.iloc[0]
-            # TODO here i have to change things..
-            fasta = Fasta(GENOME_FILE.format(GENOME), as_raw=True)
-
-            seq = fasta[chromosome][min(exons.start):max(exons.end)]
+            _, _, seq = genome_assets(genome).gene_sequence(gene_ids[0])
             # if self.strand == '-':  # i think this is done on the client...
             #     seq = seq.reverse.complement
             result[0]['sequence'] = seq
@@ -258,10 +280,10 @@ class Details(Resource):
 
         # gene_data = [{field: v[field] for field in fields} for v in genes]
 
-        return next(gene_data)
+        return expand_celllines(next(gene_data))
 
 
-# TODO edit is not necessary anymore.. also I didnot apply multi genome changes..
+# TODO edit is not necessary anymore..
 @ns.route('/edit')
 class EditGuides(Resource):
     @api.expect(edit_input)
@@ -269,21 +291,28 @@ class EditGuides(Resource):
     def post(self):
         data = request.get_json(force=True)
         gene_id = data['gene_id']
+        genome = data['genome']
         edit_position = data['edit_position']
 
         if not gene_id:  # TODO improve
             raise BadRequest('gene_id not set')
-        gene_data = guide_collection.find_one({'gene_id': gene_id})
+
+        if genome not in SERVER_GENOMES:
+            raise BadRequest(f'{genome} not supported')
+
+        gene_data = guide_collection.find_one(
+            {'gene_id': gene_id, 'genome': genome})
 
         output = {}
         output['edit_position'] = edit_position
         # TODO sequence to upper case in generate_edit_guides?
         output['sequence'], output['guides_before'], output['guides_after'] = \
-            generate_edit_guides(
+            (edit_workers or generate_edit_guides)(
             gene_id,
             gene_data['chromosome'],
             edit_position,
-            offset=data['padding'])
+            offset=data['padding'],
+            genome=genome)
 
         bed_url = f'{time.time()}.guides.bed'
         guides_to_bed(output['guides_before'] + output['guides_after'],
@@ -294,10 +323,38 @@ class EditGuides(Resource):
         return output
 
 
+def edit_assets():
+    '''
+    The genome assets (see pavooc.registry) generate_edit_guides needs, to
+    be preloaded before the edit workers are forked
+    '''
+    # mutation_trees are empty for genomes without CCLE data
+    assets = ['chromosomes', 'exon_index', 'exon_trees', 'mutation_trees',
+              'gene_name_similarity']
+    if EDIT_OFFTARGET_BACKEND == 'native':
+        assets.append('offtarget_index')
+    return assets
+
+
 def main():
-    # call them so that their results get buffered and are fastly accessible
-    for g in ['mm10', 'hg19']:
-        gencode_exons()
+    global edit_workers
+    # with DEBUG, the reloader runs main() in a parent process which only
+    # watches the files and restarts the serving child
+    if DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        app.run(debug=DEBUG, host='0.0.0.0')
+        return
+    # load them now so that they are fastly accessible
+    for genome in SERVER_GENOMES:
+        genome_assets(genome).preload()
+    for genome, usage in memory_usage().items():
+        logging.info('{} data: {}'.format(genome, ', '.join(
+            f'{asset} {size >> 20} MB' for asset, size in usage.items())))
+    if EDIT_WORKERS > 0:
+        for genome in SERVER_GENOMES:
+            genome_assets(genome).preload(edit_assets())
+        preload([azimuth_model])
+        edit_workers = WorkerPool(generate_edit_guides, EDIT_WORKERS,
+                                  EDIT_TIMEOUT)
     app.run(debug=DEBUG, host='0.0.0.0')
 
 
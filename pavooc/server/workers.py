@@ -0,0 +1,139 @@
+'''
+Resident worker processes for interactive requests
+
+The workers are forked from the server process after its data is preloaded,
+so they share it and every job starts warm. Jobs are sent over a Pipe, one
+job per worker at a time. A worker which dies or exceeds the timeout is
+killed and replaced by a new one, which is forked by a supervisor thread
+rather than by the (request) thread which ran the job. Each worker is the
+leader of its own process group and has its own temporary directory, so
+killing it also kills the programs it started (e.g. FlashFry) and removes
+the files of the aborted job.
+'''
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import threading
+
+_CONTEXT = multiprocessing.get_context('fork')
+
+
+def _serve(function, connection, directory):
+    '''
+    Worker loop: receive (args, kwargs), reply with ('ok', result) or
+    ('error', message)
+    '''
+    os.setpgrp()
+    tempfile.tempdir = directory
+    while True:
+        try:
+            args, kwargs = connection.recv()
+        except EOFError:  # the server is gone
+            return
+        try:
+            reply = ('ok', function(*args, **kwargs))
+        except Exception as e:
+            logging.exception('Worker job failed')
+            reply = ('error', '{}: {}'.format(type(e).__name__, e))
+        connection.send(reply)
+
+
+class WorkerPool:
+    '''
+    A fixed number of long-lived processes running one function
+    '''
+
+    def __init__(self, function, processes, timeout):
+        '''
+        :function: the function to run in the workers
+        :processes: number of worker processes
+        :timeout: seconds after which a job is aborted and its worker is
+            replaced
+        '''
+        self.function = function
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        for _ in range(processes):
+            self._idle.put(self._start_worker())
+        # one item per worker to start, None stops the supervisor
+        self._restarts = queue.Queue()
+        self._supervisor = threading.Thread(
+            target=self._supervise, name='worker-supervisor', daemon=True)
+        self._supervisor.start()
+
+    def _start_worker(self):
+        connection, child_connection = _CONTEXT.Pipe()
+        directory = tempfile.mkdtemp(prefix='pavooc-worker-')
+        process = _CONTEXT.Process(
+            target=_serve, args=(self.function, child_connection, directory),
+            daemon=True)
+        process.start()
+        child_connection.close()
+        return process, connection, directory
+
+    def _supervise(self):
+        '''
+        Start the replacements of killed workers
+        '''
+        while self._restarts.get() is not None:
+            try:
+                self._idle.put(self._start_worker())
+            except Exception:
+                logging.exception('Could not start a worker')
+
+    @staticmethod
+    def _kill(process, directory):
+        '''
+        Kill a worker with all its child processes and remove its files
+        '''
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:  # the worker and its children are gone
+            pass
+        process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def __call__(self, *args, **kwargs):
+        '''
+        Run the function in the next idle worker (blocks until one is idle)
+        :returns: the result of the function
+        :raises RuntimeError: if the job failed or its worker died
+        '''
+        worker = process, connection, directory = self._idle.get()
+        try:
+            connection.send((args, kwargs))
+            if not connection.poll(self.timeout):
+                raise TimeoutError('no result after {} seconds'
+                                   .format(self.timeout))
+            status, result = connection.recv()
+        except (EOFError, OSError) as e:
+            logging.error('Restarting worker {}: {}'.format(process.pid, e))
+            worker = None
+            self._kill(process, directory)
+            connection.close()
+            self._restarts.put(True)
+            raise RuntimeError('Worker failed: {}'.format(e)) from e
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        # pending replacements are started (and closed below) first
+        self._restarts.put(None)
+        self._supervisor.join()
+        while True:
+            try:
+                process, connection, directory = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()  # the worker loop ends on EOF
+            process.join(1)
+            self._kill(process, directory)
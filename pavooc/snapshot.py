@@ -0,0 +1,198 @@
+'''
+Versioned, columnar on-disk snapshots of DataFrames (and other array
+based values, see pavooc.intervals)
+
+Every column is saved as its own .npy file (str columns as fixed width
+unicode arrays with a separate null mask), so snapshots load without parsing
+and numeric columns stay memory-mapped. A snapshot is keyed by a fingerprint
+of its input files (path, size and modification time), arbitrary extra values
+(e.g. CHROMOSOMES), the version of the snapshotted loader and
+SNAPSHOT_VERSION. Changing any of them makes the snapshot stale, it is then
+recomputed and replaces the old one.
+'''
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import tempfile
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+from pavooc.config import SNAPSHOT_DIR
+
+# increment when the snapshot format changes. Changes of a snapshotted
+# computation increment the version of its loader (see snapshot)
+SNAPSHOT_VERSION = 2
+META_FILE = 'meta.json'
+INDEX_COLUMN = '__index__'
+
+
+def fingerprint(files, extra=()):
+    '''
+    :files: input files of the snapshotted computation
+    :extra: any repr-able values the computation depends on
+    :returns: hex digest
+    '''
+    digest = hashlib.sha1(str(SNAPSHOT_VERSION).encode())
+    for filename in files:
+        stat = os.stat(filename)
+        digest.update('{}:{}:{}'.format(os.path.abspath(filename),
+                                        stat.st_size,
+                                        stat.st_mtime_ns).encode())
+    digest.update(repr(tuple(extra)).encode())
+    return digest.hexdigest()
+
+
+def _is_numeric(series):
+    return series.dtype.kind in 'biuf'
+
+
+def save_frame(df, directory, meta=None):
+    '''
+    Save a DataFrame (including its index) column by column
+    :meta: dict of additional JSON-serializable information
+    '''
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    series_list = [pd.Series(df.index)] + [df[c] for c in df.columns]
+
+    for i, (column, series) in enumerate(
+            zip([INDEX_COLUMN] + list(df.columns), series_list)):
+        if _is_numeric(series):
+            values = series.to_numpy()
+            nulls = None
+        else:
+            nulls = series.isna().to_numpy()
+            values = series.where(~nulls, '').astype(str).to_numpy(
+                dtype='U')
+        np.save(os.path.join(directory, f'{i}.npy'), values)
+        if nulls is not None and nulls.any():
+            np.save(os.path.join(directory, f'{i}.null.npy'), nulls)
+        columns.append(str(column))
+
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION,
+                   'columns': columns,
+                   'index_name': df.index.name,
+                   'meta': meta or {}}, f)
+
+
+def load_frame(directory, mmap_mode='r'):
+    '''
+    Inverse of save_frame. Numeric columns are memory-mapped
+    '''
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        values = np.load(os.path.join(directory, f'{i}.npy'),
+                         mmap_mode=mmap_mode)
+        null_file = os.path.join(directory, f'{i}.null.npy')
+        if values.dtype.kind == 'U':
+            values = values.astype(object)
+            if os.path.exists(null_file):
+                values[np.load(null_file)] = np.nan
+        data[column] = values
+
+    df = pd.DataFrame(data, copy=False)
+    if INDEX_COLUMN in data:
+        df.set_index(INDEX_COLUMN, inplace=True)
+        df.index.name = meta['index_name']
+    return df
+
+
+def arguments_hash(arguments):
+    '''
+    :arguments: the bound arguments of a snapshotted call
+    :returns: short hex digest identifying the arguments
+    '''
+    return hashlib.sha1(repr(arguments).encode()).hexdigest()[:12]
+
+
+def snapshot_path(name, arguments, key):
+    return os.path.join(SNAPSHOT_DIR, f'{name}_{arguments}_{key}')
+
+
+def _remove_stale(name, arguments, key):
+    '''
+    Remove the older snapshots of the same name and arguments. Snapshots for
+    other arguments (e.g. other genomes) are kept
+    '''
+    prefix = f'{name}_{arguments}_'
+    for entry in os.listdir(SNAPSHOT_DIR):
+        if entry.startswith(prefix) and entry != prefix + key and \
+                len(entry) == len(prefix) + len(key):
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, entry),
+                          ignore_errors=True)
+
+
+def _load_frame_copy_on_write(directory):
+    # callers may modify the returned frame
+    return load_frame(directory, mmap_mode='c')
+
+
+def snapshot(name, files, extra=(), version=1, save=save_frame,
+             load=_load_frame_copy_on_write):
+    '''
+    Decorator persisting the DataFrame returned by the decorated function
+
+    :name: snapshot name. The function arguments (with defaults applied)
+        are part of the key, one snapshot is kept per distinct arguments
+    :files: function with the same arguments as the decorated function,
+        returning the list of input files
+    :extra: function with the same arguments as the decorated function,
+        returning additional key values
+    :version: version of the computation. Increment it whenever the
+        decorated function (or a snapshotted loader it uses) computes
+        something different from the same input files
+    :save, load: functions save(value, directory) and load(directory) to
+        persist values other than DataFrames. save must write META_FILE
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # read_gencode() and read_gencode('hg19') share their snapshot
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            args, kwargs = bound.args, bound.kwargs
+            arguments = tuple(bound.arguments.items())
+            try:
+                key = fingerprint(
+                    files(*args, **kwargs),
+                    (arguments, version) +
+                    tuple(extra(*args, **kwargs) if callable(extra)
+                          else extra))
+            except FileNotFoundError:
+                # nothing to fingerprint, let func deal with it
+                return func(*args, **kwargs)
+            arguments = arguments_hash(arguments)
+            path = snapshot_path(name, arguments, key)
+            if os.path.exists(os.path.join(path, META_FILE)):
+                logging.info(f'Loading snapshot {path}')
+                return load(path)
+
+            df = func(*args, **kwargs)
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            # write to a temporary directory first, so concurrent or
+            # interrupted runs never leave a half-written snapshot
+            tmp_path = tempfile.mkdtemp(dir=SNAPSHOT_DIR, prefix='.tmp_')
+            save(df, tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:  # another process was faster
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            _remove_stale(name, arguments, key)
+            logging.info(f'Saved snapshot {path}')
+            # serve the memory-mapped snapshot right away, not the computed
+            # value, so processes forked later share its pages
+            return load(path)
+
+        return wrapper
+    return decorator
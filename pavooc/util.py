@@ -1,12 +1,26 @@
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
 import pandas as pd
 
+from pavooc.config import CACHE_MEMORY_BUDGET
+from pavooc.genome import ALPHABET, N_CODE, encode_bases
+
+MAX_K = 32
 
-def kmer_to_int(kmer):
-    '''Transform a 20bp DNA sequence to a 64 bit integer'''
+
+def kmer_to_int(kmer, k=20):
+    '''Transform a k bp (default 20) DNA sequence to a 64 bit integer'''
     code = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
 
-    if len(kmer) != 20:
-        raise ValueError('Only 20mers supported')
+    if len(kmer) != k:
+        raise ValueError('Only {}mers supported'.format(k))
 
     v = 0
     for i, c in enumerate(str(kmer)):
@@ -16,28 +30,273 @@ def kmer_to_int(kmer):
     return v
 
 
-def int_to_kmer(v):
-    '''Transform a 64 bit integer to a 20mer DNA sequence'''
+def int_to_kmer(v, k=20):
+    '''Transform a 64 bit integer to a k bp (default 20) DNA sequence'''
     code = ['A', 'C', 'G', 'T']
 
     kmer = ''
 
-    for i in range(20):
+    for i in range(k):
         kmer = code[v & 3] + kmer
         v >>= 2
 
     return kmer
 
 
-def buffer_return_value(func):
-    def wrapper(*args, **kwargs):
-        if isinstance(wrapper.buffer, type(None)):
-            wrapper.buffer = func(*args, **kwargs)
-        return wrapper.buffer
+def _shifts(k):
+    if not 0 < k <= MAX_K:
+        raise ValueError('k must be between 1 and {}'.format(MAX_K))
+    return np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+
+
+def codes_to_ints(codes):
+    '''
+    2-bit encode rows of base codes (see pavooc.genome.encode_bases)
+    :codes: 2D uint8 array with one k-mer (k <= 32) per row. Codes must be
+        0-3 (no N)
+    :returns: uint64 array
+    '''
+    codes = np.asarray(codes)
+    return np.bitwise_or.reduce(
+        codes.astype(np.uint64) << _shifts(codes.shape[1]), axis=1)
+
+
+def kmers_to_ints(kmers, k=20, return_valid=False):
+    '''
+    Vectorized kmer_to_int
+    :kmers: array-like of str or bytes, all of length k
+    :k: k-mer length, up to 32
+    :return_valid: by default k-mers containing N (or any other non-ACGT
+        character) raise a ValueError. If True, they are encoded as 0 and a
+        boolean array marking the valid k-mers is returned in addition
+    :returns: uint64 array (, valid array)
+    '''
+    kmers = np.asarray(kmers)
+    if len(kmers) == 0:
+        values = np.zeros(0, dtype=np.uint64)
+        return (values, np.zeros(0, dtype=bool)) if return_valid else values
+    kmers = kmers.astype('S')
+    if kmers.dtype.itemsize != k or \
+            np.any(np.char.str_len(kmers) != k):
+        raise ValueError('Only {}mers supported'.format(k))
+
+    codes = encode_bases(kmers.tobytes()).reshape(len(kmers), k)
+    valid = np.all(codes != N_CODE, axis=1)
+    if not return_valid and not valid.all():
+        raise ValueError('{} k-mers contain non-ACGT bases, e.g. {}'.format(
+            (~valid).sum(), kmers[~valid][0]))
+    codes[~valid] = 0
+    values = codes_to_ints(codes)
+
+    return (values, valid) if return_valid else values
+
+
+def ints_to_kmers(values, k=20):
+    '''
+    Vectorized int_to_kmer
+    :values: uint64 array
+    :returns: bytes array (dtype S<k>)
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    codes = (values[:, None] >> _shifts(k)) & np.uint64(3)
+    return np.ascontiguousarray(ALPHABET[codes]).view('S{}'.format(k)) \
+        .ravel()
+
+
+def expand_ranges(starts, counts):
+    '''
+    :returns: concatenation of arange(start, start + count) for all pairs
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.asarray(starts, dtype=np.int64), counts) + \
+        np.arange(total, dtype=np.int64) - offsets
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'loads', 'load_time',
+                                     'entries', 'nbytes'])
+
+# all cached values of all memoized functions in least recently used order,
+# (function, key) -> estimated size in bytes
+_cache_entries = OrderedDict()
+_cache_lock = threading.RLock()
+
+
+def estimate_size(value, _depth=0):
+    '''
+    Rough memory footprint of a cached value in bytes. Uses nbytes (numpy,
+    PackedChromosome, ProtospacerIndex), memory_usage (pandas) and recurses
+    into containers (two levels deep)
+    '''
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    size = sys.getsizeof(value)
+    if _depth < 2:
+        if isinstance(value, dict):
+            size += sum(estimate_size(v, _depth + 1) for v in value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(v, _depth + 1) for v in value)
+    return size
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _account(function, key, size):
+    '''
+    Register a new cache entry and evict the least recently used entries
+    (of any memoized function) while the memory budget is exceeded
+    '''
+    with _cache_lock:
+        _cache_entries[(function, key)] = size
+        total = sum(_cache_entries.values())
+        while CACHE_MEMORY_BUDGET and total > CACHE_MEMORY_BUDGET and \
+                len(_cache_entries) > 1:
+            (evicted, evicted_key), evicted_size = \
+                _cache_entries.popitem(last=False)
+            evicted._evict(evicted_key)
+            total -= evicted_size
+            logging.info('Evicted {}{} from the cache ({} MB)'.format(
+                evicted.__name__, evicted_key, evicted_size >> 20))
+
+
+class _Memoized:
+    '''
+    See memoize
+    '''
+
+    def __init__(self, func):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.signature = inspect.signature(func)
+        self.cache = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_time = 0.0
+
+    def _key(self, args, kwargs):
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return tuple((name, _hashable(value))
+                     for name, value in bound.arguments.items())
+
+    def _lookup(self, key):
+        # called with self._lock held. Lock order is _cache_lock before
+        # self._lock (see _account), so _cache_lock must not be taken here
+        if key in self.cache:
+            self.hits += 1
+            return True, self.cache[key]
+        return False, None
+
+    def _touch(self, key):
+        '''
+        Mark the entry as most recently used (self._lock must not be held)
+        '''
+        with _cache_lock:
+            if (self, key) in _cache_entries:
+                _cache_entries.move_to_end((self, key))
+
+    def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        with self._lock:
+            found, value = self._lookup(key)
+            if not found:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if found:
+            self._touch(key)
+            return value
+
+        # single flight: concurrent first calls wait for one load
+        with key_lock:
+            with self._lock:
+                found, value = self._lookup(key)
+                if not found:
+                    self.misses += 1
+            if found:
+                self._touch(key)
+                return value
 
-    wrapper.buffer = None
+            start = time.time()
+            value = self.func(*args, **kwargs)
+            duration = time.time() - start
 
-    return wrapper
+            with self._lock:
+                self.cache[key] = value
+                self.loads += 1
+                self.load_time += duration
+                self._key_locks.pop(key, None)
+        _account(self, key, estimate_size(value))
+        return value
+
+    def cached_size(self, *args, **kwargs):
+        '''
+        :returns: estimated size in bytes of the value cached for the given
+            arguments or None if it is not cached
+        '''
+        with _cache_lock:
+            return _cache_entries.get((self, self._key(args, kwargs)))
+
+    def _evict(self, key):
+        with self._lock:
+            self.cache.pop(key, None)
+
+    def cache_info(self):
+        with _cache_lock:
+            nbytes = sum(size for (function, _), size
+                         in _cache_entries.items() if function is self)
+        return CacheInfo(self.hits, self.misses, self.loads, self.load_time,
+                         len(self.cache), nbytes)
+
+    def cache_clear(self):
+        with self._lock:
+            self.cache.clear()
+            self.hits = self.misses = self.loads = 0
+            self.load_time = 0.0
+        with _cache_lock:
+            for entry in [entry for entry in _cache_entries
+                          if entry[0] is self]:
+                del _cache_entries[entry]
+
+    def __repr__(self):
+        return '<memoized {}>'.format(self.__name__)
+
+
+def memoize(func):
+    '''
+    Cache the return values of a loader, keyed by its (normalized) arguments
+
+    - f('hg19') and f(genome='hg19') share one entry, defaults are applied
+    - thread safe. Concurrent first calls with the same arguments load once
+    - all memoized values share the CACHE_MEMORY_BUDGET (bytes, 0 for
+      unlimited). The least recently used values are evicted first
+    - f.cache_info() reports hits, misses, loads, load time and size,
+      f.cache_clear() empties the cache
+    '''
+    return _Memoized(func)
+
+
+def cache_info():
+    '''
+    :returns: dict of function name to CacheInfo for all memoized functions
+        with cached values
+    '''
+    with _cache_lock:
+        functions = {function for function, _ in _cache_entries}
+    return {function.__qualname__: function.cache_info()
+            for function in functions}
 
 
 def read_guides(guides_file):
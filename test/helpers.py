@@ -1,7 +1,7 @@
 import pandas as pd
 
 
-def mock_read_gtf_as_dataframe(filename):
+def mock_read_gtf_as_dataframe(filename, **kwargs):
     # 'start' AND 'end' are included and are 1-indexed. to transform to proper
     # indexing, just do start-=1 and leave end as is.
     # in our case here, all exons are in-frame (dividable by 3)
@@ -119,6 +119,10 @@ def mock_read_gtf_as_dataframe(filename):
         gene3, gene3_transcript1, gene3_transcript1_exon1
     ])
 
+    # GENCODE ids are versioned (read_gencode strips the version)
+    for key in ['gene_id', 'transcript_id', 'exon_id', 'protein_id']:
+        df[key] = df[key].map(lambda v: v + '.1' if v else v)
+
     # add unused keys
     for key in [
             'ccdsid', 'frame', 'gene_status', 'havana_gene',
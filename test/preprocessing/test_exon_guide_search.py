@@ -1,4 +1,10 @@
 import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from pavooc.intervals import build_interval_indexes, records
 from pavooc.util import read_guides
 from pavooc.preprocessing import exon_guide_search
 
@@ -39,4 +45,97 @@ AAAAAAAAAAAACCAATTTTTTAAAAAAAAAAAAAAAA''')
     eq_(set(df[df['orientation'] == 'RVS'].start), {12, 17})
 
 
+def test_flashfry_guides_native_backend():
+    with mock.patch.object(exon_guide_search.offtarget_search, 'discover',
+                           return_value='targets') as discover, \
+            mock.patch.object(exon_guide_search.subprocess, 'run') as run:
+        eq_(exon_guide_search.flashfry_guides('seqs', 'targets',
+                                              backend='native',
+                                              genome='hg19'),
+            'targets')
+    discover.assert_called_once_with('seqs', 'targets', genome='hg19')
+    run.assert_not_called()
+
+
 # TODO test_generate_exon_guides test_off_targets_relevant
+
+
+def test_batch_split():
+    directory = tempfile.mkdtemp()
+    with mock.patch.object(exon_guide_search, 'EXON_DIR', directory), \
+            mock.patch.object(exon_guide_search, 'GUIDES_FILE',
+                              os.path.join(directory, '{}.guides')):
+        _test_batch_split()
+
+
+def _test_batch_split():
+    gene_files = {
+        'GB1': '>E1;+;0;9;T1:1\nACGT\n>E2;+;20;29;T1:2\nTTTT\n',
+        'GB2': '>E2;+;20;29;T2:1\nTTTT\n',
+        'GB3': '>E3;-;50;59;T3:1\nGGGG\n'}
+    for gene_id, exons in gene_files.items():
+        with open(os.path.join(exon_guide_search.EXON_DIR, gene_id),
+                  'w') as f:
+            f.write(exons)
+    batch_file = os.path.join(exon_guide_search.EXON_DIR, 'batch.fa')
+    exon_genes = exon_guide_search.write_batch_fasta(
+        ['GB1', 'GB2', 'GB3'], batch_file)
+
+    eq_(exon_genes, {'E1': ['GB1'], 'E2': ['GB1', 'GB2'], 'E3': ['GB3']})
+    with open(batch_file) as f:  # the shared exon is searched only once
+        eq_(f.read().count('>E2;'), 1)
+
+    target_file = os.path.join(exon_guide_search.EXON_DIR, 'batch.guides')
+    with open(target_file, 'w') as f:
+        f.write('contig\tstart\totCount\n'
+                'E1;+;0;9;T1:1\t3\t0\n'
+                'E2;+;20;29;T1:2\t5\t1\n')
+    exon_guide_search.split_batch_guides(
+        target_file, exon_genes, ['GB1', 'GB2', 'GB3'])
+
+    guides = {gene_id: pd.read_csv(exon_guide_search.GUIDES_FILE.format(
+        gene_id), sep='\t') for gene_id in ['GB1', 'GB2', 'GB3']}
+    eq_(list(guides['GB1'].start), [3, 5])
+    eq_(list(guides['GB2'].contig), ['E2;+;20;29;T1:2'])
+    eq_(list(guides['GB3'].columns), ['contig', 'start', 'otCount'])
+    eq_(len(guides['GB3']), 0)
+
+
+def test_parse_off_targets():
+    loci = exon_guide_search.parse_off_targets(pd.Series(
+        ['{}_2_0<chr1:10^F|chr2:20^R>,{}_1_3<chr1:5^R>'.format(
+            'A' * 23, 'C' * 23)], index=[7]))
+
+    eq_(list(loci.guide), [7, 7, 7])
+    eq_(list(loci.entry), [0, 0, 1])
+    eq_(list(loci.locus), [0, 1, 0])
+    eq_(list(loci.chromosome), ['chr1', 'chr2', 'chr1'])
+    eq_(list(loci.position), [10, 20, 5])
+    eq_(list(loci.strand), ['F', 'R', 'R'])
+    eq_(list(loci.occurences), [2, 2, 1])
+    eq_(list(loci.mismatch_count), [0, 0, 3])
+
+
+def test_relevant_off_targets():
+    trees = build_interval_indexes(
+        ['chr1'], ['chr1', 'chr1'], [20, 100], [30, 110],
+        records(gene_id=np.array(['GA', 'GB'], dtype=object)))
+    off_targets = pd.Series([
+        # first locus in GA (same gene), second one in GB
+        '{}_2_0<chr1:10^F|chr1:90^F>'.format('A' * 23),
+        # in GA only, and a GB hit with mismatches
+        '{}_1_0<chr1:10^F>,{}_1_2<chr1:90^F>'.format('A' * 23, 'C' * 23),
+        # no exon
+        '{}_3_0<chr1:500^R>'.format('A' * 23)], index=[0, 1, 2])
+    mismatches = {}
+    with mock.patch.object(exon_guide_search, 'exon_interval_trees',
+                           return_value=trees) as exon_interval_trees, \
+            mock.patch.object(exon_guide_search, 'gene_names_similar',
+                              side_effect=lambda a, b, genome: a == b):
+        relevant = exon_guide_search.relevant_off_targets(
+            exon_guide_search.parse_off_targets(off_targets), 'GA',
+            mismatches, 'hg19')
+    exon_interval_trees.assert_called_once_with('hg19')
+
+    eq_(list(relevant), [0])
+    eq_(mismatches, {(True, 0): 5, (False, 0): 3})
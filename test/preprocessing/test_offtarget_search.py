@@ -0,0 +1,111 @@
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import eq_
+import numpy as np
+
+from pavooc.genome import (PackedChromosome, encode_bases,
+                           write_packed_chromosome)
+from pavooc.preprocessing.exon_guide_search import parse_off_targets
+from pavooc.preprocessing.offtarget_search import (find_targets,
+                                                   mismatch_counts,
+                                                   off_targets, search,
+                                                   variant_masks)
+from pavooc.preprocessing.sgrna_finder import scan_codes
+from pavooc.protospacer_index import OffTargetIndex
+from pavooc.util import kmer_to_int
+
+
+def _random_index(size, seed=0):
+    random = np.random.RandomState(seed)
+    protospacers = random.randint(0, 2 ** 40, size=size, dtype=np.uint64)
+    catalog = {'position': np.arange(size, dtype=np.uint32),
+               'strand': np.full(size, b'+', 'S1'),
+               'protospacer': protospacers}
+    return OffTargetIndex.build({'chrA': catalog}), random
+
+
+def test_mismatch_counts():
+    a = kmer_to_int('ACGTACGTACGTACGTACGT')
+    b = kmer_to_int('ACGTACGTACGAACGTACGC')
+    eq_(mismatch_counts(np.array([a, a]), np.array([a, b])).tolist(), [0, 2])
+
+
+def test_variant_masks():
+    eq_(len(variant_masks(10, 2)), 1 + 10 * 3 + 45 * 9)
+    eq_(len(set(variant_masks(10, 2).tolist())), 436)
+
+
+def test_search_matches_brute_force():
+    index, random = _random_index(5000)
+    queries = np.array(index.keys[random.randint(0, len(index), 20)])
+    # mutate a few bases of every query
+    for i in range(len(queries)):
+        for position in random.choice(20, i % 6, replace=False):
+            queries[i] ^= np.uint64(random.randint(1, 4)) << \
+                np.uint64(2 * position)
+
+    query_ids, key_ids, mismatches = search(queries, index, max_mismatch=4)
+
+    expected = set()
+    for i, query in enumerate(queries):
+        counts = mismatch_counts(np.asarray(index.keys), query)
+        expected.update((i, key, counts[key])
+                        for key in np.flatnonzero(counts <= 4))
+    eq_(set(zip(query_ids.tolist(), key_ids.tolist(), mismatches.tolist())),
+        expected)
+    eq_(len(query_ids), len(expected))
+
+
+def _genome_index(sequence):
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'chrA.bin')
+    write_packed_chromosome(filename, sequence)
+    position, strand, protospacer = scan_codes(encode_bases(sequence))
+    index = OffTargetIndex.build({'chrA': {'position': position,
+                                           'strand': strand,
+                                           'protospacer': protospacer}})
+    return index, {'chrA': PackedChromosome(filename)}
+
+
+def test_off_targets_flashfry_format():
+    random = np.random.RandomState(1)
+    sequence = ''.join(random.choice(list('ACGT'), 300))
+    # the first 60 bases occur twice in the genome
+    sequence += sequence[:60]
+    index, genome = _genome_index(sequence)
+    targets = find_targets([('query', sequence[:100])])
+    assert (targets.orientation == 'FWD').any()
+    assert (targets.orientation == 'RVS').any()
+
+    with mock.patch('pavooc.preprocessing.offtarget_search.chromosomes',
+                    return_value=genome):
+        result = off_targets(targets, index, max_mismatch=3,
+                             maximum_off_targets=100)
+        overflowing = off_targets(targets, index, max_mismatch=3,
+                                  maximum_off_targets=1)
+
+    loci = parse_off_targets(result['offTargets'])
+    eq_(set(loci.guide), set(targets.index))
+    eq_(list(loci.groupby(['guide', 'entry']).size()),
+        list(loci.groupby(['guide', 'entry']).occurences.first()))
+    eq_(list(result.otCount),
+        list(loci.groupby(['guide', 'entry']).occurences.first()
+             .groupby(level=0).sum()))
+
+    # every target finds itself (and its copy) without mismatches, with the
+    # PAM it has in the genome
+    for guide, target in targets.iterrows():
+        hits = loci[(loci.guide == guide) & (loci.mismatch_count == 0)]
+        eq_(set(hits.protospacer), {target.target})
+        strand = 'F' if target.orientation == 'FWD' else 'R'
+        assert ('chrA', target.start, strand) in \
+            set(zip(hits.chromosome, hits.position, hits.strand))
+        if target.stop <= 60:
+            eq_(set(hits.occurences), {2})
+            eq_(set(hits.position), {target.start, target.start + 300})
+
+    eq_(set(result.overflow), {'OK'})
+    eq_(list(overflowing.overflow == 'OVERFLOW'),
+        list(result.otCount > 1))
@@ -0,0 +1,24 @@
+from nose.tools import eq_
+
+from pavooc.genome import encode_bases
+from pavooc.preprocessing.sgrna_finder import scan_codes
+from pavooc.util import int_to_kmer
+
+
+def test_scan_codes():
+    protospacer_a = 'AACGTACGTACGTACGTACT'
+    sequence = 'A' + 'CCT' + protospacer_a + 'AGG' + 'T' + \
+        'TTTTTTTTTNTTTTTTTTTT' + 'AGG'
+    position, strand, protospacer = scan_codes(encode_bases(sequence))
+
+    # the CCN site at 1 uses protospacer_a in reverse direction
+    eq_(list(position), [1, 4])
+    eq_(list(strand), [b'-', b'+'])
+    eq_(int_to_kmer(int(protospacer[0])), 'AGTACGTACGTACGTACGTT')
+    eq_(int_to_kmer(int(protospacer[1])), protospacer_a)
+    # the NGG site at the end is skipped because it contains an N
+
+
+def test_scan_codes_short_sequence():
+    position, strand, protospacer = scan_codes(encode_bases('ACGG'))
+    eq_(len(position), 0)
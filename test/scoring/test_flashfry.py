@@ -0,0 +1,37 @@
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import eq_
+import pandas as pd
+
+from pavooc.scoring import flashfry
+
+
+def _fake_score(guides_file, scores_file):
+    guides = pd.read_csv(guides_file, sep='\t')
+    guides['Hsu2013'] = guides['start'] * 10
+    guides.to_csv(scores_file, sep='\t', index=False)
+
+
+def test_score_batch():
+    directory = tempfile.mkdtemp()
+    guides_file = os.path.join(directory, '{}.guides')
+    scores_file = os.path.join(directory, '{}.guides.scores')
+    pd.DataFrame({'target': ['AAA', 'CCC'], 'start': [1, 2]}).to_csv(
+        guides_file.format('GA'), sep='\t', index=False)
+    pd.DataFrame({'target': ['GGG'], 'start': [3]}).to_csv(
+        guides_file.format('GB'), sep='\t', index=False)
+
+    with mock.patch.object(flashfry, 'GUIDES_FILE', guides_file), \
+            mock.patch.object(flashfry, 'SCORES_FILE', scores_file), \
+            mock.patch.object(flashfry, '_run_score',
+                              side_effect=_fake_score) as run_score:
+        eq_(flashfry.score_batch(['GA', 'GMISSING', 'GB']), ['GA', 'GB'])
+        eq_(run_score.call_count, 1)
+
+        scores = flashfry.load_scores('GA')
+        eq_(list(scores.target), ['AAA', 'CCC'])
+        eq_(list(scores.Hsu2013), [10, 20])
+        eq_(list(flashfry.load_scores('GB').Hsu2013), [30])
+        eq_(run_score.call_count, 1)
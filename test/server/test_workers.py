@@ -0,0 +1,121 @@
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from nose.tools import eq_, raises
+
+from pavooc.server.workers import WorkerPool
+
+
+def _job(action, value=0):
+    if action == 'fail':
+        raise ValueError('bad value {}'.format(value))
+    if action == 'die':
+        os._exit(1)
+    return value * 2, os.getpid()
+
+
+def test_worker_pool():
+    pool = WorkerPool(_job, processes=1, timeout=10)
+    try:
+        result, pid = pool('double', 21)
+        eq_(result, 42)
+        assert pid != os.getpid()
+        # the same warm process serves the next job
+        eq_(pool('double', value=1), (2, pid))
+
+        try:
+            pool('fail', 3)
+        except RuntimeError as e:
+            eq_(str(e), 'ValueError: bad value 3')
+        else:
+            raise AssertionError('RuntimeError expected')
+        eq_(pool('double', 2)[1], pid)  # a failing job keeps its worker
+
+        try:
+            pool('die')
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('RuntimeError expected')
+        result, new_pid = pool('double', 3)
+        eq_(result, 6)
+        assert new_pid != pid  # the dead worker was replaced
+    finally:
+        pool.close()
+
+
+def test_worker_pool_restarts_from_supervisor():
+    pool = WorkerPool(_job, processes=1, timeout=10)
+    starting_threads = []
+    start_worker = pool._start_worker
+
+    def record_start_worker():
+        starting_threads.append(threading.current_thread())
+        return start_worker()
+
+    pool._start_worker = record_start_worker
+    try:
+        try:
+            pool('die')
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('RuntimeError expected')
+        eq_(pool('double', 1)[0], 2)
+        eq_(starting_threads, [pool._supervisor])
+    finally:
+        pool.close()
+    assert not pool._supervisor.is_alive()
+
+
+@raises(RuntimeError)
+def test_worker_pool_timeout():
+    pool = WorkerPool(lambda: __import__('time').sleep(5), processes=1,
+                      timeout=0.1)
+    try:
+        pool()
+    finally:
+        pool.close()
+
+
+def _start_child(pid_file):
+    child = subprocess.Popen(['sleep', '30'])
+    with open(pid_file, 'w') as f:
+        f.write(str(child.pid))
+    tempfile.NamedTemporaryFile(delete=False).close()
+    time.sleep(30)
+
+
+def _alive(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_worker_pool_timeout_kills_children():
+    pid_file = tempfile.NamedTemporaryFile(delete=False).name
+    pool = WorkerPool(_start_child, processes=1, timeout=1)
+    (_, _, directory), = list(pool._idle.queue)
+    try:
+        try:
+            pool(pid_file)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('RuntimeError expected')
+        with open(pid_file) as f:
+            child = int(f.read())
+        for _ in range(50):
+            if not _alive(child):
+                break
+            time.sleep(0.1)
+        assert not _alive(child)
+        assert not os.path.exists(directory)
+    finally:
+        pool.close()
+        os.remove(pid_file)
@@ -1,31 +1,26 @@
+import gc
+import os
+import tempfile
 from unittest import mock
 from nose.tools import eq_
 
+import numpy as np
 import pandas as pd
 
 
-from pavooc.config import PROTEIN_ID_MAPPING_FILE
+from pavooc.config import GENOME
 from pavooc import data
+from pavooc.intervals import build_interval_indexes, records
 
 from test.helpers import mock_read_gtf_as_dataframe
 
 # mock chromosomes
 data.CHROMOSOMES = ['chrA']
+data.genome_chromosomes = lambda genome: ['chrA']
 
 
-def mock_read_appris():
-    return pd.DataFrame({
-        'gene_symbol': ['NA', 'NA', 'NA', 'NA'],
-        'transcript_id': ['TA1', 'TA2', 'TB1', 'TC1'],
-        'ccds_id': ['CCDS1', 'CCDS1', 'CCDS2', 'CCDS3'],
-        'type': ['PRINCIPAL:1', 'PRINCIPAL:1', 'PRINCIPAL:1', 'PRINCIPAL:1']
-    }, index=pd.Index(name='gene_id', data=['GA', 'GA', 'GB', 'GC']))
-
-
-def mock_read_protein_id_mapping_csv(filename, *args, **kwargs):
-    print('im here')
-    assert filename == PROTEIN_ID_MAPPING_FILE, \
-        'this mock only fits for {}'.format(PROTEIN_ID_MAPPING_FILE)
+def mock_load_protein_mapping(genome=GENOME):
+    assert genome == GENOME, 'this mock only fits for {}'.format(GENOME)
 
     return pd.DataFrame({
         'swissprot_id': ['SP1', 'SP2', 'SOMETHINGELSE'],
@@ -33,10 +28,11 @@ def mock_read_protein_id_mapping_csv(filename, *args, **kwargs):
         'protein_id': ['PA', 'PB', 'ABC']})
 
 
-# why does the upper patch not work???
+# without input files there is no snapshot to load
+@mock.patch.dict('pavooc.data.GENCODE_FILES', {GENOME: '/nonexistent.gtf'})
 @mock.patch('pavooc.data.load_protein_mapping',
-            side_effect=mock_read_protein_id_mapping_csv)
-@mock.patch('gtfparse.read_gtf_as_dataframe',
+            side_effect=mock_load_protein_mapping)
+@mock.patch('pavooc.data.read_gtf',
             side_effect=mock_read_gtf_as_dataframe)
 def test_read_gencode(mocked_gtf, mocked_protein_mapping):
     '''only
@@ -44,7 +40,10 @@ def test_read_gencode(mocked_gtf, mocked_protein_mapping):
     read_gencode should return only one copy of gene2
     '''
 
+    data.read_gencode.cache_clear()
     df = data.read_gencode()
+    data.read_gencode.cache_clear()
+    mocked_protein_mapping.assert_called_once_with(GENOME)
 
     # check that the correct columns are returned
     eq_(set(df.columns), {
@@ -73,22 +72,212 @@ def test_read_gencode(mocked_gtf, mocked_protein_mapping):
     eq_(list(df[(df.protein_id == 'PB')].swissprot_id.drop_duplicates()),
         ['SP2'])
 
+    # only the best transcript of a gene is kept
+    eq_(list(df[df.feature == 'transcript'].transcript_id), ['TA1', 'TB1'])
+
     # no swissprot_id for a protein_id shouldn't delete that row
-    assert (df.protein_id == 'PA2').any()
+    mocked_protein_mapping.side_effect = \
+        lambda genome: mock_load_protein_mapping(genome).iloc[[0, 2]]
+    data.read_gencode.cache_clear()
+    df = data.read_gencode()
+    data.read_gencode.cache_clear()
+    eq_(len(df[df.gene_id == 'GB']), 3)
+    assert df[df.protein_id == 'PB'].swissprot_id.isna().all()
 
     # TODO test that non protein_coding gene_types are ignored
 
 
-@mock.patch('pavooc.data.read_appris',
-            side_effect=mock_read_appris)
-@mock.patch('pavooc.data.read_gtf_as_dataframe',
+@mock.patch.dict('pavooc.data.GENCODE_FILES', {GENOME: '/nonexistent.gtf'})
+@mock.patch('pavooc.data.load_protein_mapping',
+            side_effect=mock_load_protein_mapping)
+@mock.patch('pavooc.data.read_gtf',
             side_effect=mock_read_gtf_as_dataframe)
-def test_gencode_exons(mocked_gtf, mocked_appris):
+def test_gencode_exons(mocked_gtf, mocked_protein_mapping):
+    data.read_gencode.cache_clear()
+    data.gencode_exons.cache_clear()
     df = data.gencode_exons()
+    data.read_gencode.cache_clear()
+    data.gencode_exons.cache_clear()
     eq_(set(df.index), {'EA1', 'EA2', 'EB1'})
     eq_(df.index.name, 'exon_id')
     # EA1 does only exist once because we only took the first
     # principal transcript
     eq_(len(df), 3)
+    # the GTF is read with the row filters of read_gencode
+    eq_(mocked_gtf.call_args[1]['seqnames'], ['chrA'])
+    eq_(mocked_gtf.call_args[1]['gene_types'], ['protein_coding'])
+
+
+GTF = '''##description: test
+chrA\tHAVANA\tgene\t11\t30\t.\t-\t.\tgene_id "GA.1"; gene_type "protein_coding"; gene_name "NA";
+chrA\tHAVANA\ttranscript\t11\t30\t.\t-\t.\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding"; transcript_type "protein_coding"; gene_name "NA"; tag "basic"; tag "appris_principal_1"; protein_id "PA.1";
+chrA\tHAVANA\texon\t26\t30\t.\t-\t.\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding"; transcript_type "protein_coding"; gene_name "NA"; exon_number 1; exon_id "EA1.1"; tag "basic"; protein_id "PA.1";
+chrA\tHAVANA\tCDS\t26\t30\t.\t-\t0\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding"; tag "basic"; protein_id "PA.1";
+chrA\tHAVANA\tgene\t40\t50\t.\t+\t.\tgene_id "GB.1"; gene_type "lincRNA";
+chrA\tHAVANA\ttranscript\t40\t50\t.\t+\t.\tgene_id "GB.1"; transcript_id "TB1.1"; gene_type "lincRNA"; tag "basic";
+chrB\tHAVANA\tgene\t40\t50\t.\t+\t.\tgene_id "GC.1"; gene_type "protein_coding";
+'''
+
+
+@mock.patch('pavooc.data.load_protein_mapping',
+            side_effect=mock_load_protein_mapping)
+def test_read_gencode_gtf(mocked_protein_mapping):
+    '''
+    read_gencode on a GTF file, through pavooc.gtf.read_gtf
+    '''
+    directory = tempfile.mkdtemp()
+    gtf_file = os.path.join(directory, 'gencode.gtf')
+    with open(gtf_file, 'w') as f:
+        f.write(GTF)
+
+    with mock.patch.dict('pavooc.data.GENCODE_FILES', {GENOME: gtf_file}), \
+            mock.patch('pavooc.snapshot.SNAPSHOT_DIR', directory):
+        data.read_gencode.cache_clear()
+        df = data.read_gencode()
+        data.read_gencode.cache_clear()
+
+    # the CDS row, the lincRNA gene and the chrB gene are filtered out
+    eq_(list(df.feature), ['gene', 'transcript', 'exon'])
+    eq_(set(df.gene_id), {'GA'})
+    eq_(list(df.exon_id), ['', '', 'EA1'])
+    eq_(list(df.start), [10, 10, 25])
+    eq_(df.tag.iloc[1], 'basic,appris_principal_1')
+    eq_(df.swissprot_id.iloc[1], 'SP1')
+
 
 # TODO test domain_interval_trees
+
+
+def test_select_best_transcripts():
+    df = pd.DataFrame({
+        'feature': ['gene', 'transcript', 'exon', 'transcript', 'exon',
+                    'gene', 'transcript', 'transcript'],
+        'gene_id': ['GA', 'GA', 'GA', 'GA', 'GA', 'GB', 'GB', 'GB'],
+        'transcript_id': ['GA', 'TA1', 'TA1', 'TA2', 'TA2',
+                          'GB', 'TB1', 'TB2'],
+        'tag': ['', 'basic,appris_candidate_longest', 'basic',
+                'basic,appris_principal_1', 'basic,appris_candidate',
+                '', 'basic', 'basic']},
+        index=[7, 6, 5, 4, 3, 2, 1, 0])
+    selected = data._select_best_transcripts(df)
+
+    # no exact appris_principal tag in GA. appris_candidate_longest wins
+    # and the first row containing it is TA1
+    eq_(list(selected.index), [7, 6, 5, 2, 1])
+    eq_(list(selected.transcript_id), ['GA', 'TA1', 'TA1', 'GB', 'TB1'])
+
+
+def test_compute_canonical_exons():
+    df = pd.DataFrame({
+        'feature': ['exon', 'exon', 'exon', 'UTR', 'UTR', 'UTR', 'exon'],
+        'gene_id': ['GA', 'GA', 'GA', 'GA', 'GA', 'GA', 'GB'],
+        'start': [0, 20, 50, 0, 5, 28, 0],
+        'end': [10, 30, 60, 5, 12, 30, 10],
+        'exon_number': [1, 2, 3, float('nan'), float('nan'), float('nan'), 1],
+        'exon_id': ['EA1', 'EA2', 'EA3', '', '', '', 'EB1']})
+    for column in ['seqname', 'strand', 'transcript_id', 'swissprot_id',
+                   'gene_name']:
+        df[column] = 'x'
+    exons = data.compute_canonical_exons(df)
+
+    # EA1 is completely covered by the adjacent UTRs. UTRs of GA don't
+    # affect GB
+    eq_(list(exons.exon_id), ['EA2', 'EA3', 'EB1'])
+    eq_(list(exons.start), [20, 50, 0])
+    eq_(list(exons.end), [28, 60, 10])
+
+
+def test_gene_index():
+    df = pd.DataFrame({
+        'gene_id': ['GB', 'GB', 'GA', 'GB'],
+        'gene_name': ['NB', 'NB', 'NA', 'NB'],
+        'strand': ['+', '+', '-', '+'],
+        'seqname': ['chrA', 'chrA', 'chrB', 'chrA'],
+        'start': [10, 5, 100, 30],
+        'end': [20, 8, 200, 40]})
+    genes = data.GeneIndex(df)
+
+    eq_(len(genes), 2)
+    eq_(list(genes.rows('GB').start), [10, 5, 30])
+    eq_(len(genes.rows('GX')), 0)
+    eq_(genes.name('GA'), 'NA')
+    eq_(genes.strand('GA'), '-')
+    eq_(genes.chromosome('GB'), 'chrA')
+    eq_(genes.bounds('GB'), (5, 40))
+    assert 'GA' in genes
+
+
+def test_gene_name_similarity():
+    names = pd.Series(['HBA1', 'HBA2', 'HBB', 'X', 'TP53'])
+    with mock.patch('pavooc.data.read_gencode',
+                    return_value=pd.DataFrame({'gene_name': names})):
+        stems = data.gene_name_stems.__wrapped__()
+    similar = data.GeneNameSimilarity(lambda name: name, stems)
+
+    assert similar('HBA1', 'HBA2')
+    assert similar('HBB', 'HBA1')  # 'HB' is contained in 'HBA1'
+    assert not similar('TP53', 'HBA1')
+    # single character names are similar to everything
+    assert similar('X', 'TP53')
+
+
+@mock.patch('pavooc.data.celllines', return_value=['C1', 'C2'])
+def test_cellline_mutation_trees(mocked_celllines):
+    maf = pd.DataFrame({
+        'Chromosome': ['A', 'A', 'B', 'A'],
+        'Start_position': [10, 20, 10, 12],
+        'End_position': [10, 22, 10, 12],
+        'Variant_Type': ['SNP', 'DEL', 'SNP', 'SNP'],
+        'Tumor_Sample_Barcode': ['C2', 'C1', 'C1', 'UNKNOWN']})
+    with mock.patch('pavooc.data.pd.read_csv', return_value=maf):
+        trees = data.cellline_mutation_trees.__wrapped__('hg19')
+
+    eq_(list(trees), ['chrA'])
+    eq_(len(trees['chrA']), 2)
+    eq_(data.decode_celllines(
+        [mutation[2]['cellline'] for mutation in trees['chrA'][0:15]]),
+        ['C2'])
+    eq_(list(data.encode_celllines(['C1', 'UNKNOWN', 'C2'])), [0, -1, 1])
+    # names (documents from before the id encoding) are passed through
+    eq_(data.decode_celllines([1, 'C1']), ['C2', 'C1'])
+
+
+def test_cellline_trees_without_ccle_data():
+    # without input files the snapshot would be saved, bypass it
+    with mock.patch('pavooc.data.pd.read_csv') as read_csv:
+        trees = data.cellline_mutation_trees.__wrapped__.__wrapped__('mm10')
+    read_csv.assert_not_called()
+    eq_(list(trees), ['chrA'])
+    eq_(sum(len(tree) for tree in trees.values()), 0)
+    eq_(trees['chrA'][0:100], [])
+
+
+def test_gene_cns_affection():
+    exons = pd.DataFrame({
+        'gene_id': ['GA', 'GA', 'GB', 'GC'],
+        'seqname': ['chrA', 'chrA', 'chrA', 'chrB'],
+        'start': [10, 50, 200, 10],
+        'end': [20, 60, 210, 20]})
+    trees = build_interval_indexes(
+        ['chrA'], ['chrA', 'chrA', 'chrA'], [30, 55, 100], [40, 300, 110],
+        records(cellline=np.array([1, 1, 2], dtype=np.int32)))
+    with mock.patch('pavooc.data.gencode_exons', return_value=exons), \
+            mock.patch('pavooc.data.cns_trees', return_value=trees):
+        table = data.gene_cns_affection.__wrapped__()
+
+    # both segments of cellline 1 overlap GA, it is listed once
+    eq_(list(zip(table.gene_id, table.cellline)), [('GA', 1), ('GB', 1)])
+
+
+def test_preloaded_pool():
+    calls = []
+
+    def loader():
+        calls.append(1)
+
+    with data.preloaded_pool([loader], processes=1) as pool:
+        assert gc.get_freeze_count() > 0
+        eq_(pool.map(abs, [-1, -2]), [1, 2])
+    eq_(calls, [1])
+    # objects created after the pool are collected normally again
+    eq_(gc.get_freeze_count(), 0)
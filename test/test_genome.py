@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+from nose.tools import eq_, raises
+import numpy as np
+
+from pavooc.genome import (PackedChromosome, extract_contexts, invalid_pams,
+                           write_packed_chromosome)
+
+SEQUENCE = 'NNNNacgtACGTTTGGCCnnAAAGTCAGTACGGCATNNNTGCAG'
+
+
+def _packed(sequence):
+    f = tempfile.NamedTemporaryFile(delete=False, suffix='.packed')
+    f.close()
+    write_packed_chromosome(f.name, sequence)
+    chromosome = PackedChromosome(f.name)
+    os.remove(f.name)  # the memory map stays valid
+    return chromosome
+
+
+def test_packed_roundtrip():
+    chromosome = _packed(SEQUENCE)
+    eq_(len(chromosome), len(SEQUENCE))
+    eq_(chromosome[:], SEQUENCE.upper())
+
+
+def test_packed_slicing():
+    chromosome = _packed(SEQUENCE)
+    for start in range(len(SEQUENCE)):
+        for end in range(start, len(SEQUENCE) + 3):
+            eq_(chromosome[start:end], SEQUENCE[start:end].upper())
+    eq_(chromosome[-5:], SEQUENCE[-5:].upper())
+    eq_(chromosome[5], SEQUENCE[5].upper())
+    eq_(chromosome[1:20:3], SEQUENCE[1:20:3].upper())
+
+
+def test_packed_gather():
+    chromosome = _packed(SEQUENCE)
+    positions = np.array([[-1, 0, 4, 5], [18, 19, 20, len(SEQUENCE)]])
+    eq_(chromosome.gather(positions).tolist(),
+        [[4, 4, 0, 1], [4, 4, 0, 4]])
+
+
+@raises(IndexError)
+def test_packed_index_out_of_range():
+    _packed(SEQUENCE)[len(SEQUENCE)]
+
+
+def test_extract_contexts():
+    # FWD target at 4, RVS target (CCN + protospacer) at 32
+    sequence = 'TTTT' + 'ACGTACGTACGTACGTACGT' + 'AGG' + 'TTTTT' + \
+        'CCA' + 'GCATGCATGCATGCATGCAT' + 'AAAAAA'
+    chromosome = _packed(sequence)
+    contexts = extract_contexts(
+        {'chrA': chromosome}, ['chrA', 'chrA', 'chrA'], [4, 32, 0],
+        ['FWD', 'RVS', 'FWD'])
+
+    eq_(contexts[0], sequence[:30])
+    reverse = sequence[29:59][::-1].translate(str.maketrans('ACGT', 'TGCA'))
+    eq_(contexts[1], reverse)
+    eq_(contexts[2][:4], 'NNNN')
+    eq_(invalid_pams(contexts).tolist(), [False, False, True])
@@ -0,0 +1,48 @@
+import gzip
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from pavooc.gtf import read_gtf
+
+GTF = '''##description: test
+chrA\tHAVANA\tgene\t11\t30\t.\t-\t.\tgene_id "GA.1"; gene_type "protein_coding"; gene_name "NA";
+chrA\tHAVANA\ttranscript\t11\t30\t.\t-\t.\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding"; tag "basic"; tag "appris_principal_1"; protein_id "PA.1";
+chrA\tHAVANA\texon\t26\t30\t.\t-\t.\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding"; exon_number 1; exon_id "EA1.1";
+chrA\tHAVANA\tCDS\t26\t30\t.\t-\t0\tgene_id "GA.1"; transcript_id "TA1.1"; gene_type "protein_coding";
+chrA\tHAVANA\tgene\t40\t50\t.\t+\t.\tgene_id "GB.1"; gene_type "lincRNA";
+chrB\tHAVANA\tgene\t40\t50\t.\t+\t.\tgene_id "GC.1"; gene_type "protein_coding";
+'''
+
+
+def _write(content, gzipped=False):
+    f = tempfile.NamedTemporaryFile(
+        delete=False, suffix='.gtf.gz' if gzipped else '.gtf')
+    f.close()
+    with (gzip.open(f.name, 'wt') if gzipped else open(f.name, 'w')) as out:
+        out.write(content)
+    return f.name
+
+
+def test_read_gtf_filters():
+    filename = _write(GTF)
+    df = read_gtf(filename, features=['gene', 'transcript', 'exon'],
+                  seqnames=['chrA'], gene_types=['protein_coding'])
+    os.remove(filename)
+
+    eq_(list(df.feature), ['gene', 'transcript', 'exon'])
+    eq_(list(df.start), [11, 11, 26])
+    eq_(df.tag[1], 'basic,appris_principal_1')
+    eq_(df.transcript_id[0], '')
+    eq_(df.exon_id[2], 'EA1.1')
+    eq_(df.exon_number[2], '1')
+
+
+def test_read_gtf_gzip():
+    filename = _write(GTF, gzipped=True)
+    df = read_gtf(filename)
+    os.remove(filename)
+    eq_(len(df), 6)
+    eq_(list(df.gene_type), ['protein_coding'] * 4 +
+        ['lincRNA', 'protein_coding'])
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import eq_
+import numpy as np
+
+from pavooc.intervals import IntervalIndex, build_interval_indexes, \
+    interval_snapshot, load_interval_indexes, records, save_interval_indexes
+
+
+def _brute_force(starts, ends, query_starts, query_ends):
+    return sorted((q, i)
+                  for q, (qs, qe) in enumerate(zip(query_starts, query_ends))
+                  for i, (s, e) in enumerate(zip(starts, ends))
+                  if s < qe and qs < e and e > s)
+
+
+def test_query_ranges_brute_force():
+    rng = np.random.RandomState(42)
+    starts = rng.randint(0, 1000, 300)
+    ends = starts + rng.randint(-5, 80, 300)
+    query_starts = rng.randint(0, 1100, 200)
+    query_ends = query_starts + rng.randint(1, 30, 200)
+
+    index = IntervalIndex(starts, ends, np.arange(len(starts)))
+    queries, found = index.query_ranges(query_starts, query_ends)
+    # map back to the original interval numbers through the payload
+    eq_(sorted(zip(queries.tolist(), index.data[found].tolist())),
+        _brute_force(starts, ends, query_starts, query_ends))
+
+
+def test_query_points():
+    index = IntervalIndex([0, 5, 8], [10, 6, 9])
+    queries, found = index.query_points([5, 6, 10, -1])
+    eq_(sorted(zip(queries.tolist(), index.starts[found].tolist())),
+        [(0, 0), (0, 5), (1, 0)])
+
+
+def test_getitem_records():
+    index = IntervalIndex([10, 20], [15, 30],
+                          records(gene_id=np.array(['A', 'B'], dtype=object),
+                                  exon_number=np.array(['1', '2'],
+                                                       dtype=object)))
+    eq_(index[5], [])
+    hit, = index[12]
+    eq_((hit.begin, hit.end), (10, 15))
+    eq_(hit[2][0], 'A')
+    eq_(hit.data['exon_number'], '1')
+    eq_(sorted(interval.data['gene_id'] for interval in index[14:21]),
+        ['A', 'B'])
+
+
+def test_build_interval_indexes():
+    indexes = build_interval_indexes(
+        ['chr1', 'chr2'], ['chr1', 'chr3', 'chr1'], [0, 0, 4], [3, 3, 4])
+    eq_(len(indexes['chr1']), 1)  # the empty interval is dropped
+    eq_(len(indexes['chr2']), 0)
+    eq_(indexes['chr2'][1], [])
+
+
+def test_save_load_interval_indexes():
+    directory = tempfile.mkdtemp()
+    indexes = build_interval_indexes(
+        ['chr1', 'chr2'], ['chr1', 'chr1', 'chr2'], [10, 0, 5], [20, 12, 6],
+        records(cellline=np.array([3, 4, 5], dtype=np.int32),
+                type=np.array(['SNP', 'DEL', 'INS'], dtype=object)))
+    save_interval_indexes(indexes, directory)
+    loaded = load_interval_indexes(directory)
+
+    eq_(list(loaded), ['chr1', 'chr2'])
+    assert isinstance(loaded['chr1'].starts, np.memmap)
+    eq_(sorted((interval.begin, interval.data['cellline'],
+                interval.data['type']) for interval in loaded['chr1'][11]),
+        [(0, 4, 'DEL'), (10, 3, 'SNP')])
+    eq_(loaded['chr2'][5][0][2][1], 'INS')
+
+
+def test_interval_snapshot_memory_mapped():
+    directory = tempfile.mkdtemp()
+    input_file = os.path.join(directory, 'input.bed')
+    with open(input_file, 'w') as f:
+        f.write('a')
+
+    @interval_snapshot('test_index', lambda: [input_file])
+    def indexes():
+        return build_interval_indexes(['chr1'], ['chr1'], [0], [3])
+
+    with mock.patch('pavooc.snapshot.SNAPSHOT_DIR', directory):
+        # already the first, computing call serves the snapshot
+        assert isinstance(indexes()['chr1'].starts, np.memmap)
+        eq_(len(indexes()['chr1'][1]), 1)
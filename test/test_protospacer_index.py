@@ -0,0 +1,27 @@
+from nose.tools import eq_
+import numpy as np
+
+from pavooc.protospacer_index import ProtospacerIndex
+from pavooc.util import kmer_to_int
+
+KMER_A = 'AACCTTGATCGTAGATCATG'
+KMER_B = 'TTTTTTTTTTTTTTTTTTTT'
+KMER_C = 'ACGTACGTACGTACGTACGT'
+
+
+def test_protospacer_index_occurrences():
+    a, b, c = [kmer_to_int(kmer) for kmer in (KMER_A, KMER_B, KMER_C)]
+    index = ProtospacerIndex.build([
+        np.array([b, a, b], dtype=np.uint64),
+        np.array([a, b], dtype=np.uint64)])
+
+    eq_(len(index), 2)
+    eq_(list(index.keys), sorted([a, b]))
+    eq_(list(index.occurrences(np.array([a, b, c], dtype=np.uint64))),
+        [2, 3, 0])
+    eq_(list(index.occurrences([KMER_C, KMER_B])), [0, 3])
+
+
+def test_protospacer_index_empty():
+    index = ProtospacerIndex.build([])
+    eq_(list(index.occurrences([KMER_A])), [0])
@@ -0,0 +1,28 @@
+from unittest import mock
+
+from nose.tools import eq_, raises
+import numpy as np
+
+from pavooc import registry
+from pavooc.util import memoize
+
+
+@memoize
+def _fake_exons(genome):
+    return np.zeros(10 if genome == 'hg19' else 20, dtype=np.uint8)
+
+
+@raises(ValueError)
+def test_unsupported_genome():
+    registry.genome_assets('hg00')
+
+
+def test_genomes_side_by_side():
+    with mock.patch.dict(registry.ASSET_LOADERS, {'exons': _fake_exons},
+                         clear=True):
+        eq_(len(registry.genome_assets('hg19').exons), 10)
+        eq_(len(registry.genome_assets('mm10').exons), 20)
+        usage = registry.memory_usage()
+    eq_(usage['hg19'], {'exons': 10})
+    eq_(usage['mm10'], {'exons': 20})
+    _fake_exons.cache_clear()
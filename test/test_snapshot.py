@@ -0,0 +1,106 @@
+import os
+import tempfile
+from unittest import mock
+
+from nose.tools import eq_
+import numpy as np
+import pandas as pd
+
+from pavooc import snapshot
+
+
+def _frame():
+    df = pd.DataFrame({
+        'gene_id': ['GA', 'GA', 'GB'],
+        'start': [4, 10, 20],
+        'exon_number': [1.0, np.nan, 1.0],
+        'swissprot_id': ['SP1', np.nan, 'SP2']},
+        index=pd.Index(['EA1', 'EA2', 'EB1'], name='exon_id'))
+    return df
+
+
+def test_save_load_frame():
+    directory = tempfile.mkdtemp()
+    snapshot.save_frame(_frame(), directory)
+    df = snapshot.load_frame(directory)
+
+    eq_(list(df.columns), list(_frame().columns))
+    eq_(df.index.name, 'exon_id')
+    eq_(list(df.index), ['EA1', 'EA2', 'EB1'])
+    eq_(list(df.start), [4, 10, 20])
+    assert pd.isna(df.swissprot_id.iloc[1])
+    assert pd.isna(df.exon_number.iloc[1])
+    eq_(df.swissprot_id.iloc[2], 'SP2')
+
+
+def test_snapshot_recomputes_on_change():
+    directory = tempfile.mkdtemp()
+    input_file = os.path.join(directory, 'input.gtf')
+    with open(input_file, 'w') as f:
+        f.write('a')
+    calls = []
+
+    @snapshot.snapshot('test', lambda: [input_file])
+    def compute():
+        calls.append(1)
+        return _frame()
+
+    with mock.patch('pavooc.snapshot.SNAPSHOT_DIR', directory):
+        compute()
+        df = compute()
+        eq_(len(calls), 1)
+        eq_(list(df.gene_id), ['GA', 'GA', 'GB'])
+
+        with open(input_file, 'w') as f:
+            f.write('changed')
+        compute()
+        eq_(len(calls), 2)
+        # the stale snapshot is removed
+        eq_(len([d for d in os.listdir(directory)
+                 if d.startswith('test_')]), 1)
+
+
+def test_snapshot_per_arguments():
+    directory = tempfile.mkdtemp()
+    input_file = os.path.join(directory, 'input.gtf')
+    with open(input_file, 'w') as f:
+        f.write('a')
+    calls = []
+
+    @snapshot.snapshot('demo', lambda genome='hg19': [input_file])
+    def demo(genome='hg19'):
+        calls.append(genome)
+        return _frame()
+
+    with mock.patch('pavooc.snapshot.SNAPSHOT_DIR', directory):
+        demo()
+        demo('hg19')
+        demo()
+        demo(genome='hg19')
+        demo('mm10')
+        demo('hg19')
+        demo('mm10')
+        # defaults are bound, other arguments don't evict each other
+        eq_(calls, ['hg19', 'mm10'])
+        eq_(len([d for d in os.listdir(directory)
+                 if d.startswith('demo_')]), 2)
+
+
+def test_snapshot_version():
+    directory = tempfile.mkdtemp()
+    input_file = os.path.join(directory, 'input.gtf')
+    with open(input_file, 'w') as f:
+        f.write('a')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return _frame()
+
+    with mock.patch('pavooc.snapshot.SNAPSHOT_DIR', directory):
+        snapshot.snapshot('test', lambda: [input_file])(compute)()
+        snapshot.snapshot('test', lambda: [input_file])(compute)()
+        eq_(len(calls), 1)
+        # a changed computation with unchanged inputs is recomputed
+        snapshot.snapshot('test', lambda: [input_file], version=2)(compute)()
+        eq_(len(calls), 2)
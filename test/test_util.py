@@ -1,7 +1,13 @@
-# from unittest import mock
+import threading
+import time
+from unittest import mock
 # from test.helpers import mock_read_gtf_as_dataframe
 from nose.tools import raises, eq_
-from pavooc.util import int_to_kmer, kmer_to_int, normalize_pid
+import numpy as np
+
+from pavooc import util
+from pavooc.util import (int_to_kmer, ints_to_kmers, kmer_to_int,
+                         kmers_to_ints, memoize, normalize_pid)
 
 
 @raises(ValueError)
@@ -20,3 +26,108 @@ def test_normalize_pid():
     eq_(normalize_pid('ABC'), 'ABC')
     eq_(normalize_pid('ABC-'), 'ABC')
 
+
+
+def test_kmers_to_ints():
+    kmers = ['AACCTTGATCGTAGATCATG', 'TTTTTTTTTTTTTTTTTTTT']
+    values = kmers_to_ints(kmers)
+    eq_(values.dtype, np.uint64)
+    eq_(list(values), [kmer_to_int(kmer) for kmer in kmers])
+    eq_([kmer.decode() for kmer in ints_to_kmers(values)], kmers)
+
+
+def test_kmers_to_ints_k32():
+    kmer = 'TGCATGCATGCATGCATGCATGCATGCATGCA'
+    values = kmers_to_ints([kmer, kmer.encode()], k=32)
+    eq_(list(ints_to_kmers(values, k=32)), [kmer.encode()] * 2)
+    eq_(int(values[0]), kmer_to_int(kmer, k=32))
+
+
+def test_kmers_to_ints_n_bases():
+    values, valid = kmers_to_ints(['ACGN', 'ACGT'], k=4, return_valid=True)
+    eq_(list(valid), [False, True])
+    eq_(int(values[1]), kmer_to_int('ACGT', k=4))
+
+
+@raises(ValueError)
+def test_kmers_to_ints_n_bases_raise():
+    kmers_to_ints(['ACGN'], k=4)
+
+
+@raises(ValueError)
+def test_kmers_to_ints_bad_length():
+    kmers_to_ints(['ACGTA', 'ACGT'], k=4)
+
+
+def test_memoize_keys_on_arguments():
+    calls = []
+
+    @memoize
+    def load(genome='mm10', nopos=False):
+        calls.append((genome, nopos))
+        return genome, nopos
+
+    eq_(load(), ('mm10', False))
+    eq_(load('mm10'), ('mm10', False))
+    eq_(load(genome='mm10', nopos=False), ('mm10', False))
+    eq_(load('hg19'), ('hg19', False))
+    eq_(load(nopos=True), ('mm10', True))
+    eq_(len(calls), 3)
+    info = load.cache_info()
+    eq_((info.hits, info.misses, info.entries), (2, 3, 3))
+
+    load.cache_clear()
+    load()
+    eq_(len(calls), 4)
+
+
+def test_memoize_single_flight():
+    calls = []
+
+    @memoize
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return 1
+
+    threads = [threading.Thread(target=slow) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    eq_(len(calls), 1)
+
+
+def test_memoize_memory_budget():
+    @memoize
+    def array(n):
+        return np.zeros(n, dtype=np.uint8)
+
+    with mock.patch('pavooc.util.CACHE_MEMORY_BUDGET', 250):
+        array(100)
+        array(101)
+        array(100)  # makes 101 the least recently used
+        array(102)
+    eq_(array.cache_info().entries, 2)
+    eq_(sorted(key[0][1] for key in array.cache), [100, 102])
+    array.cache_clear()
+
+
+def test_memoize_hit_does_not_hold_function_lock():
+    @memoize
+    def value():
+        return 1
+
+    value()
+    # an eviction holds the cache lock and then takes the function lock. A
+    # concurrent hit must not hold the function lock while waiting for the
+    # cache lock
+    with util._cache_lock:
+        thread = threading.Thread(target=value, daemon=True)
+        thread.start()
+        time.sleep(0.05)
+        assert value._lock.acquire(timeout=1)
+        value._lock.release()
+    thread.join(1)
+    assert not thread.is_alive()
+    value.cache_clear()
@@ -58,17 +58,20 @@ export interface FetchEdit {
   type: typeof t.FETCH_EDIT;
   geneId: string;
   editPosition: number;
+  genome: string;
   padding: number;
 }
 
 export const fetchEdit = (
   geneId: string,
   editPosition: number,
+  genome: string,
   padding: number
 ): FetchEdit => ({
   type: t.FETCH_EDIT,
   geneId,
   editPosition,
+  genome,
   padding
 });
 
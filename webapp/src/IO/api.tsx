@@ -10,7 +10,13 @@ function handleFetchErrors(response: Response) {
 export const fetchKnockoutsApi = (geneIds: Array<string>, edit: boolean, genome: string) => {
   const request = fetch("/api/knockout", {
     method: "POST",
-    body: JSON.stringify({ gene_ids: geneIds, edit: edit, genome: genome })
+    // cellline ids are expanded to names by the reducer
+    body: JSON.stringify({
+      gene_ids: geneIds,
+      edit: edit,
+      genome: genome,
+      expand_mutations: false
+    })
   })
     .then(handleFetchErrors)
     .then(response => response.json());
@@ -55,6 +61,7 @@ export const fetchDetailsApi = (
 export const fetchEditApi = (
   geneId: string,
   editPosition: number,
+  genome: string,
   padding: number = 400
 ) => {
   const request = fetch("/api/edit", {
@@ -62,6 +69,7 @@ export const fetchEditApi = (
     body: JSON.stringify({
       gene_id: geneId,
       edit_position: editPosition,
+      genome: genome,
       padding: padding
     })
   })
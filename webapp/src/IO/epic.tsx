@@ -27,7 +27,8 @@ import { fetchDetailsApi, fetchKnockoutsApi, fetchInitialApi, fetchEditApi } fro
 
 const fetchEditEpic = (action$: any) =>
   action$.ofType(FETCH_EDIT).mergeMap((action: FetchEdit) =>
-    fetchEditApi(action.geneId, action.editPosition, action.padding)
+    fetchEditApi(action.geneId, action.editPosition, action.genome,
+                 action.padding)
       .map(fetchEditSuccess)
       .catch((error: string) => Observable.of(fetchEditFailure(error)))
   );
@@ -1,6 +1,6 @@
 import * as t from "./actionTypes";
 
-import { guidesWithDomains, groupBy } from "../util/functions";
+import { expandCelllines, guidesWithDomains, groupBy } from "../util/functions";
 
 export type State = {
   readonly isFetching: boolean;
@@ -51,7 +51,8 @@ export default (state: State = INITIAL_STATE, action: any) => {
         ...state,
         isFetching: false,
         error: undefined,
-        knockoutData: action.data.map((gene: any) => {
+        knockoutData: action.data.map((fetchedGene: any) => {
+          const gene = expandCelllines(fetchedGene, state.celllines);
           if (action.edit) {
             return {
               ...gene,
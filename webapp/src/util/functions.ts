@@ -127,6 +127,21 @@ export const guidesWithDomains = (geneData: any) => {
   }));
 };
 
+// /api/knockout returns cellline ids (indices into the celllines of
+// /api/initial) for the cns and mutations of genes
+export const expandCelllines = (geneData: any, celllines: Array<string>) => {
+  const names = (ids: Array<number> | undefined) =>
+    ids && ids.map((id: number) => celllines[id]);
+  return {
+    ...geneData,
+    cns: names(geneData.cns),
+    guides: geneData.guides.map((guide: any) => ({
+      ...guide,
+      mutations: names(guide.mutations)
+    }))
+  };
+};
+
 export const reverseComplement = (sequence: string) => {
   const dict = new Map([["A", "T"], ["T", "A"], ["C", "G"], ["G", "C"]]);
   let outSeq = [];